@@ -1,10 +1,12 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import Field
+from pydantic import Field, model_validator
 from typing import Optional
 
 
 class DatabaseSettings(BaseSettings):
     """Database configuration settings"""
+    backend: str = Field(default="dynamodb", description="Storage backend (dynamodb or memory)")
+    memory_latency_ms: float = Field(default=0, description="Delay added to every call of the memory backend")
     aws_region: str = Field(default="us-west-2", description="AWS Region")
     dynamodb_endpoint: Optional[str] = Field(default="http://localhost:8000", description="DynamoDB endpoint URL")
     main_table_name: str = Field(default="crm_data", description="Main DynamoDB table name")
@@ -25,13 +27,24 @@ class DatabaseSettings(BaseSettings):
 
 class OpenSearchSettings(BaseSettings):
     """OpenSearch configuration settings"""
-    mode: str = Field(default="local", description="OpenSearch mode (local or cloud)")
+    mode: str = Field(default="local", description="OpenSearch mode (local, cloud or memory)")
+    memory_latency_ms: float = Field(default=0, description="Delay added to every call of the memory backend")
     endpoint: Optional[str] = Field(default="http://localhost:9200", description="OpenSearch endpoint URL")
     host: Optional[str] = Field(default=None, description="OpenSearch host for cloud mode")
     username: str = Field(default="admin", description="OpenSearch username")
     password: str = Field(default="aStrongPassw0rd!", description="OpenSearch password")
     use_ssl: bool = Field(default=False, description="Whether to use SSL")
     verify_certs: bool = Field(default=False, description="Whether to verify certificates")
+    search_timeout: float = Field(default=2.0, description="Seconds a user search may take before it falls back to DynamoDB")
+    fallback: bool = Field(default=True, description="Answer user searches from the DynamoDB GSIs while OpenSearch is unavailable")
+    timeout: float = Field(default=10.0, description="Client timeout in seconds of calls without their own")
+    max_retries: int = Field(default=1, description="Client retries of a failed connection")
+    write_timeout: float = Field(default=1.0, description="Seconds an index update from a write path may take")
+    request_budget: float = Field(default=3.0, description="Seconds all OpenSearch calls of one request may take together")
+    breaker_failures: int = Field(default=5, description="Consecutive failures that open the circuit breaker")
+    breaker_reset_seconds: float = Field(default=30.0, description="Seconds the breaker stays open before a probe call")
+    replay_seconds: float = Field(default=10.0, description="Interval of the replay of index updates queued while OpenSearch was unavailable")
+    replay_lease_seconds: int = Field(default=60, description="Seconds one worker holds the replay lease without renewing it")
     
     model_config = SettingsConfigDict(
         env_prefix="OPENSEARCH_",
@@ -50,6 +63,20 @@ class AppSettings(BaseSettings):
     api_host: str = Field(default="0.0.0.0", description="API host")
     log_level: str = Field(default="INFO", description="Logging level")
     production: bool = Field(default=False, description="Production mode")
+    workers: int = Field(default=0, description="Server worker processes, 0 for one per available CPU")
+    loop: str = Field(default="uvloop", description="Event loop implementation (uvloop, asyncio or auto)")
+    http: str = Field(default="httptools", description="HTTP parser implementation (httptools, h11 or auto)")
+    backlog: int = Field(default=2048, description="Maximum number of pending connections")
+    keep_alive_timeout: int = Field(default=75, description="Seconds idle keep-alive connections stay open, above the load balancer's idle timeout")
+    graceful_shutdown_timeout: int = Field(default=25, description="Seconds in-flight requests get to finish on shutdown, below the ECS stop timeout")
+    limit_concurrency: Optional[int] = Field(default=None, description="Concurrent connections per worker before 503s")
+    warmup_retry_seconds: float = Field(default=5.0, description="First delay before failed startup warm-up phases are retried, doubled on each retry")
+    threadpool_size: Optional[int] = Field(default=None, description="Threads for blocking calls per worker, defaults to anyio's 40")
+    forwarded_allow_ips: str = Field(default="127.0.0.1", description="Comma-separated IPs or CIDRs of the proxies whose X-Forwarded-* headers are trusted")
+    idempotency_ttl_hours: int = Field(default=24, description="How long Idempotency-Key responses are kept")
+    idempotency_lock_seconds: int = Field(default=60, description="How long an unfinished Idempotency-Key blocks retries")
+    coalesce_reads: bool = Field(default=True, description="Share one backend call between identical concurrent reads")
+    idempotency_cache_size: int = Field(default=10000, description="Completed Idempotency-Key responses cached per process")
 
     model_config = SettingsConfigDict(
         env_prefix="APP_",
@@ -79,12 +106,102 @@ class AuthSettings(BaseSettings):
     )
 
 
+class EmailSettings(BaseSettings):
+    """Email delivery settings"""
+    provider: str = Field(default="mock", description="Delivery provider (mock, smtp or api)")
+    from_address: str = Field(default="no-reply@emcrm.local", description="Sender address")
+    smtp_host: str = Field(default="localhost", description="SMTP server host")
+    smtp_port: int = Field(default=25, description="SMTP server port")
+    smtp_username: Optional[str] = Field(default=None, description="SMTP username")
+    smtp_password: Optional[str] = Field(default=None, description="SMTP password")
+    smtp_starttls: bool = Field(default=False, description="Upgrade SMTP connections with STARTTLS")
+    smtp_timeout: int = Field(default=10, description="SMTP socket timeout in seconds")
+    api_url: Optional[str] = Field(default=None, description="HTTP endpoint of the api provider")
+    api_key: Optional[str] = Field(default=None, description="Bearer token of the api provider")
+    api_batch_size: int = Field(default=100, description="Recipients per api provider request")
+    pool_size: int = Field(default=8, description="Pooled provider connections, also the number of concurrent senders")
+    chunk_size: int = Field(default=100, description="Recipients handed to a sender at a time")
+    rate_per_second: float = Field(default=50, description="Sustained messages per second per provider")
+    burst: int = Field(default=100, description="Messages that may be sent at once before the rate applies")
+    max_retries: int = Field(default=3, description="Retries of a transient delivery failure")
+    retry_backoff_seconds: float = Field(default=0.5, description="First retry delay, doubled on each retry")
+    log_format: str = Field(default="items", description="Delivery log storage (items or compact)")
+    log_chunk_size: int = Field(default=5000, description="Recipients per compressed log chunk in compact format")
+    segment_buckets: int = Field(default=64, description="Membership items of a new saved segment, ~10k members fit in one")
+
+    model_config = SettingsConfigDict(
+        env_prefix="EMAIL_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_ignore_empty=True,
+        extra='ignore'
+    )
+
+
+class RetentionSettings(BaseSettings):
+    """Retention and archival of log-like records"""
+    email_log_days: int = Field(default=0, description="Days email delivery logs are kept, 0 keeps them forever")
+    attendance_days: int = Field(default=0, description="Days attendance records are kept, 0 keeps them forever")
+    archive_format: str = Field(default="ndjson", description="Archive file format (ndjson or parquet)")
+    archive_target: str = Field(default="archive", description="Local directory or s3://bucket/prefix for archives")
+    archive_lead_days: int = Field(default=3, description="Archive records this many days before they expire")
+
+    @model_validator(mode="after")
+    def check_lead_days(self):
+        for days in (self.email_log_days, self.attendance_days):
+            if days and self.archive_lead_days >= days:
+                raise ValueError("RETENTION_ARCHIVE_LEAD_DAYS must be less than every retention period")
+        return self
+
+    model_config = SettingsConfigDict(
+        env_prefix="RETENTION_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_ignore_empty=True,
+        extra='ignore'
+    )
+
+
+class AnalyticsSettings(BaseSettings):
+    """In-memory analytics snapshot"""
+    refresh_seconds: int = Field(default=30, description="Age after which a query first applies the change log")
+    rebuild_seconds: int = Field(default=3600, description="Age after which the snapshot is rebuilt from a full scan")
+    scan_segments: int = Field(default=8, description="Parallel scan workers of a full build")
+    full_rebuild_ratio: float = Field(default=0.05, description="Share of changed users above which a refresh rebuilds instead")
+
+    model_config = SettingsConfigDict(
+        env_prefix="ANALYTICS_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_ignore_empty=True,
+        extra='ignore'
+    )
+
+
+class RecommendationSettings(BaseSettings):
+    """Co-attendance recommendations"""
+    neighbours: int = Field(default=50, description="Neighbours kept per event and per user")
+    fanout: int = Field(default=20, description="Earlier attendances paired with a new one, per side")
+
+    model_config = SettingsConfigDict(
+        env_prefix="RECOMMEND_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        env_ignore_empty=True,
+        extra='ignore'
+    )
+
+
 class Settings(BaseSettings):
     """Main settings class that combines all settings"""
     database: DatabaseSettings = Field(default_factory=DatabaseSettings)
     opensearch: OpenSearchSettings = Field(default_factory=OpenSearchSettings)
     app: AppSettings = Field(default_factory=AppSettings)
     auth: AuthSettings = Field(default_factory=AuthSettings)
+    email: EmailSettings = Field(default_factory=EmailSettings)
+    retention: RetentionSettings = Field(default_factory=RetentionSettings)
+    analytics: AnalyticsSettings = Field(default_factory=AnalyticsSettings)
+    recommend: RecommendationSettings = Field(default_factory=RecommendationSettings)
     
     
     model_config = SettingsConfigDict(
@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import logging
+import anyio.to_thread
 
-from app.services.db.init import create_tables
-from app.routes import users, events, email, attendance, health, query_users
+from app.services import startup
+from app.services.startup import warm_up
+from app.services.opensearch.sync import replay_loop
+from app.routes import users, events, email, attendance, health, query_users, jobs, segments, analytics, recommendations
 from fastapi_pagination import Page, add_pagination, paginate
 from fastapi_pagination.utils import disable_installed_extensions_check
 from app.config import settings
@@ -12,6 +16,7 @@ from app.config import settings
 # Conditional imports for authentication
 # if settings.auth.enabled:
 from app.middleware.auth import AuthMiddleware
+from app.middleware.deadline import DeadlineMiddleware
 from app.routes import auth
 
 # Configure logging
@@ -27,15 +32,25 @@ disable_installed_extensions_check()
 async def lifespan(app: FastAPI):
     # Startup logic
     logger.info("Starting application...")
+    # Blocking boto3/OpenSearch calls and the other threadpool work share this
+    # pool, so it is sized on its own rather than to one client's connections
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    if settings.app.threadpool_size:
+        limiter.total_tokens = settings.app.threadpool_size
+    logger.info(f"Threadpool size: {limiter.total_tokens}")
     if settings.auth.enabled:
         logger.info("Authentication enabled")
     else:
         logger.info("Authentication disabled - development mode")
-    if not settings.app.production:
-        create_tables()
+    await warm_up()
+    replayer = asyncio.create_task(replay_loop())
     yield
     # Shutdown logic
     logger.info("Shutting down...")
+    for task in filter(None, (replayer, startup.state.retrier)):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
 
 
 app = FastAPI(
@@ -59,6 +74,9 @@ if settings.auth.enabled:
     # Add authentication middleware
     app.add_middleware(AuthMiddleware)
 
+# Outermost, so the budget also covers the time spent in other middleware
+app.add_middleware(DeadlineMiddleware)
+
 add_pagination(app)
 
 # Include authentication routes when enabled
@@ -71,4 +89,8 @@ app.include_router(events.router, prefix="/events", tags=["Events"])
 app.include_router(attendance.router, prefix="/attend", tags=["Attendance"])
 app.include_router(query_users.router, prefix="/search", tags=["Search"])
 app.include_router(email.router, prefix="/email", tags=["Email"])
+app.include_router(segments.router, prefix="/segments", tags=["Segments"])
+app.include_router(analytics.router, prefix="/analytics", tags=["Analytics"])
+app.include_router(recommendations.router, prefix="/recommendations", tags=["Recommendations"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 app.include_router(health.router)
\ No newline at end of file
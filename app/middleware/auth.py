@@ -1,6 +1,7 @@
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import run_in_threadpool
 import jwt
 from jwt import PyJWKClient
 import requests
@@ -11,6 +12,19 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+JWKS_URL = f"https://cognito-idp.{settings.auth.cognito_region}.amazonaws.com/{settings.auth.cognito_user_pool_id}/.well-known/jwks.json"
+
+_jwks_cache: Optional[dict] = None
+
+def get_jwks() -> dict:
+    """Cognito signing keys, fetched once per process (prefetched at startup)"""
+    global _jwks_cache
+    if _jwks_cache is None:
+        response = requests.get(JWKS_URL, timeout=10)
+        response.raise_for_status()
+        _jwks_cache = response.json()
+    return _jwks_cache
+
 class AuthMiddleware(BaseHTTPMiddleware):
     """Authentication middleware for JWT token validation"""
     
@@ -29,8 +43,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             "/auth/session",
             "/auth/token"
         }
-        self.jwks_cache = None
-        self.jwks_url = f"https://cognito-idp.{settings.auth.cognito_region}.amazonaws.com/{settings.auth.cognito_user_pool_id}/.well-known/jwks.json"
+        self.jwks_url = JWKS_URL
         # Cookie session support
         self.secret_key = settings.auth.cognito_client_secret or "dev-secret-key-for-testing"
         self.serializer = URLSafeTimedSerializer(self.secret_key)
@@ -87,19 +100,15 @@ class AuthMiddleware(BaseHTTPMiddleware):
     async def validate_token(self, token: str) -> Optional[dict]:
         """Validate JWT token against Cognito"""
         try:
-            # Get JWKS if not cached
-            if not self.jwks_cache:
-                response = requests.get(self.jwks_url)
-                response.raise_for_status()
-                self.jwks_cache = response.json()
-            
+            jwks = await run_in_threadpool(get_jwks)
+
             # Decode token header to get key ID
             unverified_header = jwt.get_unverified_header(token)
             kid = unverified_header.get('kid')
             
             # Find the correct key
             key = None
-            for jwk in self.jwks_cache['keys']:
+            for jwk in jwks['keys']:
                 if jwk['kid'] == kid:
                     # Use PyJWKClient to handle the key conversion
                     from jwt.algorithms import RSAAlgorithm
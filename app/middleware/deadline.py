@@ -0,0 +1,18 @@
+from app.config import settings
+from app.services import deadline
+
+
+class DeadlineMiddleware:
+    """Start the request's time budget (see app.services.deadline)
+
+    A plain ASGI middleware: the context variable it sets is seen by the
+    route, its threadpool calls and the background tasks run after it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            deadline.start(settings.opensearch.request_budget)
+        await self.app(scope, receive, send)
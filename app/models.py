@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, Field, conint, field_validator, StringConstraints, PastDatetime, ConfigDict
-from typing import Annotated, List, Optional
+from pydantic import BaseModel, EmailStr, Field, conint, field_validator, model_validator, StringConstraints, PastDatetime, ConfigDict
+from typing import Annotated, Dict, List, Optional
 from datetime import datetime
 from uuid import uuid4
 from enum import Enum
@@ -38,6 +38,12 @@ class EmailStatusEnum(str, Enum):
     sending = "sending"
     sent = "sent"
 
+class JobStatusEnum(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    error = "error"
+
 class User(AppBaseModel):
     id: IdStr
     firstName: Str50
@@ -68,12 +74,45 @@ class User(AppBaseModel):
             "company": self.company,
             "city": self.city,
             "state": self.state,
+            # CityStateIndex key
+            "city_state": f"{self.city}#{self.state}" if self.city and self.state else None,
             "attendedCount": self.attendedCount,
             "hostedCount": self.hostedCount,
         })
     def to_opensearch_doc(self):
         return self.model_dump(exclude_none=True)
 
+    @classmethod
+    def from_dynamodb_item(cls, item: dict) -> "User":
+        return cls(**{
+            "id": item["PK"].split("#", 1)[1],
+            "firstName": item["firstName"],
+            "lastName": item["lastName"],
+            "email": item["email"],
+            "phoneNumber": item.get("phoneNumber"),
+            "avatar": item.get("avatar"),
+            "gender": item.get("gender"),
+            "jobTitle": item.get("jobTitle"),
+            "company": item.get("company"),
+            "city": item.get("city"),
+            "state": item.get("state"),
+            "attendedCount": item.get("attendedCount", 0),
+            "hostedCount": item.get("hostedCount", 0),
+        })
+
+class UserPatch(AppBaseModel):
+    """Fields a client may change on an existing user; counters are server-maintained"""
+    firstName: Optional[Str50] = None
+    lastName: Optional[Str50] = None
+    email: Optional[EmailStr] = None
+    phoneNumber: Optional[Annotated[str, StringConstraints(min_length=7, max_length=20)]] = None
+    avatar: Optional[str] = None
+    gender: Optional[GenderEnum] = None
+    jobTitle: Optional[Str50] = None
+    company: Optional[Str50] = None
+    city: Optional[Str50] = None
+    state: Optional[Str50] = None
+
 class Event(AppBaseModel):
     id: IdStr
     slug: SlugStr
@@ -107,6 +146,8 @@ class Event(AppBaseModel):
             "owner": self.owner,
             "hosts": self.hosts,
         })
+    def to_opensearch_doc(self):
+        return self.model_dump(mode="json", exclude_none=True)
 
 class EventAttendance(AppBaseModel):
     user_id: Str50
@@ -122,8 +163,21 @@ class EventAttendance(AppBaseModel):
                 "type": "attendance",
                 "attended": self.attended,
                 "createdAt": iso_time,
+                # Range key of EventAttendeesIndex and UserAttendanceIndex
+                "attendedAt": iso_time,
             }
 
+class ExpandedEventAttendance(EventAttendance):
+    user: Optional[User] = None
+    event: Optional[Event] = None
+
+class BulkAttendanceRequest(AppBaseModel):
+    items: Annotated[List[EventAttendance], Field(min_length=1, max_length=1000)]
+
+class BatchGetRequest(AppBaseModel):
+    ids: Annotated[List[Str50], Field(min_length=1, max_length=500)]
+    fields: Optional[List[str]] = None
+
 class UserFilter(AppBaseModel):
     company: Optional[str] = None
     jobTitle: Optional[str] = None
@@ -154,25 +208,87 @@ class UserFilter(AppBaseModel):
 
 class EmailRequest(AppBaseModel):
     email_id: IdStr
-    filter: UserFilter #for storage purpose
+    filter: Optional[UserFilter] = None #for storage purpose
+    segment_id: Optional[Str50] = None
     createdAt: datetime = Field(default_factory=datetime.now)
     totalRecipients: Optional[NonNegativeInt] = 0 #for storage purpose
     status: Optional[EmailStatusEnum] = EmailStatusEnum.sent
     subject: Str50
     body: Str1000
+    statusCounts: Optional[Dict[EmailStatusEnum, NonNegativeInt]] = None #for storage purpose
+    job_id: Optional[Str50] = None # delivery job, poll GET /jobs/{job_id}
+
+    @model_validator(mode="after")
+    def validate_audience(self):
+        if self.filter is None and self.segment_id is None:
+            raise ValueError("Either filter or segment_id is required")
+        return self
+
     def to_dynamodb_item(self) -> dict:
         iso_time = self.createdAt.isoformat()
-        return {
+        return clean_dynamodb_item({
                 "PK": f"email#{self.email_id}",
                 "SK": f"email#{self.email_id}",
                 "type": "email_request",
-                "filter": self.filter.model_dump(exclude_none=True),
+                "filter": self.filter.model_dump(exclude_none=True) if self.filter else None,
+                "segment_id": self.segment_id,
                 "createdAt": iso_time,
                 "status": self.status,
                 "totalRecipients": self.totalRecipients,
                 "subject": self.subject,
-                "body": self.body
-            }
+                "body": self.body,
+                "job_id": self.job_id,
+                # One counter attribute per status, adjusted atomically as log statuses change
+                **{status_count_attribute(status): (self.statusCounts or {}).get(status, 0)
+                   for status in EmailStatusEnum},
+            })
+
+def status_count_attribute(status: EmailStatusEnum) -> str:
+    return f"{EmailStatusEnum(status).value}Count"
+
+class EmailSummary(AppBaseModel):
+    email_id: Str50
+    status: Optional[EmailStatusEnum] = None
+    totalRecipients: NonNegativeInt = 0
+    statusCounts: Dict[EmailStatusEnum, int]
+
+class SegmentStatusEnum(str, Enum):
+    building = "building"
+    ready = "ready"
+
+class Segment(AppBaseModel):
+    segment_id: IdStr
+    name: Str50
+    filter: UserFilter
+    status: SegmentStatusEnum = SegmentStatusEnum.building
+    memberCount: NonNegativeInt = 0
+    buckets: Annotated[int, Field(ge=1, le=4096)] = 64
+    createdAt: datetime = Field(default_factory=datetime.now)
+    builtAt: Optional[datetime] = None
+    def to_dynamodb_item(self) -> dict:
+        return clean_dynamodb_item({
+            "PK": f"segment#{self.segment_id}",
+            "SK": f"segment#{self.segment_id}",
+            "type": "segment",
+            "name": self.name,
+            "filter": self.filter.model_dump(exclude_none=True),
+            "status": self.status.value,
+            "memberCount": self.memberCount,
+            "buckets": self.buckets,
+            "createdAt": self.createdAt.isoformat(),
+            "builtAt": self.builtAt.isoformat() if self.builtAt else None,
+        })
+
+class SegmentCreate(AppBaseModel):
+    name: Str50
+    filter: UserFilter
+
+class SegmentMember(AppBaseModel):
+    id: Str50
+    email: EmailStr
+
+class EmailStatusUpdate(AppBaseModel):
+    status: EmailStatusEnum
 
 class Email(AppBaseModel):
     email_id: Str50
@@ -181,10 +297,38 @@ class Email(AppBaseModel):
     createdAt: datetime = Field(default_factory=datetime.now)
     def to_dynamodb_item(self) -> dict:
         iso_time = self.createdAt.isoformat()
-        return {
+        return clean_dynamodb_item({
                 "PK": f"req_email#{self.email_id}",
                 "SK": f"user#{self.user_id}",
                 "type": "email_log",
                 "status": self.status,
+                # StatusIndex key, lists one campaign's recipients with one status
+                "campaignStatus": f"{self.email_id}#{EmailStatusEnum(self.status).value}" if self.status else None,
                 "createdAt": iso_time,
-            }
\ No newline at end of file
+            })
+
+class Job(AppBaseModel):
+    id: IdStr
+    kind: Str50
+    target: Str50
+    status: JobStatusEnum = JobStatusEnum.pending
+    total: Optional[NonNegativeInt] = None
+    processed: NonNegativeInt = 0
+    error: Optional[str] = None
+    createdAt: datetime = Field(default_factory=datetime.now)
+    updatedAt: datetime = Field(default_factory=datetime.now)
+
+    def to_dynamodb_item(self) -> dict:
+        return clean_dynamodb_item({
+            "PK": f"job#{self.id}",
+            "SK": f"job#{self.id}",
+            "type": "job",
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status.value,
+            "total": self.total,
+            "processed": self.processed,
+            "error": self.error,
+            "createdAt": self.createdAt.isoformat(),
+            "updatedAt": self.updatedAt.isoformat(),
+        })
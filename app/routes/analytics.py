@@ -0,0 +1,95 @@
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from app.services.analytics import SnapshotUnavailable, get_snapshot, update_snapshot
+from app.serialization import FastJSONResponse
+
+router = APIRouter()
+
+UserCategory = Literal["company", "jobTitle", "city", "state"]
+Metric = Literal["attendedCount", "hostedCount"]
+
+
+async def snapshot():
+    # Never waits for a scan: a stale snapshot is served while it updates
+    try:
+        return get_snapshot()
+    except SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Analytics snapshot unavailable: {e}")
+
+
+@router.get("/status")
+async def analytics_status():
+    """Row counts and build/refresh times of this worker's snapshot"""
+    return FastJSONResponse((await snapshot()).status())
+
+
+@router.post("/refresh")
+async def refresh_analytics(full: bool = False):
+    """Apply the change log now, or rebuild the snapshot from a full scan with `full=true`
+
+    Unlike queries this waits for the update.
+    """
+    try:
+        data = await run_in_threadpool(update_snapshot, 0, full)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Analytics snapshot unavailable: {e}")
+    return FastJSONResponse(data.status())
+
+
+@router.get("/attendance")
+async def attendance_by(
+    by: UserCategory = "company",
+    period: Optional[Literal["day", "month", "year"]] = None,
+    top: Optional[int] = Query(default=None, ge=1, le=1000),
+):
+    """Check-ins per value of an attendee attribute, optionally per check-in day, month or year"""
+    data = await snapshot()
+    with data.lock:
+        rows = data.attendance_by(by, period, top)
+    return FastJSONResponse({"by": by, "period": period, "rows": rows})
+
+
+@router.get("/users")
+async def users_by(
+    by: UserCategory = "company",
+    metric: Optional[Metric] = None,
+    agg: Literal["count", "sum", "mean"] = "count",
+    top: Optional[int] = Query(default=None, ge=1, le=1000),
+):
+    """Users per value of an attribute, with the sum or mean of a counter"""
+    if agg != "count" and metric is None:
+        raise HTTPException(status_code=400, detail=f"agg={agg} needs a metric")
+    data = await snapshot()
+    with data.lock:
+        rows = data.users_by(by, metric, agg, top)
+    return FastJSONResponse({"by": by, "rows": rows})
+
+
+@router.get("/hosts")
+async def top_hosts(
+    by: UserCategory = "company",
+    top: int = Query(default=3, ge=1, le=100),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+):
+    """The users hosting the most events within every value of an attribute"""
+    data = await snapshot()
+    with data.lock:
+        rows = data.top_hosts(by, top, limit)
+    return FastJSONResponse({"by": by, "rows": rows})
+
+
+@router.get("/histogram")
+async def histogram(
+    metric: Metric = "attendedCount",
+    bins: int = Query(default=10, ge=1, le=100),
+    by: Optional[UserCategory] = None,
+    value: Optional[str] = None,
+):
+    """Distribution of a user counter, optionally restricted to users with `by` = `value`"""
+    if (by is None) != (value is None):
+        raise HTTPException(status_code=400, detail="by and value go together")
+    data = await snapshot()
+    with data.lock:
+        result = data.histogram(metric, bins, by, value)
+    return FastJSONResponse(result)
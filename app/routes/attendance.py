@@ -1,12 +1,48 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
 from boto3.dynamodb.conditions import Key
-from app.models import EventAttendance
-from app.services.db.session import table
-from app.services.opensearch.client import get_opensearch_client
-from fastapi_pagination import Page, add_pagination, paginate
+from collections import Counter
+from pydantic import BaseModel
+from app.models import EventAttendance, ExpandedEventAttendance, BulkAttendanceRequest, User, Event
+from app.services.db.batch import fetch_records, batch_get_items, batch_write_items
+from app.services.counters import adjust_user_counters
+from app.services.changes import users_changed
+from app.services.recommendations import sync_recommendations
+from app.services.db.session import table, key_exists
+from app.services.opensearch.indices import USERS_INDEX
+from app.services.opensearch.sync import update_doc
+from fastapi_pagination import Page, add_pagination, paginate, set_page
 from fastapi.concurrency import run_in_threadpool
+from app.serialization import FastJSONResponse, type_adapter
+from app.services.idempotency import IdempotencyKey, run_idempotent
+from app.services.retention import with_expiry
+from typing import Literal, Optional
+from functools import partial
 router = APIRouter()
 
+attendance_adapter = type_adapter(list[EventAttendance])
+
+ExpandOption = Literal["user", "event"]
+
+BulkStatus = Literal["created", "duplicate", "user_not_found", "event_not_found"]
+
+class BulkAttendanceResult(BaseModel):
+    user_id: str
+    event_id: str
+    status: BulkStatus
+
+class BulkAttendanceResponse(BaseModel):
+    created: int
+    results: list[BulkAttendanceResult]
+
+async def expand_page(page, expand: Optional[str]):
+    """Attach the user or event record to each attendance on the page with one batched read"""
+    if not expand:
+        return page
+    model, prefix, attr = (User, "user", "user_id") if expand == "user" else (Event, "event", "event_id")
+    records = await fetch_records(model, prefix, [getattr(a, attr) for a in page.items])
+    page.items = [{**a.__dict__, expand: records.get(getattr(a, attr))} for a in page.items]
+    return page
+
 async def increment_attended_count(user_id: str):
     key = {"PK": f"user#{user_id}", "SK": f"user#{user_id}"}
     res = await run_in_threadpool( 
@@ -17,46 +53,92 @@ async def increment_attended_count(user_id: str):
         ReturnValues="UPDATED_NEW"
     )   
     new_count = res["Attributes"]["attendedCount"]
-    os_client = get_opensearch_client()
-    await run_in_threadpool(
-        os_client.update,
-        index="users",
-        id=user_id,
-        body={"doc": {"attendedCount": new_count}}
-    )   
+    await run_in_threadpool(update_doc, USERS_INDEX, user_id, {"attendedCount": new_count})
+    await run_in_threadpool(users_changed, [user_id])
         
 
 @router.post("/", response_model=EventAttendance)
-async def create_attendance(attendance: EventAttendance):
+async def create_attendance(attendance: EventAttendance, background_tasks: BackgroundTasks, idempotency_key: IdempotencyKey = None):
+    return await run_idempotent(idempotency_key, "create_attendance", attendance,
+                                partial(_create_attendance, attendance, background_tasks))
+
+async def _create_attendance(attendance: EventAttendance, background_tasks: BackgroundTasks):
     pk = f"user#{attendance.user_id}"
     sk = f"event#{attendance.event_id}"
 
     # Check if already attended
-    existing = table.get_item(Key={"PK": pk, "SK": sk})
-    if "Item" in existing:
+    if await run_in_threadpool(key_exists, {"PK": pk, "SK": sk}):
         raise HTTPException(status_code=400, detail="Attendance record already exists")
     
     # check user exists
-    user_check = table.get_item(Key={"PK": pk, "SK": pk})
-    if "Item" not in user_check:
+    if not await run_in_threadpool(key_exists, {"PK": pk, "SK": pk}):
         raise HTTPException(status_code=404, detail="User not found")
     
     # check event exists
-    event_check = table.get_item(Key={"PK": f"event#{attendance.event_id}",
-                                        "SK": f"event#{attendance.event_id}"})
-    if "Item" not in event_check:
+    if not await run_in_threadpool(key_exists, {"PK": f"event#{attendance.event_id}",
+                                                 "SK": f"event#{attendance.event_id}"}):
         raise HTTPException(status_code=404, detail="Event not found")
 
-    item = attendance.to_dynamodb_item()
+    item = with_expiry(attendance.to_dynamodb_item())
 
     await run_in_threadpool(table.put_item, Item=item)
     await increment_attended_count(attendance.user_id)
+    background_tasks.add_task(sync_recommendations, [(attendance.user_id, attendance.event_id, item["createdAt"])])
     return attendance
 
 
+@router.post("/bulk", response_model=BulkAttendanceResponse)
+async def create_attendance_bulk(request: BulkAttendanceRequest, background_tasks: BackgroundTasks,
+                                 idempotency_key: IdempotencyKey = None):
+    """Check in many (user_id, event_id) pairs at once
 
-@router.get("/user/{user_id}", response_model=Page[EventAttendance])
-async def get_user_attendance(user_id: str):
+    Existence checks are batched key-only reads, rows are written with
+    BatchWriteItem and every user's attendedCount is updated once with the
+    number of rows created for them. Results keep the request order; a pair
+    repeated within the request is reported as a duplicate.
+    """
+    return await run_idempotent(idempotency_key, "create_attendance_bulk", request,
+                                partial(_create_attendance_bulk, request, background_tasks))
+
+async def _create_attendance_bulk(request: BulkAttendanceRequest, background_tasks: BackgroundTasks):
+    keys = []
+    for a in request.items:
+        user_key = f"user#{a.user_id}"
+        event_key = f"event#{a.event_id}"
+        keys += [
+            {"PK": user_key, "SK": event_key},
+            {"PK": user_key, "SK": user_key},
+            {"PK": event_key, "SK": event_key},
+        ]
+    found = await batch_get_items(keys, fields=["PK"])
+
+    seen = set()
+    results, rows = [], []
+    for a in request.items:
+        user_key = f"user#{a.user_id}"
+        event_key = f"event#{a.event_id}"
+        if (user_key, event_key) in found or (user_key, event_key) in seen:
+            status = "duplicate"
+        elif (user_key, user_key) not in found:
+            status = "user_not_found"
+        elif (event_key, event_key) not in found:
+            status = "event_not_found"
+        else:
+            status = "created"
+            seen.add((user_key, event_key))
+            rows.append(a)
+        results.append(BulkAttendanceResult(user_id=a.user_id, event_id=a.event_id, status=status))
+
+    await batch_write_items([{"PutRequest": {"Item": with_expiry(a.to_dynamodb_item())}} for a in rows])
+    await adjust_user_counters("attendedCount", Counter(a.user_id for a in rows))
+    if rows:
+        background_tasks.add_task(sync_recommendations,
+                                  [(a.user_id, a.event_id, a.createdAt.isoformat()) for a in rows])
+    return FastJSONResponse({"created": len(rows), "results": results})
+
+
+@router.get("/user/{user_id}", response_model=Page[ExpandedEventAttendance])
+async def get_user_attendance(user_id: str, expand: Optional[ExpandOption] = Query(None, description="Embed the user or event of each record")):
     pk = f"user#{user_id}"
     res = await run_in_threadpool(table.query,
         KeyConditionExpression=Key("PK").eq(pk) & Key("SK").begins_with("event#"),
@@ -65,18 +147,21 @@ async def get_user_attendance(user_id: str):
         ExpressionAttributeValues={":type": "attendance"}
     )
 
-    return paginate([
-        EventAttendance(
-            user_id=user_id,
-            event_id=item["SK"].split("#", 1)[1],
-            attended=item.get("attended", False),
-            createdAt=item["createdAt"],
-        )
-        for item in res.get("Items", [])
-    ])
+    # Only the requested page is validated, with one cached TypeAdapter call
+    with set_page(Page[EventAttendance]):
+        page = paginate(res.get("Items", []), transformer=lambda items: attendance_adapter.validate_python([
+            {
+                "user_id": user_id,
+                "event_id": item["SK"].split("#", 1)[1],
+                "attended": item.get("attended", False),
+                "createdAt": item["createdAt"],
+            }
+            for item in items
+        ]))
+    return FastJSONResponse(await expand_page(page, expand))
 
-@router.get("/event/{event_id}", response_model=Page[EventAttendance])
-async def get_event_attendance(event_id: str):
+@router.get("/event/{event_id}", response_model=Page[ExpandedEventAttendance])
+async def get_event_attendance(event_id: str, expand: Optional[ExpandOption] = Query(None, description="Embed the user or event of each record")):
 
     res = await run_in_threadpool(table.query,
             IndexName='SKIndex',
@@ -87,13 +172,15 @@ async def get_event_attendance(event_id: str):
         )
     items = res.get("Items", [])
 
-    return paginate([
-        EventAttendance(
-            user_id=item["PK"].split("#", 1)[1],
-            event_id=event_id,
-            attended=item["attended"],
-            createdAt=item["createdAt"],
-        )
-        for item in items
-    ])
+    with set_page(Page[EventAttendance]):
+        page = paginate(items, transformer=lambda items: attendance_adapter.validate_python([
+            {
+                "user_id": item["PK"].split("#", 1)[1],
+                "event_id": event_id,
+                "attended": item["attended"],
+                "createdAt": item["createdAt"],
+            }
+            for item in items
+        ]))
+    return FastJSONResponse(await expand_page(page, expand))
 
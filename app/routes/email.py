@@ -1,14 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 from fastapi_pagination import Page, add_pagination, paginate
 from uuid import uuid4
 from datetime import datetime
 from app.models import User
-from app.models import EmailRequest, Email, EmailStatusEnum
-from app.routes.query_users import filter_users_opensearch, UserSearchResponse
-from app.services.email_sender import send_bulk_emails
+from app.models import EmailRequest, Email, EmailStatusEnum, EmailStatusUpdate, EmailSummary, SegmentStatusEnum, UserFilter
+from app.routes.query_users import count_user_docs
+from app.services.campaigns import deliver_campaign
+from app.services.jobs import create_job, run_job
+from app.services.email_logs import (
+    read_campaign_logs, read_campaign_summary, status_counts, update_log_status,
+)
+from app.services.segments import read_segment
 from app.services.db.session import email_table 
 from boto3.dynamodb.conditions import Key
-from typing import List, Annotated
+from functools import partial
+from fastapi.concurrency import run_in_threadpool
+from app.services.idempotency import IdempotencyKey, run_idempotent
+from app.serialization import FastJSONResponse
+from typing import List, Annotated, Optional
 # from fastapi.responses import ORJSONResponse
 router = APIRouter()
 
@@ -26,45 +35,48 @@ async def get_email_requests():
 
     return paginate(response["Items"])
 
-@router.post("/send_emails", response_model=EmailRequest, response_model_exclude_none=True)
-async def send_email_to_filtered_users(request: EmailRequest):
-    # 1. Filter users using OpenSearch
-    search_result: UserSearchResponse = filter_users_opensearch(request.filter, size=10000)
-
-    if search_result.total == 0:
+@router.post("/send_emails", response_model=EmailRequest, response_model_exclude_none=True, status_code=202)
+async def send_email_to_filtered_users(request: EmailRequest, background_tasks: BackgroundTasks,
+                                       idempotency_key: IdempotencyKey = None):
+    # A retried send with the same key replays the first campaign instead of mailing everyone again
+    return await run_idempotent(idempotency_key, "send_emails", request,
+                                partial(_send_email_to_filtered_users, request, background_tasks))
+
+async def _send_email_to_filtered_users(request: EmailRequest, background_tasks: BackgroundTasks):
+    # 1. Size the audience: a saved segment's member count, or the number of
+    # OpenSearch matches of the filter; the job reads the recipients themselves
+    if request.segment_id:
+        segment = await run_in_threadpool(read_segment, request.segment_id)
+        if not segment:
+            raise HTTPException(status_code=404, detail="Segment not found")
+        if segment["status"] != SegmentStatusEnum.ready.value:
+            raise HTTPException(status_code=409, detail="Segment is still building")
+        # The campaign records the filter it was sent with
+        request.filter = UserFilter(**segment["filter"])
+        total = int(segment.get("memberCount", 0))
+    else:
+        total = await run_in_threadpool(count_user_docs, request.filter)
+
+    if total == 0:
         raise HTTPException(status_code=404, detail="No users match the given filter.")
-    
-    users = search_result.users
-
-    # 2. Generate unique email_id
-    email_id = str(uuid4())
 
-    # 3. Extract emails and send
-    email_list = [user.email for user in users if user.email]
-    
-    # dummy sent
-    send_bulk_emails(email_list, subject=request.subject, body=request.body)
-
-    # 4. Prepare EmailRequest record
-    request.email_id = email_id
+    # 2. Record the campaign before anything is sent; logs are written by
+    # the job, once per recipient with the result of its send
+    request.email_id = str(uuid4())
+    job = await run_in_threadpool(create_job, "send_emails", request.email_id)
     request.createdAt = datetime.now()
-    request.totalRecipients = len(email_list)
-    request.status = EmailStatusEnum.sent
-
-    request_item = request.to_dynamodb_item()
-    email_table.put_item(Item=request_item)
-
-    # 5. Log delivery status for each user
-    for user in users:
-        log = Email(
-            user_id=user.id,
-            email_id=email_id,
-            status=EmailStatusEnum.sent,
-            createdAt=datetime.now()
-        )
-        email_table.put_item(Item=log.to_dynamodb_item())
-    
-    return request
+    request.totalRecipients = total
+    request.status = EmailStatusEnum.sending
+    request.statusCounts = status_counts({})
+    request.job_id = job.id
+    await run_in_threadpool(email_table.put_item, Item=request.to_dynamodb_item())
+
+    # 3. Deliver in the background, the job pages over the whole audience
+    # and reports progress batch by batch
+    background_tasks.add_task(run_job, job, partial(
+        deliver_campaign, request.email_id, request.segment_id, request.filter, request.subject, request.body,
+        request.createdAt, total))
+    return FastJSONResponse(request.model_dump(mode="json", exclude_none=True), status_code=202)
 
 @router.post("/{email_id}", response_model=EmailRequest, response_model_exclude_none=True)
 async def get_email_sent_request(email_id: str):
@@ -76,26 +88,29 @@ async def get_email_sent_request(email_id: str):
         raise HTTPException(status_code=404, detail="Item not found")
     return item
 
-@router.post("/sent/{email_id}", response_model=Page[Email], response_model_exclude_none=True)
-async def get_emails_status(email_id: str):
-    response = email_table.query(
-        IndexName="EmailIndex",
-        KeyConditionExpression=Key("PK").eq(f"req_email#{email_id}")
-    )
-    
-    if "Items" not in response or len(response["Items"]) == 0:
+@router.get("/{email_id}/summary", response_model=EmailSummary)
+async def get_email_summary(email_id: str):
+    """Per-status recipient counts of a campaign, kept on the campaign item"""
+    summary = await run_in_threadpool(read_campaign_summary, email_id)
+    if summary is None:
         raise HTTPException(status_code=404, detail="Item not found")
+    return summary
 
-    emails = []
-    for item in response["Items"]:
-        emails.append({
-            "createdAt": item["createdAt"],
-            "user_id": item["SK"].split("#")[1],
-            "email_id": item["PK"].split("#")[1],
-            "status": EmailStatusEnum(item["status"]),
-        })
+@router.post("/sent/{email_id}", response_model=Page[Email], response_model_exclude_none=True)
+async def get_emails_status(email_id: str, status: Optional[EmailStatusEnum] = None):
+    emails = await run_in_threadpool(read_campaign_logs, email_id, status)
+    if not emails:
+        raise HTTPException(status_code=404, detail="Item not found")
     return paginate(emails)
 
+@router.patch("/sent/{email_id}/{user_id}", response_model=Email)
+async def update_email_status(email_id: str, user_id: str, update: EmailStatusUpdate):
+    """Record a later delivery outcome (bounce, deferred send) for one recipient"""
+    entry = await run_in_threadpool(update_log_status, email_id, user_id, update.status)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Recipient not found in this campaign")
+    return entry
+
 @router.post("/user/{user_id}", response_model=Page[Email], response_model_exclude_none=True)
 async def get_emails_status(user_id: str):
     response = email_table.query(
@@ -1,15 +1,42 @@
-from fastapi import APIRouter, HTTPException
-from app.models import Event, EventAttendance
-from app.services.db.session import table
+from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
+from functools import partial
+from app.models import Event, EventAttendance, BatchGetRequest
+from app.services.db.session import table, key_exists
+from app.services.db.expressions import build_projection
+from app.services.db.batch import fetch_records
+from app.services.db.transactions import (
+    transact_write, put_op, release_guard_op, delete_releasing_guard, failed_conditions,
+    slug_guard_item, slug_guard_key,
+)
+from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 from datetime import datetime
-from app.services.opensearch.client import get_opensearch_client
+from app.config import settings
+from app.services.opensearch.client import get_opensearch_client, guarded, search_unavailable
+from app.services.opensearch.indices import USERS_INDEX, EVENTS_INDEX
+from app.services.opensearch.sync import index_doc, update_doc, delete_doc
+from app.services.jobs import create_job, run_job
+from app.services.cascade import cascade_delete_event
+from app.services.changes import users_changed, events_changed
 from fastapi.concurrency import run_in_threadpool
-from fastapi_pagination import Page, add_pagination, paginate
+from fastapi_pagination import Page, add_pagination, paginate, set_page
+from app.serialization import FastJSONResponse, stored_record, select_fields
+from app.services.idempotency import IdempotencyKey, run_idempotent
+from app.services.coalesce import single_flight
+from typing import Optional
+from pydantic import BaseModel
+import base64
+import orjson
 
 router = APIRouter()
 
-def increment_hosted_count(user_id: str):
+OLD_SLUG_GUARD_CONFLICT = "The guard of the old slug belongs to another event, resolve the duplicate slug first"
+
+class EventBatchResponse(BaseModel):
+    events: list[Event]
+    missing: list[str]
+
+def increment_hosted_count(user_id: str, background_tasks: BackgroundTasks):
     if not user_id or user_id.strip() == "":
         print(f"Warning: Skipping hosted count increment for empty user_id")
         return
@@ -22,17 +49,11 @@ def increment_hosted_count(user_id: str):
         ReturnValues="UPDATED_NEW"
     )
     new_count = res["Attributes"]["hostedCount"]
-    os_client = get_opensearch_client()
-    
-    # Additional validation before OpenSearch update
-    if os_client and user_id:
-        os_client.update(
-            index="users",
-            id=user_id,
-            body={"doc": {"hostedCount": new_count}}
-        )
-
-def decrement_hosted_count(user_id: str):
+    # Index and segment updates run after the response, like the other user writes
+    background_tasks.add_task(update_doc, USERS_INDEX, user_id, {"hostedCount": new_count})
+    background_tasks.add_task(users_changed, [user_id])
+
+def decrement_hosted_count(user_id: str, background_tasks: BackgroundTasks):
     if not user_id or user_id.strip() == "":
         print(f"Warning: Skipping hosted count decrement for empty user_id")
         return
@@ -45,90 +66,190 @@ def decrement_hosted_count(user_id: str):
         ReturnValues="UPDATED_NEW"
     )
     new_count = res["Attributes"]["hostedCount"]
-    os_client = get_opensearch_client()
-    
-    # Additional validation before OpenSearch update
-    if os_client and user_id:
-        os_client.update(
-            index="users",
-            id=user_id,
-            body={"doc": {"hostedCount": new_count}}
-        )
+    # Index and segment updates run after the response, like the other user writes
+    background_tasks.add_task(update_doc, USERS_INDEX, user_id, {"hostedCount": new_count})
+    background_tasks.add_task(users_changed, [user_id])
+
+def index_event(event: Event):
+    index_doc(EVENTS_INDEX, event.id, event.to_opensearch_doc())
+
+def unindex_event(event_id: str):
+    delete_doc(EVENTS_INDEX, event_id)
 
 @router.post("/", response_model=Event)
-def create_event(event: Event):
-    
-    result = table.query(
-        IndexName="SlugIndex",
-        KeyConditionExpression=Key("slug").eq(event.slug)
-    )
-    if result["Count"] > 0:
-        raise HTTPException(status_code=400, detail="Event slug already exists")
-    
+async def create_event(event: Event, background_tasks: BackgroundTasks, idempotency_key: IdempotencyKey = None):
+    return await run_idempotent(idempotency_key, "create_event", event,
+                                partial(run_in_threadpool, _create_event, event, background_tasks))
+
+def _create_event(event: Event, background_tasks: BackgroundTasks):
     # ensure owner and hosts are valid users, this is a bit expensive
     if event.owner:
-        res = table.get_item(Key={"PK": f"user#{event.owner}", "SK": f"user#{event.owner}"})
-        if "Item" not in res:
+        if not key_exists({"PK": f"user#{event.owner}", "SK": f"user#{event.owner}"}):
             raise HTTPException(status_code=400, detail="Owner user not found")
     
     for host_id in event.hosts:
-        res = table.get_item(Key={"PK": f"user#{host_id}", "SK": f"user#{host_id}"})
-        if "Item" not in res:
+        if not key_exists({"PK": f"user#{host_id}", "SK": f"user#{host_id}"}):
             raise HTTPException(status_code=400, detail="Host user not found")
 
+    # Event item and slug guard are written together, a taken slug cancels both
+    item = event.to_dynamodb_item()
+    try:
+        transact_write([
+            put_op(item, "attribute_not_exists(PK)"),
+            put_op(slug_guard_item(event.slug, event.id), "attribute_not_exists(PK)"),
+        ])
+    except ClientError as e:
+        failed = failed_conditions(e)
+        if 0 in failed:
+            raise HTTPException(status_code=400, detail="Event ID already exists")
+        if 1 in failed:
+            raise HTTPException(status_code=400, detail="Event slug already exists")
+        raise
+
     # Update hostedCount for owner and hosts
     owner_id = event.owner
     try:
-        increment_hosted_count(owner_id)
+        increment_hosted_count(owner_id, background_tasks)
     except Exception as e:
         raise HTTPException(status_code=400, detail="Failed to update hosted count for owner")
 
     for host_id in event.hosts:
         try:
-            increment_hosted_count(host_id)
+            increment_hosted_count(host_id, background_tasks)
         except Exception as e:
             raise HTTPException(status_code=400, detail="Failed to update hosted count for owner")
 
-    item = event.to_dynamodb_item()
-    table.put_item(Item=item)
-
+    background_tasks.add_task(index_event, event)
+    background_tasks.add_task(events_changed, [event.id])
     return event
 
+@router.post("/batch_get", response_model=EventBatchResponse)
+async def batch_get_events(request: BatchGetRequest):
+    selected = select_fields(",".join(request.fields or []), Event)
+    ids = list(dict.fromkeys(request.ids))
+    records = await fetch_records(Event, "event", ids, selected)
+    return FastJSONResponse({
+        "events": [records[i] for i in ids if i in records],
+        "missing": [i for i in ids if i not in records],
+    })
+
+class EventDiscoveryResponse(BaseModel):
+    events: list[Event]
+    next: Optional[str] = None
+
+@router.get("/discover", response_model=EventDiscoveryResponse)
+async def discover_events(
+    start_from: Optional[datetime] = Query(None, description="Earliest startAt, defaults to now (upcoming events)"),
+    start_to: Optional[datetime] = Query(None, description="Latest startAt"),
+    venue: Optional[str] = Query(None, max_length=200, description="Venue text to match"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="`next` of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+):
+    """Events in a startAt window, optionally at a venue, sorted by startAt
+
+    Served from the `events` index with search_after paging, so every
+    page costs the same however deep it is.
+    """
+    selected = select_fields(fields, Event)
+    body = discovery_query(start_from or datetime.now(), start_to, venue, order, size)
+    if cursor:
+        try:
+            search_after = orjson.loads(base64.urlsafe_b64decode(cursor))
+        except ValueError:
+            search_after = None
+        # A cursor holds one sort value per sort field, as the last hit returned it
+        if not (isinstance(search_after, list) and len(search_after) == len(body["sort"])
+                and all(value is None or isinstance(value, (str, int, float)) for value in search_after)):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        body["search_after"] = search_after
+    if selected:
+        body["_source"] = list(dict.fromkeys(["id", *selected]))
+
+    try:
+        res = await run_in_threadpool(guarded, get_opensearch_client().search, index=EVENTS_INDEX, body=body,
+                                      timeout=settings.opensearch.search_timeout)
+    except Exception as e:
+        if not search_unavailable(e):
+            raise
+        raise HTTPException(status_code=503, detail=f"Event search is unavailable: {e}")
+    hits = res["hits"]["hits"]
+    next_cursor = None
+    if len(hits) == size:
+        next_cursor = base64.urlsafe_b64encode(orjson.dumps(hits[-1]["sort"])).decode()
+    return FastJSONResponse({"events": [hit["_source"] for hit in hits], "next": next_cursor}, exclude_none=True)
+
+def discovery_query(start_from: datetime, start_to: Optional[datetime], venue: Optional[str],
+                    order: str, size: int) -> dict:
+    start_range = {"gte": start_from.isoformat()}
+    if start_to:
+        start_range["lte"] = start_to.isoformat()
+    filters = [{"range": {"startAt": start_range}}]
+    must = [{"match": {"venue": {"query": venue, "operator": "and"}}}] if venue else []
+    return {
+        "query": {"bool": {"filter": filters, "must": must}},
+        # id breaks startAt ties so search_after never skips or repeats an event
+        "sort": [{"startAt": order}, {"id": order}],
+        "size": size,
+        "track_total_hits": False,
+    }
+
 @router.get("/{event_id}", response_model=Event)
-async def get_event(event_id: str):
+async def get_event(event_id: str, fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+    selected = select_fields(fields, Event)
+    record = await single_flight.do("get_event", (event_id, tuple(sorted(selected or []))),
+                                    partial(read_event, event_id, selected))
+    return FastJSONResponse(record)
+
+async def read_event(event_id: str, selected: Optional[list]) -> dict:
     pk = f"event#{event_id}"
-    res = await run_in_threadpool(table.get_item, Key={"PK": pk, "SK": pk})
+    projection = build_projection(selected) if selected else {}
+    res = await run_in_threadpool(table.get_item, Key={"PK": pk, "SK": pk}, **projection)
     item = res.get("Item")
     if not item:
         raise HTTPException(status_code=404, detail="Event not found")
-    return Event(**item)
+    return stored_record(Event, item, selected)
 
 @router.put("/{event_id}", response_model=Event)
-def update_event(event_id: str, event_update: Event):
+def update_event(event_id: str, event_update: Event, background_tasks: BackgroundTasks):
     pk = f"event#{event_id}"
     
     res = table.get_item(Key={"PK": pk, "SK": pk})
     if "Item" not in res:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    # Optional: check for slug conflict if slug is changing
+    event_update.id = event_id
+    item = event_update.to_dynamodb_item()
+
+    # Swap slug guards atomically with the event when the slug changes
     existing_slug = res["Item"].get("slug")
     if event_update.slug != existing_slug:
-        slug_check = table.query(
-            IndexName="SlugIndex",
-            KeyConditionExpression=Key("slug").eq(event_update.slug)
-        )
-        if slug_check["Count"] > 0:
-            raise HTTPException(status_code=400, detail="Slug already exists")
-
-    item = event_update.to_dynamodb_item()
-    table.put_item(Item=item)
+        try:
+            transact_write([
+                put_op(item, "attribute_exists(PK)"),
+                put_op(slug_guard_item(event_update.slug, event_id), "attribute_not_exists(PK)"),
+                release_guard_op(slug_guard_key(existing_slug), event_id),
+            ])
+        except ClientError as e:
+            failed = failed_conditions(e)
+            if 0 in failed:
+                raise HTTPException(status_code=404, detail="Event not found")
+            if 1 in failed:
+                raise HTTPException(status_code=400, detail="Slug already exists")
+            if 2 in failed:
+                raise HTTPException(status_code=409, detail=OLD_SLUG_GUARD_CONFLICT)
+            raise
+    else:
+        table.put_item(Item=item)
 
+    background_tasks.add_task(index_event, event_update)
+    background_tasks.add_task(events_changed, [event_id])
     return event_update
 
 
 @router.delete("/{event_id}")
-def delete_event(event_id: str):
+def delete_event(event_id: str, background_tasks: BackgroundTasks):
     pk = f"event#{event_id}"
     res = table.get_item(Key={"PK": pk, "SK": pk})
     if "Item" not in res:
@@ -136,42 +257,40 @@ def delete_event(event_id: str):
 
     event = res["Item"]
 
-    table.delete_item(Key={"PK": pk, "SK": pk})
+    delete_releasing_guard({"PK": pk, "SK": pk}, slug_guard_key(event["slug"]), event_id)
 
     # Optional: decrement hostedCount for owner/hosts
-    decrement_hosted_count(event["owner"])
+    decrement_hosted_count(event["owner"], background_tasks)
     for host_id in event.get("hosts", []):
-        decrement_hosted_count(host_id)
+        decrement_hosted_count(host_id, background_tasks)
+
+    background_tasks.add_task(unindex_event, event_id)
+    background_tasks.add_task(events_changed, [event_id])
 
-    return {"message": "Event deleted successfully"}
+    # Attendance rows and attendee counters are cleaned up in the background
+    job = create_job("delete_event", event_id)
+    background_tasks.add_task(run_job, job, partial(cascade_delete_event, event_id))
+
+    return {"message": "Event deleted successfully", "job_id": job.id}
 
 @router.get("/", response_model=Page[Event])
-async def get_events():
+async def get_events(fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
     """Get all events with pagination"""
+    selected = select_fields(fields, Event)
+    projection = build_projection(selected) if selected else {}
     res = await run_in_threadpool(
         table.query,
         IndexName="TypeIndex",
-        KeyConditionExpression=Key("type").eq("event")
+        KeyConditionExpression=Key("type").eq("event"),
+        **projection
     )
     
     items = res.get("Items", [])
     
-    events = [
-        Event(
-            id=item["PK"].split("#", 1)[1],
-            slug=item["slug"],
-            title=item["title"],
-            description=item.get("description"),
-            startAt=item["startAt"],
-            endAt=item["endAt"],
-            venue=item.get("venue"),
-            maxCapacity=item.get("maxCapacity"),
-            owner=item["owner"],
-            hosts=item.get("hosts", [])
-        )
-        for item in items
-    ]
-    
-    return paginate(events)
-
-
+    # Records are shaped for the requested page only; Page[dict] keeps
+    # pagination from validating them into Event again
+    with set_page(Page[dict]):
+        page = paginate(items, transformer=lambda page_items: [
+            stored_record(Event, item, selected) for item in page_items
+        ])
+    return FastJSONResponse(page)
@@ -5,7 +5,11 @@ from botocore.exceptions import BotoCoreError, ClientError
 from opensearchpy.exceptions import OpenSearchException
 
 from app.services.db.session import table
-from app.services.opensearch.client import get_opensearch_client
+from fastapi.concurrency import run_in_threadpool
+from app.services.opensearch.client import get_opensearch_client, breaker
+from app.services.opensearch.sync import queue_depth
+from app.services.coalesce import single_flight
+from app.services import startup
 
 router = APIRouter()
 
@@ -32,3 +36,16 @@ async def health_check():
 
     http_status = 200 if all(v == "ok" or v == "disabled" for v in status.values()) else 503
     return JSONResponse(content=status, status_code=http_status)
+
+@router.get("/health/coalescing", summary="Read coalescing metrics")
+async def coalescing_metrics():
+    return single_flight.metrics()
+
+@router.get("/health/ready", summary="Check startup warm-up finished")
+async def readiness():
+    report = startup.state.report()
+    return JSONResponse(content=report, status_code=200 if report["ready"] else 503)
+
+@router.get("/health/opensearch", summary="Read the OpenSearch circuit breaker and replay queue")
+async def opensearch_sync():
+    return {"breaker": breaker.state, "queued": await run_in_threadpool(queue_depth)}
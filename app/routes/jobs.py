@@ -0,0 +1,14 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from app.models import Job
+from app.services.jobs import get_job
+from app.serialization import FastJSONResponse
+
+router = APIRouter()
+
+@router.get("/{job_id}", response_model=Job)
+async def get_job_status(job_id: str):
+    job = await run_in_threadpool(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(job)
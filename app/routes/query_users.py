@@ -1,165 +1,148 @@
 from fastapi import APIRouter, Query, HTTPException
 from app.models import UserFilter, User
-from app.services.db.session import table
-from boto3.dynamodb.conditions import Key
-from typing import List, Optional, Annotated
-from decimal import Decimal
+from typing import Optional, Annotated
 from pydantic import StringConstraints, BaseModel
-from app.services.opensearch.client import get_opensearch_client
-# from fastapi.responses import ORJSONResponse
+from app.services.opensearch.client import get_opensearch_client, guarded, search_unavailable
+from app.serialization import FastJSONResponse, select_fields
+from app.services.coalesce import single_flight
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.services.export import ExportFormat, export_response, search_user_records
+from app.services.opensearch.indices import USERS_INDEX, SUGGEST_FIELDS
+from app.services.opensearch.queries import user_query
+from app.services.fallback_search import FilterNotIndexed, fallback_user_docs
+from app.config import settings
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-'''
-@router.post("/basic-filter-users", response_model=List[User])
-def filter_users(
-    filter: UserFilter,
-    sort_by: Annotated[str | None, StringConstraints(pattern="^(attendedCount|hostedCount)$")] = None,
-    limit: int = 50,
-    lastKey: Optional[str] = None,
-    sort_order: Optional[str] = Query("desc", pattern="^(asc|desc)$")
-):
-    # Step 1: Collect queries for all provided filters
-    queries = []
-    if filter.company:
-        queries.append({
-            "IndexName": "CompanyIndex",
-            "KeyConditionExpression": Key("company").eq(filter.company),
-            "Limit": limit
-        })
-    if filter.jobTitle:
-        queries.append({
-            "IndexName": "JobTitleIndex",
-            "KeyConditionExpression": Key("jobTitle").eq(filter.jobTitle),
-            "Limit": limit
-        })
-    if filter.city and filter.state:
-        city_state = f"{filter.city}#{filter.state}"
-        queries.append({
-            "IndexName": "CityStateIndex",
-            "KeyConditionExpression": Key("city_state").eq(city_state),
-            "Limit": limit
-        })
-
-    if not queries:
-        raise ValueError("At least one filter among company, jobTitle, or city+state must be provided")
-
-    # Step 2: Query all indexes and collect PKs
-    pk_sets = []
-    for q in queries:
-        if lastKey:
-            q["ExclusiveStartKey"] = {"PK": lastKey, "SK": lastKey}
-        result = table.query(**q)
-        items = result.get("Items", [])
-        pks = set(item["PK"] for item in items)
-        pk_sets.append(pks)
-
-    # Step 3: Intersect PKs to get users matching all filters
-    if pk_sets:
-        matching_pks = set.intersection(*pk_sets)
-    else:
-        matching_pks = set()
-
-    # Step 4: Collect all items from the first query and filter by PK
-    # (Assume all items have the same structure)
-    users_raw = []
-    if queries:
-        first_query = queries[0]
-        if lastKey:
-            first_query["ExclusiveStartKey"] = {"PK": lastKey, "SK": lastKey}
-        result = table.query(**first_query)
-        users_raw = [item for item in result.get("Items", []) if item["PK"] in matching_pks]
-
-    # Step 5: In-memory filtering
-    users = []
-    for item in users_raw:
-        attended = int(item.get("attendedCount", 0))
-        hosted = int(item.get("hostedCount", 0))
-
-        if filter.minAttended is not None and attended < filter.minAttended:
-            continue
-        if filter.maxAttended is not None and attended > filter.maxAttended:
-            continue
-        if filter.minHosted is not None and hosted < filter.minHosted:
-            continue
-        if filter.maxHosted is not None and hosted > filter.maxHosted:
-            continue
-
-        users.append(User(
-            id=item["PK"].split("#")[1],
-            firstName=item["firstName"],
-            lastName=item["lastName"],
-            email=item["email"],
-            phoneNumber=item.get("phoneNumber"),
-            avatar=item.get("avatar"),
-            gender=item.get("gender"),
-            jobTitle=item.get("jobTitle"),
-            company=item.get("company"),
-            city=item.get("city"),
-            state=item.get("state"),
-            attendedCount=attended,
-            hostedCount=hosted
-        ))
-
-    # Step 6: Sorting
-    if sort_by:
-        users.sort(key=lambda u: getattr(u, sort_by), reverse=sort_order == "desc")
-
-    return users
-
-'''
 
 class UserSearchResponse(BaseModel):
     total: int
     users: list[User]
 
 @router.post("/query_users", response_model=UserSearchResponse,  response_model_exclude_none=True)
-def filter_users_opensearch(filter: UserFilter, page: int = 0, size: int = 10):
-
+async def filter_users_opensearch(filter: UserFilter, page: int = 0, size: int = 10,
+                                  fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+    selected = select_fields(fields, User)
+    # Identical searches in flight at the same time share one OpenSearch query
+    key = (
+        orjson.dumps(filter.model_dump(mode="json", exclude_none=True), option=orjson.OPT_SORT_KEYS),
+        page, size, tuple(sorted(selected or [])),
+    )
+    total, docs, engine = await single_flight.do(
+        "search_users", key, lambda: run_in_threadpool(search_or_fallback, filter, page, size, selected))
+    return FastJSONResponse({"total": total, "users": docs}, headers={"X-Search-Engine": engine})
+
+class UserSuggestion(BaseModel):
+    id: str
+    name: str
+    avatar: Optional[str] = None
+
+class UserSuggestResponse(BaseModel):
+    suggestions: list[UserSuggestion]
+
+@router.get("/suggest", response_model=UserSuggestResponse)
+async def suggest_users(q: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=100)],
+                        size: int = Query(8, ge=1, le=20)):
+    """Users whose name, email or company start with what was typed so far"""
+    docs = await run_in_threadpool(suggest_user_docs, q, size)
+    return FastJSONResponse({"suggestions": [
+        {"id": doc["id"], "name": f"{doc.get('firstName', '')} {doc.get('lastName', '')}".strip(),
+         "avatar": doc.get("avatar")}
+        for doc in docs
+    ]}, exclude_none=True)
+
+def suggest_query(text: str, size: int) -> dict:
+    """Every typed word must match one of the suggest fields, the last one as a prefix
+
+    Words may match different fields ("jane smi" finds Jane Smith); docs
+    where they are adjacent in one field rank first through the shingle
+    subfields. The prefix is a term lookup on the subfield's edge n-grams.
+    """
+    *words, last = text.split()
+    suggest = [f"{field}.suggest" for field in SUGGEST_FIELDS]
+    shingles = [f"{field}{suffix}" for field in suggest for suffix in ("", "._2gram", "._3gram")]
+    must = [{"multi_match": {"query": word, "fields": suggest}} for word in words]
+    must.append({"multi_match": {"query": last, "type": "bool_prefix", "fields": suggest}})
+    return {
+        "query": {"bool": {
+            "must": must,
+            "should": [{"multi_match": {"query": text, "type": "bool_prefix", "fields": shingles}}],
+        }},
+        "_source": ["id", "firstName", "lastName", "avatar"],
+        "size": size,
+        # Type-ahead never shows a count, skipping it lets shards stop early
+        "track_total_hits": False,
+    }
+
+def suggest_user_docs(text: str, size: int = 8) -> list[dict]:
+    try:
+        response = guarded(get_opensearch_client().search, index=USERS_INDEX, body=suggest_query(text, size),
+                           timeout=settings.opensearch.search_timeout)
+    except Exception as e:
+        raise HTTPException(status_code=503 if search_unavailable(e) else 500, detail=str(e))
+    return [hit["_source"] for hit in response["hits"]["hits"]]
+
+@router.post("/export", response_class=StreamingResponse)
+async def export_search(filter: UserFilter, format: ExportFormat = "csv",
+                        fields: Optional[str] = Query(None, description="Comma-separated fields to export")):
+    """Stream every user matching the filter as CSV or NDJSON, paged over a point in time"""
+    selected = select_fields(fields, User)
+    return export_response(search_user_records(user_query(filter), selected), format, selected, "users-search")
+
+def search_user_docs(filter: UserFilter, page: int = 0, size: int = 10,
+                     fields: Optional[list] = None) -> tuple[int, list[dict]]:
+    """Total hits and the matching `users` docs, as indexed from validated User models
+
+    With `fields`, OpenSearch only returns `id` and those fields of each doc.
+    """
     os_client = get_opensearch_client()
 
-    must_clauses = []
-
-    if filter.company:
-        must_clauses.append({"match": {"company": filter.company}})
-    if filter.jobTitle:
-        must_clauses.append({"match": {"jobTitle": filter.jobTitle}})
-    if filter.city:
-        must_clauses.append({"match": {"city": filter.city}})
-    if filter.state:
-        must_clauses.append({"match": {"state": filter.state}})
-
-    if filter.minAttended is not None or filter.maxAttended is not None:
-        attended_range = {}
-        if filter.minAttended is not None:
-            attended_range["gte"] = filter.minAttended
-        if filter.maxAttended is not None:
-            attended_range["lte"] = filter.maxAttended
-        must_clauses.append({"range": {"attendedCount": attended_range}})
-
-    if filter.minHosted is not None or filter.maxHosted is not None:
-        hosted_range = {}
-        if filter.minHosted is not None:
-            hosted_range["gte"] = filter.minHosted
-        if filter.maxHosted is not None:
-            hosted_range["lte"] = filter.maxHosted
-        must_clauses.append({"range": {"hostedCount": hosted_range}})
+    body = {
+        "query": user_query(filter),
+        "from": page * size,
+        "size": size
+    }
+    if fields:
+        body["_source"] = list(dict.fromkeys(["id", *fields]))
 
     try:
-        response = os_client.search(
-            index="users",
-            body={
-                "query": {
-                    "bool": {
-                        "must": must_clauses
-                    }
-                },
-                "from": page * size,
-                "size": size
-            }
-        )
+        response = guarded(os_client.search, index="users", body=body, timeout=settings.opensearch.search_timeout)
 
         total = response["hits"]["total"]["value"] if isinstance(response["hits"]["total"], dict) else response["hits"]["total"]
-        users = [User(**hit["_source"]) for hit in response["hits"]["hits"]]
-        return UserSearchResponse(total=total, users=users)
+        docs = [
+            {k: v for k, v in hit["_source"].items() if v is not None}
+            for hit in response["hits"]["hits"]
+        ]
+        return total, docs
+    except Exception as e:
+        raise HTTPException(status_code=503 if search_unavailable(e) else 500, detail=str(e))
+
+def count_user_docs(filter: UserFilter) -> int:
+    """Exact number of `users` docs matching the filter"""
+    try:
+        response = guarded(get_opensearch_client().count, index="users", body={"query": user_query(filter)},
+                           timeout=settings.opensearch.search_timeout)
+        return response["count"]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=503 if search_unavailable(e) else 500, detail=str(e))
+
+def search_or_fallback(filter: UserFilter, page: int = 0, size: int = 10,
+                       fields: Optional[list] = None) -> tuple[int, list[dict], str]:
+    """search_user_docs, answered from the DynamoDB GSIs while OpenSearch is unavailable
+
+    The third value names the engine that answered, `opensearch` or `dynamodb`.
+    """
+    try:
+        return (*search_user_docs(filter, page, size, fields), "opensearch")
+    except HTTPException as e:
+        if e.status_code != 503 or not settings.opensearch.fallback:
+            raise
+        logger.warning(f"User search falling back to DynamoDB: {e.detail}")
+    try:
+        return (*fallback_user_docs(filter, page, size, fields), "dynamodb")
+    except FilterNotIndexed as e:
+        raise HTTPException(status_code=503, detail=f"Search is unavailable and the DynamoDB fallback cannot answer: {e}")
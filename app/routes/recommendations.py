@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from app.models import Event, User
+from app.services.db.batch import fetch_records
+from app.services.db.session import key_exists
+from app.services.recommendations import similar, suggest_events
+from app.serialization import FastJSONResponse
+
+router = APIRouter()
+
+# Neighbours read beyond `k`, replacing deleted (or past) ones dropped from the result
+CANDIDATE_FACTOR = 3
+
+class EventRecommendation(BaseModel):
+    id: str
+    score: int
+    event: Event
+
+class UserRecommendation(BaseModel):
+    id: str
+    score: int
+    user: User
+
+async def _ensure_exists(prefix: str, entity_id: str, detail: str):
+    if not await run_in_threadpool(key_exists, {"PK": f"{prefix}#{entity_id}", "SK": f"{prefix}#{entity_id}"}):
+        raise HTTPException(status_code=404, detail=detail)
+
+def _upcoming(record: dict) -> bool:
+    start = datetime.fromisoformat(record["startAt"])
+    return start >= (datetime.now(timezone.utc) if start.tzinfo else datetime.now())
+
+async def _expand(candidates: list, model: type, prefix: str, k: int, keep=None) -> list:
+    """Attach the records of the best `k` candidates that still exist (and pass `keep`)"""
+    records = await fetch_records(model, prefix, [entity_id for entity_id, _ in candidates])
+    results = []
+    for entity_id, score in candidates:
+        record = records.get(entity_id)
+        if record is not None and (keep is None or keep(record)):
+            results.append({"id": entity_id, "score": score, prefix: record})
+            if len(results) == k:
+                break
+    return results
+
+@router.get("/events/{event_id}/similar", response_model=list[EventRecommendation])
+async def similar_events(event_id: str, k: int = Query(default=10, ge=1, le=50)):
+    """Events most often attended by this event's attendees"""
+    await _ensure_exists("event", event_id, "Event not found")
+    candidates = await run_in_threadpool(similar, "event", event_id, k * CANDIDATE_FACTOR)
+    return FastJSONResponse(await _expand(candidates, Event, "event", k))
+
+@router.get("/users/{user_id}/similar", response_model=list[UserRecommendation])
+async def similar_users(user_id: str, k: int = Query(default=10, ge=1, le=50)):
+    """Users who attended the most events together with this one"""
+    await _ensure_exists("user", user_id, "User not found")
+    candidates = await run_in_threadpool(similar, "user", user_id, k * CANDIDATE_FACTOR)
+    return FastJSONResponse(await _expand(candidates, User, "user", k))
+
+@router.get("/users/{user_id}/events", response_model=list[EventRecommendation])
+async def suggested_events(
+    user_id: str,
+    k: int = Query(default=10, ge=1, le=50),
+    upcoming: bool = Query(default=True, description="Only events that have not started yet"),
+):
+    """Events not yet attended, scored by how often they were co-attended with the user's events"""
+    await _ensure_exists("user", user_id, "User not found")
+    # Past events are most of the candidates when only upcoming ones are wanted
+    limit = k * CANDIDATE_FACTOR * (4 if upcoming else 1)
+    candidates = await run_in_threadpool(suggest_events, user_id, limit)
+    return FastJSONResponse(await _expand(candidates, Event, "event", k, _upcoming if upcoming else None))
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi_pagination import Page, paginate
+from functools import partial
+from pydantic import BaseModel
+from app.models import Segment, SegmentCreate, SegmentMember
+from app.services.jobs import create_job, run_job
+from app.services.segments import (
+    create_segment, read_segment, list_segments, read_members, segment_record,
+    start_build, build_segment, delete_segment,
+)
+from app.serialization import FastJSONResponse
+
+router = APIRouter()
+
+class SegmentBuildResponse(BaseModel):
+    segment: Segment
+    job_id: str
+
+@router.post("/", response_model=SegmentBuildResponse)
+async def create_saved_segment(request: SegmentCreate, background_tasks: BackgroundTasks):
+    """Save a filter as a segment; its members are materialised by a background job"""
+    segment = await run_in_threadpool(create_segment, request.name, request.filter)
+    job = await run_in_threadpool(create_job, "build_segment", segment.segment_id)
+    background_tasks.add_task(run_job, job, partial(build_segment, segment.segment_id))
+    return {"segment": segment, "job_id": job.id}
+
+@router.get("/", response_model=list[Segment])
+async def get_segments():
+    items = await run_in_threadpool(list_segments)
+    return FastJSONResponse([segment_record(item) for item in items])
+
+@router.get("/{segment_id}", response_model=Segment)
+async def get_segment(segment_id: str):
+    """The segment with its current memberCount, read with one GetItem"""
+    item = await run_in_threadpool(read_segment, segment_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return FastJSONResponse(segment_record(item))
+
+@router.get("/{segment_id}/members", response_model=Page[SegmentMember])
+async def get_segment_members(segment_id: str):
+    item = await run_in_threadpool(read_segment, segment_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    members = await run_in_threadpool(read_members, segment_id)
+    return paginate([{"id": user_id, "email": members[user_id]} for user_id in sorted(members)])
+
+@router.post("/{segment_id}/rebuild")
+async def rebuild_segment(segment_id: str, background_tasks: BackgroundTasks):
+    """Recompute membership from the filter, e.g. after a bulk import that bypassed the API"""
+    if not await run_in_threadpool(start_build, segment_id):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    job = await run_in_threadpool(create_job, "build_segment", segment_id)
+    background_tasks.add_task(run_job, job, partial(build_segment, segment_id))
+    return {"message": "Segment rebuild started", "job_id": job.id}
+
+@router.delete("/{segment_id}")
+async def delete_saved_segment(segment_id: str):
+    if not await delete_segment(segment_id):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return {"message": "Segment deleted successfully"}
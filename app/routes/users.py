@@ -1,105 +1,212 @@
-from fastapi import APIRouter, HTTPException, Body
-from app.models import User
+from fastapi import APIRouter, HTTPException, Body, Query
+from app.models import User, UserPatch, BatchGetRequest
 from app.services.db.session import table  # reference to boto3 DynamoDB Table
-from boto3.dynamodb.conditions import Key
-from app.services.opensearch.client import get_opensearch_client
+from app.services.db.transactions import (
+    transact_write, put_op, update_op, release_guard_op, delete_releasing_guard, failed_conditions,
+    email_guard_item, email_guard_key,
+)
+from app.services.db.expressions import build_update_expression, build_projection
+from app.services.db.batch import fetch_records
+from botocore.exceptions import ClientError
+from app.services.opensearch.indices import USERS_INDEX
+from app.services.opensearch.sync import index_doc, update_doc, delete_doc
 from fastapi.concurrency import run_in_threadpool
 from fastapi import BackgroundTasks
+from functools import partial
+from app.services.jobs import create_job, run_job
+from app.services.cascade import cascade_delete_user
+from app.services.changes import users_changed
+from app.serialization import FastJSONResponse, stored_record, select_fields
+from app.services.idempotency import IdempotencyKey, run_idempotent
+from app.services.coalesce import single_flight
+from app.services.export import ExportFormat, export_response, scan_user_records
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from pydantic import BaseModel
 
 router = APIRouter()
 
+OLD_EMAIL_GUARD_CONFLICT = "The guard of the old email belongs to another user, resolve the duplicate email first"
+
+class UserBatchResponse(BaseModel):
+    users: list[User]
+    missing: list[str]
+
 @router.post("/", response_model=User)
-async def create_user(user: User, background_tasks: BackgroundTasks):
-    
-    pk = f"user#{user.id}"
-    
-    existing = await run_in_threadpool(table.get_item, Key={"PK": pk, "SK": pk})
-    if "Item" in existing:
-        raise HTTPException(status_code=400, detail="User ID already exists")
-    
-    result = await run_in_threadpool(table.query,
-        IndexName="EmailIndex",
-        KeyConditionExpression=Key("email").eq(str(user.email))
-    )
-    if result.get("Count", 0) > 0:
-        raise HTTPException(status_code=400, detail="Email already exists")
+async def create_user(user: User, background_tasks: BackgroundTasks, idempotency_key: IdempotencyKey = None):
+    return await run_idempotent(idempotency_key, "create_user", user, partial(_create_user, user, background_tasks))
 
+async def _create_user(user: User, background_tasks: BackgroundTasks):
     item = user.to_dynamodb_item()
 
-    await run_in_threadpool(table.put_item,Item=item)
-
-    os_client = get_opensearch_client()
+    # User item and email guard are written together, so a duplicate id or
+    # email cancels the whole transaction instead of racing a GSI query
+    try:
+        await run_in_threadpool(transact_write, [
+            put_op(item, "attribute_not_exists(PK)"),
+            put_op(email_guard_item(user.email, user.id), "attribute_not_exists(PK)"),
+        ])
+    except ClientError as e:
+        failed = failed_conditions(e)
+        if 0 in failed:
+            raise HTTPException(status_code=400, detail="User ID already exists")
+        if 1 in failed:
+            raise HTTPException(status_code=400, detail="Email already exists")
+        raise
 
-    if os_client:
-        background_tasks.add_task(os_client.index,
-            index="users",
-            id=user.id,
-            body=user.to_opensearch_doc())
+    background_tasks.add_task(index_doc, USERS_INDEX, user.id, user.to_opensearch_doc())
+    background_tasks.add_task(users_changed, [user.id])
 
     return user
 
+@router.post("/batch_get", response_model=UserBatchResponse)
+async def batch_get_users(request: BatchGetRequest):
+    selected = select_fields(",".join(request.fields or []), User)
+    ids = list(dict.fromkeys(request.ids))
+    records = await fetch_records(User, "user", ids, selected)
+    return FastJSONResponse({
+        "users": [records[i] for i in ids if i in records],
+        "missing": [i for i in ids if i not in records],
+    })
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_users(format: ExportFormat = "csv",
+                       fields: Optional[str] = Query(None, description="Comma-separated fields to export"),
+                       segments: int = Query(4, ge=1, le=32, description="Parallel scan segments")):
+    """Stream every user as CSV or NDJSON straight from a parallel table scan"""
+    selected = select_fields(fields, User)
+    return export_response(scan_user_records(segments, selected), format, selected, "users")
+
 @router.get("/{user_id}", response_model=User)
-async def get_user(user_id: str):
+async def get_user(user_id: str, fields: Optional[str] = Query(None, description="Comma-separated fields to return")):
+    selected = select_fields(fields, User)
+    record = await single_flight.do("get_user", (user_id, tuple(sorted(selected or []))),
+                                    partial(read_user, user_id, selected))
+    return FastJSONResponse(record)
+
+async def read_user(user_id: str, selected: Optional[list]) -> dict:
     pk = f"user#{user_id}"
-    res = await run_in_threadpool(table.get_item,Key={"PK": pk, "SK": pk})
+    projection = build_projection(selected) if selected else {}
+    res = await run_in_threadpool(table.get_item,Key={"PK": pk, "SK": pk}, **projection)
     item = res.get("Item")
     if not item:
         raise HTTPException(status_code=404, detail="User not found")
-    return User(**{
-        "id": user_id,
-        "firstName": item["firstName"],
-        "lastName": item["lastName"],
-        "email": item["email"],
-        "phoneNumber": item.get("phoneNumber"),
-        "avatar": item.get("avatar"),
-        "gender": item.get("gender"),
-        "jobTitle": item.get("jobTitle"),
-        "company": item.get("company"),
-        "city": item.get("city"),
-        "state": item.get("state"),
-        "attendedCount": item.get("attendedCount", 0),
-        "hostedCount": item.get("hostedCount", 0),
-    })
+    return stored_record(User, item, selected)
 
 @router.put("/{user_id}", response_model=User)
-async def update_user(user_id: str, user_update: User = Body(...)):
+async def update_user(user_id: str, background_tasks: BackgroundTasks, user_update: User = Body(...)):
     pk = f"user#{user_id}"
     
     existing = await run_in_threadpool(table.get_item,Key={"PK": pk, "SK": pk})
     if not existing.get("Item"):
         raise HTTPException(status_code=404, detail="User not found")
     
-    if user_update.email != existing["Item"].get("email"):
-        result = await run_in_threadpool(table.query,
-            IndexName="EmailIndex",
-            KeyConditionExpression=Key("email").eq(str(user_update.email))
-        )
-        if result.get("Count", 0) > 0:
-            raise HTTPException(status_code=400, detail="Email already exists")
-    
+    old_email = existing["Item"].get("email")
+
+    # Counters are maintained by attendance/event writes, never by the client
+    user_update.attendedCount = int(existing["Item"].get("attendedCount", 0))
+    user_update.hostedCount = int(existing["Item"].get("hostedCount", 0))
 
     updated_item = user_update.to_dynamodb_item()
     updated_item["PK"] = pk
     updated_item["SK"] = pk
 
-    # Update city_state if city and state exist
-    if user_update.city and user_update.state:
-        updated_item["city_state"] = f"{user_update.city}#{user_update.state}"
-
-    await run_in_threadpool(table.put_item,Item=updated_item)
-
-    os_client = get_opensearch_client()
-    if os_client:
-        await run_in_threadpool(os_client.index,
-            index="users",
-            id=user_id,
-            body=user_update.to_opensearch_doc()
-        )
+    if str(user_update.email).lower() != str(old_email).lower():
+        try:
+            await run_in_threadpool(transact_write, [
+                put_op(updated_item, "attribute_exists(PK)"),
+                put_op(email_guard_item(user_update.email, user_id), "attribute_not_exists(PK)"),
+                release_guard_op(email_guard_key(old_email), user_id),
+            ])
+        except ClientError as e:
+            failed = failed_conditions(e)
+            if 0 in failed:
+                raise HTTPException(status_code=404, detail="User not found")
+            if 1 in failed:
+                raise HTTPException(status_code=400, detail="Email already exists")
+            if 2 in failed:
+                raise HTTPException(status_code=409, detail=OLD_EMAIL_GUARD_CONFLICT)
+            raise
+    else:
+        await run_in_threadpool(table.put_item,Item=updated_item)
+
+    background_tasks.add_task(index_doc, USERS_INDEX, user_id, user_update.to_opensearch_doc())
+    background_tasks.add_task(users_changed, [user_id])
 
     return user_update
 
+@router.patch("/{user_id}", response_model=User)
+async def patch_user(user_id: str, background_tasks: BackgroundTasks, user_patch: UserPatch = Body(...)):
+    pk = f"user#{user_id}"
+    key = {"PK": pk, "SK": pk}
+
+    changes = user_patch.model_dump(mode="json", exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    for field in ("firstName", "lastName", "email"):
+        if field in changes and changes[field] is None:
+            raise HTTPException(status_code=400, detail=f"{field} cannot be removed")
+
+    # Only read the current item when the change depends on it: a new email
+    # needs the old guard released, and a lone city or state change needs the
+    # other half to rebuild city_state
+    existing = None
+    if "email" in changes or ("city" in changes) != ("state" in changes):
+        res = await run_in_threadpool(table.get_item, Key=key)
+        existing = res.get("Item")
+        if not existing:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    db_changes = dict(changes)
+    if "city" in changes or "state" in changes:
+        city = changes["city"] if "city" in changes else existing.get("city")
+        state = changes["state"] if "state" in changes else existing.get("state")
+        db_changes["city_state"] = f"{city}#{state}" if city and state else None
+
+    update = build_update_expression(db_changes)
+
+    email_changed = existing is not None and "email" in changes and \
+        changes["email"].lower() != str(existing.get("email")).lower()
+    if email_changed:
+        try:
+            await run_in_threadpool(transact_write, [
+                update_op(key, update["UpdateExpression"], "attribute_exists(PK)",
+                          update["ExpressionAttributeNames"], update.get("ExpressionAttributeValues")),
+                put_op(email_guard_item(changes["email"], user_id), "attribute_not_exists(PK)"),
+                release_guard_op(email_guard_key(existing["email"]), user_id),
+            ])
+        except ClientError as e:
+            failed = failed_conditions(e)
+            if 0 in failed:
+                raise HTTPException(status_code=404, detail="User not found")
+            if 1 in failed:
+                raise HTTPException(status_code=400, detail="Email already exists")
+            if 2 in failed:
+                raise HTTPException(status_code=409, detail=OLD_EMAIL_GUARD_CONFLICT)
+            raise
+        item = {k: v for k, v in {**existing, **db_changes}.items() if v is not None}
+    else:
+        try:
+            res = await run_in_threadpool(table.update_item,
+                Key=key,
+                ConditionExpression="attribute_exists(PK)",
+                ReturnValues="ALL_NEW",
+                **update
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise HTTPException(status_code=404, detail="User not found")
+            raise
+        item = res["Attributes"]
+
+    # Send only the changed fields to OpenSearch; cleared ones are removed from the doc
+    background_tasks.add_task(update_doc, USERS_INDEX, user_id, changes)
+    background_tasks.add_task(users_changed, [user_id])
+
+    return User.from_dynamodb_item(item)
+
 @router.delete("/{user_id}")
-def delete_user(user_id: str):
+def delete_user(user_id: str, background_tasks: BackgroundTasks):
     pk = f"user#{user_id}"
     
     # Check if exists
@@ -107,15 +214,14 @@ def delete_user(user_id: str):
     if not existing:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete from DynamoDB
-    table.delete_item(Key={"PK": pk, "SK": pk})
+    # Delete from DynamoDB, releasing the email guard in the same transaction
+    delete_releasing_guard({"PK": pk, "SK": pk}, email_guard_key(existing["email"]), user_id)
 
-    # Delete from OpenSearch
-    os_client = get_opensearch_client()
-    if os_client:
-        try:
-            os_client.delete(index="users", id=user_id)
-        except Exception:
-            pass  # Swallow OS errors silently
+    background_tasks.add_task(delete_doc, USERS_INDEX, user_id)
+    background_tasks.add_task(users_changed, [user_id])
+
+    # Attendance rows and email logs are cleaned up in the background
+    job = create_job("delete_user", user_id)
+    background_tasks.add_task(run_job, job, partial(cascade_delete_user, user_id))
 
-    return {"message": "User deleted successfully"}
\ No newline at end of file
+    return {"message": "User deleted successfully", "job_id": job.id}
\ No newline at end of file
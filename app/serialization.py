@@ -0,0 +1,104 @@
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Optional
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def type_adapter(tp: Any) -> TypeAdapter:
+    """Cached TypeAdapter, building one per call costs more than the validation itself"""
+    return TypeAdapter(tp)
+
+
+def _decimal(value: Decimal):
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def plain(value: Any) -> Any:
+    """Convert DynamoDB Decimals and sets inside a value to JSON-native types"""
+    if isinstance(value, Decimal):
+        return _decimal(value)
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [plain(v) for v in value]
+    return value
+
+
+@lru_cache(maxsize=None)
+def _field_defaults(model: type) -> tuple:
+    return tuple(
+        (name, None if field.is_required() else field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items()
+        if name != "id"
+    )
+
+
+def select_fields(fields: Optional[str], model: type) -> Optional[list]:
+    """Parse a comma-separated `fields=` query parameter against a model's fields"""
+    if not fields:
+        return None
+    selected = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def stored_record(model: type, item: dict, fields: Optional[list] = None) -> dict:
+    """Response dict for a DynamoDB item that `model` validated when it was written
+
+    Items are trusted, so reads skip a second pydantic validation (EmailStr
+    alone costs more than the rest of the request) and Decimals are
+    converted in the same pass that fills in the model's defaults.
+    With `fields`, only `id` and those fields are returned.
+    """
+    record = {"id": item["PK"].split("#", 1)[1]}
+    for name, default in _field_defaults(model):
+        if fields is not None and name not in fields:
+            continue
+        value = item.get(name, default)
+        record[name] = plain(value) if isinstance(value, (Decimal, list, set, dict)) else value
+    return record
+
+
+def _default(obj):
+    # Models are emitted from their already-validated attributes, orjson
+    # handles the str/int/enum/datetime values inside them natively
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    if isinstance(obj, Decimal):
+        return _decimal(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError
+
+
+def _default_exclude_none(obj):
+    if isinstance(obj, BaseModel):
+        return {k: v for k, v in obj.__dict__.items() if v is not None}
+    return _default(obj)
+
+
+def dumps(content: Any, exclude_none: bool = False) -> bytes:
+    """Serialize models, DynamoDB items (Decimal, set) and plain values to JSON bytes in one pass"""
+    return orjson.dumps(content, default=_default_exclude_none if exclude_none else _default)
+
+
+class FastJSONResponse(ORJSONResponse):
+    """ORJSONResponse for content that is already validated
+
+    Returning it from a route skips FastAPI's response_model round trip,
+    the response_model is then only used for the OpenAPI schema.
+    """
+
+    def __init__(self, content: Any, *args, exclude_none: bool = False, **kwargs):
+        self.exclude_none = exclude_none
+        super().__init__(content, *args, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content, exclude_none=self.exclude_none)
+
@@ -0,0 +1,62 @@
+"""Production entry point: `python -m app.server`
+
+Runs uvicorn with the worker, event loop, HTTP parser and connection
+settings from `settings.app`, so one container uses every core it is given.
+"""
+import importlib.util
+import logging
+import os
+import uvicorn
+from app.config import settings
+
+logger = logging.getLogger(settings.app.app_name)
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honouring affinity and a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_count() -> int:
+    return settings.app.workers or available_cpus()
+
+
+def _implementation(requested: str, module: str, fallback: str) -> str:
+    if requested != module or importlib.util.find_spec(module):
+        return requested
+    logger.warning(f"{module} is not installed, falling back to {fallback}")
+    return fallback
+
+
+def main():
+    app = settings.app
+    uvicorn.run(
+        "app.main:app",
+        host=app.api_host,
+        port=app.api_port,
+        workers=worker_count(),
+        loop=_implementation(app.loop, "uvloop", "asyncio"),
+        http=_implementation(app.http, "httptools", "h11"),
+        backlog=app.backlog,
+        timeout_keep_alive=app.keep_alive_timeout,
+        timeout_graceful_shutdown=app.graceful_shutdown_timeout,
+        limit_concurrency=app.limit_concurrency,
+        proxy_headers=True,
+        forwarded_allow_ips=app.forwarded_allow_ips,
+        log_level=app.log_level.lower(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""Columnar in-memory analytics snapshot of users, events and attendance
+
+The snapshot holds the main table's users, events and attendance rows as
+NumPy columns, loaded by one parallel scan. Categorical attributes
+(company, jobTitle, city, state, venue) are dictionary-encoded: an int32
+code per row plus the list of distinct values, so a group-by is a
+bincount over codes instead of hashing strings item by item. Entity ids
+are encoded the same way, which gives every user and event a stable
+integer key; attendance rows store those keys and join to users and
+events by array indexing.
+
+Refreshes are incremental: users and events recorded in the change log
+since the last refresh are re-read (a user's partition holds the user and
+its attendance rows), their old rows are masked out and the new ones
+appended. The snapshot is rebuilt from a full scan every
+ANALYTICS_REBUILD_SECONDS, or when a refresh would re-read more than
+ANALYTICS_FULL_REBUILD_RATIO of the users. Both run in a background
+thread while queries keep reading the previous snapshot. Each worker
+process keeps its own snapshot.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from boto3.dynamodb.conditions import Attr, Key
+from app.config import settings
+from app.services.changes import read_changes
+from app.services.db.batch import BATCH_GET_LIMIT, batch_get_chunk, chunks
+from app.services.db.expressions import build_projection
+from app.services.db.scan import parallel_scan, query_pages
+from app.services.db.session import MAIN_TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("company", "jobTitle", "city", "state")
+METRICS = ("attendedCount", "hostedCount")
+PERIODS = {"day": "D", "month": "M", "year": "Y"}
+# Change log items written this long before the last refresh are replayed
+# again, covering clock skew between workers; replaying is idempotent
+OVERLAP = timedelta(seconds=30)
+COMPACT_RATIO = 0.25
+READ_CONCURRENCY = 16
+SCAN_FIELDS = ["type", *CATEGORIES, *METRICS, "owner", "venue", "startAt", "createdAt"]
+
+
+class Dictionary:
+    """Dictionary encoding of a categorical column, code -1 for a missing value"""
+
+    def __init__(self):
+        self.values: list = []
+        self._codes: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def encode(self, value) -> int:
+        if value is None or value == "":
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code_of(self, value) -> int:
+        return self._codes.get(value, -1)
+
+    def decode(self, code: int):
+        return self.values[code] if code >= 0 else None
+
+
+class Columns:
+    """Equal-length NumPy columns and a live mask
+
+    Rows are never updated in place: a changed row is masked out and its
+    new version appended. `compact` drops the dead rows.
+    """
+
+    def __init__(self, dtypes: dict):
+        self.dtypes = dtypes
+        self.data = {name: np.empty(0, dtype) for name, dtype in dtypes.items()}
+        self.live = np.empty(0, bool)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.data[name]
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.live))
+
+    @property
+    def dead(self) -> int:
+        return len(self.live) - len(self)
+
+    def append(self, rows: Dict[str, list]) -> None:
+        count = len(next(iter(rows.values())))
+        if not count:
+            return
+        for name, dtype in self.dtypes.items():
+            self.data[name] = np.concatenate([self.data[name], np.asarray(rows[name], dtype)])
+        self.live = np.concatenate([self.live, np.ones(count, bool)])
+
+    def kill(self, column: str, keys: np.ndarray) -> None:
+        self.live &= ~np.isin(self.data[column], keys)
+
+    def compact(self) -> None:
+        self.data = {name: values[self.live] for name, values in self.data.items()}
+        self.live = np.ones(len(self.live[self.live]), bool)
+
+
+def _timestamp(value: Optional[str]) -> np.datetime64:
+    if not value:
+        return np.datetime64("NaT", "s")
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(moment, "s")
+
+
+def _timestamps(values: List[Optional[str]]) -> np.ndarray:
+    """ISO timestamps as datetime64[s], naive ones parsed by NumPy in one call"""
+    if any(value and (value[-1] == "Z" or "+" in value[10:] or "-" in value[10:]) for value in values):
+        return np.array([_timestamp(value) for value in values], "datetime64[s]")
+    return np.array([value or None for value in values], "datetime64[us]").astype("datetime64[s]")
+
+
+def _entity_id(key: str) -> str:
+    return key.split("#", 1)[1]
+
+
+class Snapshot:
+    def __init__(self):
+        self.ids = {"user": Dictionary(), "event": Dictionary()}
+        self.categories = {name: Dictionary() for name in (*CATEGORIES, "venue")}
+        self.users = Columns({"key": np.int32, **{c: np.int32 for c in CATEGORIES}, **{m: np.int32 for m in METRICS}})
+        self.events = Columns({"key": np.int32, "owner": np.int32, "venue": np.int32, "startAt": "datetime64[s]"})
+        self.attendance = Columns({"user": np.int32, "event": np.int32, "at": "datetime64[s]"})
+        self.user_row = np.empty(0, np.int64)
+        self.event_row = np.empty(0, np.int64)
+        self.built_at: Optional[datetime] = None
+        self.refreshed_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    # -- loading -----------------------------------------------------------
+
+    def _user_rows(self, items: List[dict]) -> dict:
+        return {
+            "key": [self.ids["user"].encode(_entity_id(item["PK"])) for item in items],
+            **{c: [self.categories[c].encode(item.get(c)) for item in items] for c in CATEGORIES},
+            **{m: [int(item.get(m, 0)) for item in items] for m in METRICS},
+        }
+
+    def _event_rows(self, items: List[dict]) -> dict:
+        return {
+            "key": [self.ids["event"].encode(_entity_id(item["PK"])) for item in items],
+            "owner": [self.ids["user"].encode(item.get("owner")) for item in items],
+            "venue": [self.categories["venue"].encode(item.get("venue")) for item in items],
+            "startAt": _timestamps([item.get("startAt") for item in items]),
+        }
+
+    def _attendance_rows(self, items: List[dict]) -> dict:
+        return {
+            "user": [self.ids["user"].encode(_entity_id(item["PK"])) for item in items],
+            "event": [self.ids["event"].encode(_entity_id(item["SK"])) for item in items],
+            "at": _timestamps([item.get("createdAt") for item in items]),
+        }
+
+    def _index(self) -> None:
+        """Map entity keys to their live row, -1 for deleted or unknown entities"""
+        for columns, dictionary, attr in ((self.users, self.ids["user"], "user_row"),
+                                          (self.events, self.ids["event"], "event_row")):
+            rows = np.flatnonzero(columns.live)
+            index = np.full(len(dictionary), -1, np.int64)
+            index[columns["key"][rows]] = rows
+            setattr(self, attr, index)
+
+    def load(self, items: Iterable[dict]) -> None:
+        grouped = {"user": [], "event": [], "attendance": []}
+        for item in items:
+            if item.get("type") in grouped:
+                grouped[item["type"]].append(item)
+        self.users.append(self._user_rows(grouped["user"]))
+        self.events.append(self._event_rows(grouped["event"]))
+        self.attendance.append(self._attendance_rows(grouped["attendance"]))
+        self._index()
+
+    def replace_users(self, user_ids: Iterable[str], items: List[dict]) -> None:
+        """Swap the rows of `user_ids` (user and attendance) for freshly read items"""
+        keys = np.asarray([self.ids["user"].encode(user_id) for user_id in user_ids], np.int32)
+        self.users.kill("key", keys)
+        self.attendance.kill("user", keys)
+        self.users.append(self._user_rows([item for item in items if item.get("type") == "user"]))
+        self.attendance.append(self._attendance_rows([item for item in items if item.get("type") == "attendance"]))
+
+    def replace_events(self, event_ids: Iterable[str], items: List[dict]) -> None:
+        keys = np.asarray([self.ids["event"].encode(event_id) for event_id in event_ids], np.int32)
+        self.events.kill("key", keys)
+        self.events.append(self._event_rows(items))
+
+    def finish_refresh(self) -> None:
+        for columns in (self.users, self.events, self.attendance):
+            if columns.dead > COMPACT_RATIO * max(1, len(columns.live)):
+                columns.compact()
+        self._index()
+
+    # -- queries -----------------------------------------------------------
+
+    def _labels(self, name: str, codes: np.ndarray) -> list:
+        dictionary = self.categories[name]
+        return [dictionary.decode(int(code)) for code in codes]
+
+    @staticmethod
+    def _shift(codes: np.ndarray) -> np.ndarray:
+        # Missing values (-1) get their own group at 0
+        return codes.astype(np.int64) + 1
+
+    def attendance_by(self, by: str, period: Optional[str] = None, top: Optional[int] = None) -> List[dict]:
+        """Check-ins per value of a user category, optionally per period of the check-in date"""
+        live = self.attendance.live
+        user_rows = self.user_row[self.attendance["user"][live]]
+        known = user_rows >= 0
+        groups = self._shift(self.users[by][user_rows[known]])
+        group_count = len(self.categories[by]) + 1
+        if period:
+            periods = self.attendance["at"][live][known].astype(f"datetime64[{PERIODS[period]}]")
+            dated = ~np.isnat(periods)
+            period_values, period_index = np.unique(periods[dated], return_inverse=True)
+            if not len(period_values):
+                return []
+            # One bincount over (period, group) cells
+            combined = period_index * group_count + groups[dated]
+            counts = np.bincount(combined, minlength=len(period_values) * group_count)
+            counts = counts.reshape(len(period_values), group_count)
+            rows = []
+            for p, period_counts in enumerate(counts):
+                order = np.argsort(-period_counts, kind="stable")
+                order = order[period_counts[order] > 0][:top]
+                rows.extend({period: str(period_values[p]), by: label, "count": int(period_counts[code])}
+                            for code, label in zip(order, self._labels(by, order - 1)))
+            return rows
+        counts = np.bincount(groups, minlength=group_count)
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0][:top]
+        return [{by: label, "count": int(counts[code])} for code, label in zip(order, self._labels(by, order - 1))]
+
+    def users_by(self, by: str, metric: Optional[str] = None, agg: str = "count",
+                 top: Optional[int] = None) -> List[dict]:
+        """Users per value of a category, with the sum or mean of a counter"""
+        live = self.users.live
+        groups = self._shift(self.users[by][live])
+        minlength = len(self.categories[by]) + 1
+        counts = np.bincount(groups, minlength=minlength)
+        if agg == "count" or metric is None:
+            values = counts.astype(np.float64)
+        else:
+            sums = np.bincount(groups, weights=self.users[metric][live], minlength=minlength)
+            values = sums if agg == "sum" else np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        order = np.argsort(-values, kind="stable")
+        order = order[counts[order] > 0][:top]
+        rows = []
+        for code, label in zip(order, self._labels(by, order - 1)):
+            row = {by: label, "users": int(counts[code])}
+            if metric and agg != "count":
+                row[f"{agg}_{metric}"] = round(float(values[code]), 4) if agg == "mean" else int(values[code])
+            rows.append(row)
+        return rows
+
+    def top_hosts(self, by: str, top: int = 3, limit: Optional[int] = None) -> List[dict]:
+        """The `top` users with the highest hostedCount for every value of a category"""
+        rows = np.flatnonzero(self.users.live & (self.users["hostedCount"] > 0))
+        groups = self._shift(self.users[by][rows])
+        hosted = self.users["hostedCount"][rows]
+        order = np.lexsort((-hosted, groups))
+        rows, groups, hosted = rows[order], groups[order], hosted[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+        keep = rank < top
+        user_ids = self.ids["user"].values
+        result = {}
+        for row, group, count in zip(rows[keep], groups[keep], hosted[keep]):
+            result.setdefault(int(group), []).append(
+                {"id": user_ids[self.users["key"][row]], "hostedCount": int(count)})
+        ranked = sorted(result.items(), key=lambda entry: -sum(host["hostedCount"] for host in entry[1]))
+        return [{by: self.categories[by].decode(group - 1), "hosts": hosts} for group, hosts in ranked[:limit]]
+
+    def histogram(self, metric: str, bins: int = 10, by: Optional[str] = None,
+                  value: Optional[str] = None) -> dict:
+        """Distribution of a user counter, optionally of the users with one category value"""
+        mask = self.users.live
+        if by:
+            mask = mask & (self.users[by] == self.categories[by].code_of(value))
+        values = self.users[metric][mask]
+        if not len(values):
+            return {"metric": metric, "users": 0, "buckets": []}
+        upper = max(int(values.max()) + 1, bins)
+        counts, edges = np.histogram(values, bins=np.linspace(0, upper, bins + 1))
+        return {
+            "metric": metric,
+            "users": int(len(values)),
+            "buckets": [{"from": round(float(lo), 2), "to": round(float(hi), 2), "count": int(count)}
+                        for lo, hi, count in zip(edges[:-1], edges[1:], counts)],
+        }
+
+    def status(self) -> dict:
+        return {
+            "builtAt": self.built_at.isoformat() if self.built_at else None,
+            "refreshedAt": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "users": len(self.users),
+            "events": len(self.events),
+            "attendance": len(self.attendance),
+            "categories": {name: len(dictionary) for name, dictionary in self.categories.items()},
+        }
+
+
+def build_snapshot(segments: Optional[int] = None) -> Snapshot:
+    """A new snapshot of the whole main table from one parallel scan"""
+    started = datetime.now(timezone.utc)
+    pages, lock = [], threading.Lock()
+
+    def handle_page(items: list):
+        with lock:
+            pages.append(items)
+
+    parallel_scan(
+        segments or settings.analytics.scan_segments,
+        handle_page,
+        FilterExpression=Attr("type").is_in(["user", "event", "attendance"]),
+        **build_projection(SCAN_FIELDS),
+    )
+    snapshot = Snapshot()
+    snapshot.load(item for page in pages for item in page)
+    snapshot.built_at = snapshot.refreshed_at = started
+    return snapshot
+
+
+def _user_partition(user_id: str) -> list:
+    # The user item and its attendance rows share the partition
+    pages = query_pages(KeyConditionExpression=Key("PK").eq(f"user#{user_id}"), **build_projection(SCAN_FIELDS))
+    return [item for page in pages for item in page]
+
+
+def _read_events(event_ids: list) -> list:
+    keys = [{"PK": f"event#{i}", "SK": f"event#{i}"} for i in event_ids]
+    projection = build_projection(SCAN_FIELDS)
+    return [item for chunk in chunks(keys, BATCH_GET_LIMIT) for item in batch_get_chunk(MAIN_TABLE_NAME, chunk, projection)]
+
+
+def refresh_snapshot(snapshot: Snapshot) -> Optional[dict]:
+    """Apply the change log to `snapshot`; None when a full rebuild is due instead"""
+    started = datetime.now(timezone.utc)
+    try:
+        users, events, entries = read_changes(snapshot.refreshed_at - OVERLAP)
+    except ValueError:
+        return None
+    # Small tables always refresh, one scan would not be much cheaper there
+    if len(users) > max(settings.analytics.full_rebuild_ratio * len(snapshot.users), BATCH_GET_LIMIT):
+        return None
+    with ThreadPoolExecutor(max_workers=READ_CONCURRENCY) as pool:
+        user_items = [item for items in pool.map(_user_partition, sorted(users)) for item in items]
+    event_items = _read_events(sorted(events))
+    with snapshot.lock:
+        snapshot.replace_users(users, user_items)
+        snapshot.replace_events(events, event_items)
+        snapshot.finish_refresh()
+        snapshot.refreshed_at = started
+    return {"entries": entries, "users": len(users), "events": len(events)}
+
+
+class SnapshotUnavailable(Exception):
+    """No snapshot has been built yet"""
+
+
+_snapshot: Optional[Snapshot] = None
+_update_lock = threading.Lock()
+_last_error: Optional[str] = None
+
+
+def _due(snapshot: Optional[Snapshot], max_age: Optional[float], full: bool) -> Optional[str]:
+    """"build", "refresh" or None when the snapshot is fresh enough"""
+    config = settings.analytics
+    max_age = config.refresh_seconds if max_age is None else max_age
+    now = datetime.now(timezone.utc)
+    if full or snapshot is None or (now - snapshot.built_at).total_seconds() >= config.rebuild_seconds:
+        return "build"
+    if (now - snapshot.refreshed_at).total_seconds() >= max_age:
+        return "refresh"
+    return None
+
+
+def update_snapshot(max_age: Optional[float] = None, full: bool = False) -> Snapshot:
+    """Build or refresh the snapshot in the calling thread if it is due
+
+    `max_age` overrides ANALYTICS_REFRESH_SECONDS; 0 applies the change log
+    now. One update runs at a time, a second caller waits for it and then
+    finds the snapshot fresh.
+    """
+    global _snapshot, _last_error
+    with _update_lock:
+        due = _due(_snapshot, max_age, full)
+        try:
+            if due == "build" or (due == "refresh" and refresh_snapshot(_snapshot) is None):
+                _snapshot = build_snapshot()
+        except Exception as e:
+            _last_error = str(e)
+            logger.exception("Analytics snapshot update failed")
+            raise
+        _last_error = None
+        return _snapshot
+
+
+def _update_in_background(max_age: Optional[float]) -> None:
+    try:
+        update_snapshot(max_age)
+    except Exception:
+        pass  # logged by update_snapshot, the next query tries again
+
+
+def get_snapshot(max_age: Optional[float] = None) -> Snapshot:
+    """The current snapshot, without waiting for a build or refresh
+
+    A stale snapshot is still served while a background thread updates
+    it. Raises SnapshotUnavailable until the first build has finished.
+    """
+    snapshot = _snapshot
+    if _due(snapshot, max_age, False) and not _update_lock.locked():
+        threading.Thread(target=_update_in_background, args=(max_age,), name="analytics-update", daemon=True).start()
+    if snapshot is None:
+        raise SnapshotUnavailable(_last_error or "Analytics snapshot is still being built")
+    return snapshot
@@ -0,0 +1,77 @@
+"""Background delivery of email campaigns
+
+POST /email/send_emails writes the campaign item and hands delivery to a
+job. The job pages over the whole audience -- the filter's OpenSearch
+matches through a point in time, or the segment's member buckets -- and
+sends one EMAIL_LOG_CHUNK_SIZE batch at a time. Each batch's logs are
+written once, with the result of the send, and added to the campaign's
+counters, so a campaign interrupted mid-send shows exactly which
+recipients were reached; the ones without a log were never tried.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional
+from fastapi.concurrency import run_in_threadpool
+from app.config import settings
+from app.models import EmailStatusEnum, UserFilter
+from app.services.db.session import email_table
+from app.services.email_logs import record_batch
+from app.services.email_sender import send_bulk_emails
+from app.services.export import search_user_records
+from app.services.jobs import Progress
+from app.services.opensearch.queries import user_query
+from app.services.segments import member_buckets
+
+
+async def audience(segment_id: Optional[str], filter: Optional[UserFilter]) -> AsyncIterator[Dict[str, str]]:
+    """Pages of recipient emails by user id, from a segment's buckets or the filter's matches"""
+    if segment_id:
+        buckets = member_buckets(segment_id)
+        while (bucket := await run_in_threadpool(next, buckets, None)) is not None:
+            yield bucket
+        return
+    async for page in search_user_records(user_query(filter), ["email"]):
+        yield {doc["id"]: doc.get("email") for doc in page}
+
+
+def _finish(email_id: str, status: EmailStatusEnum, recipients: int) -> None:
+    pk = f"email#{email_id}"
+    email_table.update_item(
+        Key={"PK": pk, "SK": pk},
+        UpdateExpression="SET #s = :status, totalRecipients = :total",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":status": status.value, ":total": recipients},
+    )
+
+
+async def _deliver_batch(email_id: str, index: int, batch: Dict[str, Optional[str]], subject: str, body: str,
+                         created_at: datetime) -> Counter:
+    """Send one batch and log its results; recipients without an address fail without a send"""
+    emails = [email for email in batch.values() if email]
+    results = await run_in_threadpool(send_bulk_emails, emails, subject=subject, body=body) if emails else {}
+    statuses = {user_id: results.get(email, EmailStatusEnum.error) if email else EmailStatusEnum.error
+                for user_id, email in batch.items()}
+    await run_in_threadpool(record_batch, email_id, index, statuses, created_at)
+    return Counter(EmailStatusEnum(status) for status in statuses.values())
+
+
+async def deliver_campaign(email_id: str, segment_id: Optional[str], filter: Optional[UserFilter], subject: str,
+                           body: str, created_at: datetime, total: int, progress: Progress) -> None:
+    """Send the campaign to its whole audience batch by batch, logging each batch once it is sent"""
+    await progress(total=total, processed=0)
+    size = settings.email.log_chunk_size
+    delivered, batch, index, processed, addressed = Counter(), {}, 0, 0, 0
+    async for page in audience(segment_id, filter):
+        for user_id, email in page.items():
+            batch[user_id] = email
+            addressed += bool(email)
+            if len(batch) < size:
+                continue
+            delivered.update(await _deliver_batch(email_id, index, batch, subject, body, created_at))
+            index, processed, batch = index + 1, processed + len(batch), {}
+            await progress(processed=processed)
+    if batch:
+        delivered.update(await _deliver_batch(email_id, index, batch, subject, body, created_at))
+        await progress(processed=processed + len(batch))
+    reached = delivered[EmailStatusEnum.sent] or not addressed
+    await run_in_threadpool(_finish, email_id, EmailStatusEnum.sent if reached else EmailStatusEnum.error, addressed)
@@ -0,0 +1,59 @@
+from collections import Counter
+from boto3.dynamodb.conditions import Key, Attr
+from fastapi.concurrency import run_in_threadpool
+from app.services.db.session import email_table, MAIN_TABLE_NAME, EMAIL_TABLE_NAME
+from app.services.db.scan import query_pages
+from app.services.db.batch import batch_delete_keys
+from app.services.counters import adjust_user_counters
+from app.services.jobs import Progress
+
+KEY_ONLY = {"ProjectionExpression": "PK, SK"}
+
+
+async def _delete_pages(pages, progress: Progress, processed: int = 0,
+                        table_name: str = MAIN_TABLE_NAME, on_page=None) -> int:
+    """Delete every item of a paged query page by page, reporting progress"""
+    while True:
+        page = await run_in_threadpool(next, pages, None)
+        if page is None:
+            return processed
+        keys = [{"PK": item["PK"], "SK": item["SK"]} for item in page]
+        if keys:
+            await batch_delete_keys(keys, table_name)
+            if on_page:
+                await on_page(keys)
+            processed += len(keys)
+            await progress(processed=processed)
+
+
+async def cascade_delete_event(event_id: str, progress: Progress) -> None:
+    """Remove an event's attendance rows and take them off attendees' attendedCount"""
+    pages = query_pages(
+        IndexName="SKIndex",
+        KeyConditionExpression=Key("SK").eq(f"event#{event_id}"),
+        FilterExpression=Attr("type").eq("attendance"),
+        **KEY_ONLY,
+    )
+
+    async def uncount(keys: list):
+        deltas = Counter(key["PK"].split("#", 1)[1] for key in keys)
+        await adjust_user_counters("attendedCount", {user_id: -n for user_id, n in deltas.items()})
+
+    await _delete_pages(pages, progress, on_page=uncount)
+
+
+async def cascade_delete_user(user_id: str, progress: Progress) -> None:
+    """Remove a user's attendance rows and email logs"""
+    attendance = query_pages(
+        KeyConditionExpression=Key("PK").eq(f"user#{user_id}") & Key("SK").begins_with("event#"),
+        **KEY_ONLY,
+    )
+    processed = await _delete_pages(attendance, progress)
+
+    email_logs = query_pages(
+        email_table,
+        IndexName="UserIndex",
+        KeyConditionExpression=Key("SK").eq(f"user#{user_id}"),
+        **KEY_ONLY,
+    )
+    await _delete_pages(email_logs, progress, processed, table_name=EMAIL_TABLE_NAME)
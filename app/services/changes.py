@@ -0,0 +1,96 @@
+"""Propagation of user and event changes to derived views
+
+Write paths report the ids they changed with `users_changed` and
+`events_changed`. Saved segments are updated right away. The ids are also
+appended to a change log in the main table, CHANGELOG_SHARDS
+`changelog#{hour}#{shard}` partitions per UTC hour so that every write in
+the system does not land on one partition, with items expiring after
+CHANGELOG_TTL. The analytics snapshot of every worker replays the log to
+refresh incrementally. Throttled log writes are retried; neither step
+fails the write it follows, and a view that missed a change is repaired
+by its next full rebuild.
+"""
+import logging
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Tuple
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from app.services.db.batch import MAX_ATTEMPTS, _backoff
+from app.services.db.scan import query_pages
+from app.services.db.session import table
+from app.services.segments import sync_members
+
+logger = logging.getLogger(__name__)
+
+CHANGELOG_TTL = 86400
+CHANGELOG_SHARDS = 8
+THROTTLED = ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded")
+
+
+def _partition(moment: datetime, shard: int) -> str:
+    return f"changelog#{moment.strftime('%Y%m%d%H')}#{shard}"
+
+
+def record_changes(users: Iterable[str] = (), events: Iterable[str] = ()) -> None:
+    users, events = sorted(set(filter(None, users))), sorted(set(filter(None, events)))
+    if not users and not events:
+        return
+    now = datetime.now(timezone.utc)
+    entry_id = uuid.uuid4().hex
+    # No `type`: the log stays out of TypeIndex
+    item = {"PK": _partition(now, zlib.crc32(entry_id.encode()) % CHANGELOG_SHARDS),
+            "SK": f"{now.isoformat()}#{entry_id}", "expiresAt": int(time.time()) + CHANGELOG_TTL}
+    if users:
+        item["users"] = users
+    if events:
+        item["events"] = events
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            table.put_item(Item=item)
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLED or attempt == MAX_ATTEMPTS - 1:
+                error = e
+                break
+            _backoff(attempt)
+        except Exception as e:
+            error = e
+            break
+    logger.warning(f"Change log write failed for {len(users)} users and {len(events)} events: {error}")
+
+
+def users_changed(user_ids: Iterable[str]) -> None:
+    user_ids = list(user_ids)
+    sync_members(user_ids)
+    record_changes(users=user_ids)
+
+
+def events_changed(event_ids: Iterable[str]) -> None:
+    record_changes(events=event_ids)
+
+
+def read_changes(since: datetime) -> Tuple[set, set, int]:
+    """Users and events changed at or after `since`, and how many log items held them
+
+    Replaying a change twice is harmless, so callers pass a `since` with
+    some overlap to cover clock skew between writers.
+    """
+    now = datetime.now(timezone.utc)
+    if now - since > timedelta(seconds=CHANGELOG_TTL):
+        raise ValueError("Change log does not reach back that far")
+    users, events, entries = set(), set(), 0
+    hour = since.replace(minute=0, second=0, microsecond=0)
+    while hour <= now:
+        for shard in range(CHANGELOG_SHARDS):
+            pages = query_pages(KeyConditionExpression=Key("PK").eq(_partition(hour, shard))
+                                & Key("SK").gte(since.isoformat()))
+            for page in pages:
+                for item in page:
+                    users.update(item.get("users", []))
+                    events.update(item.get("events", []))
+                    entries += 1
+        hour += timedelta(hours=1)
+    return users, events, entries
@@ -0,0 +1,52 @@
+"""Single-flight coalescing of identical concurrent reads
+
+While a backend read for a key is in flight, further callers with the same
+key await that call instead of starting their own, so a burst of identical
+requests costs one DynamoDB/OpenSearch round trip. Results are shared
+between callers and must not be mutated.
+"""
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Hashable
+from app.config import settings
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._inflight: dict = {}
+        self.requests = Counter()
+        self.backend_calls = Counter()
+
+    async def do(self, scope: str, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()`, or the in-flight call already running for (scope, key)"""
+        self.requests[scope] += 1
+        if not self.enabled:
+            self.backend_calls[scope] += 1
+            return await fn()
+
+        flight_key = (scope, key)
+        task = self._inflight.get(flight_key)
+        if task is None:
+            self.backend_calls[scope] += 1
+            # The call runs as its own task so a disconnecting caller
+            # cancels only its own wait, not the read the others share
+            task = asyncio.ensure_future(fn())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        return await asyncio.shield(task)
+
+    def metrics(self) -> dict:
+        scopes = {}
+        for scope, requests in self.requests.items():
+            calls = self.backend_calls[scope]
+            scopes[scope] = {
+                "requests": requests,
+                "backend_calls": calls,
+                "coalesced": requests - calls,
+                "coalescing_ratio": round((requests - calls) / requests, 4) if requests else 0.0,
+            }
+        return {"enabled": self.enabled, "in_flight": len(self._inflight), "scopes": scopes}
+
+
+single_flight = SingleFlight(enabled=settings.app.coalesce_reads)
@@ -0,0 +1,48 @@
+import asyncio
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+from app.services.db.session import table
+from app.services.opensearch.indices import USERS_INDEX
+from app.services.opensearch.sync import update_docs
+from app.services.changes import users_changed
+
+# update_item calls allowed in flight per adjust_user_counters() call
+COUNTER_CONCURRENCY = 16
+
+
+def _adjust(field: str, user_id: str, delta: int):
+    pk = f"user#{user_id}"
+    try:
+        res = table.update_item(
+            Key={"PK": pk, "SK": pk},
+            UpdateExpression="SET #c = if_not_exists(#c, :zero) + :delta",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={"#c": field},
+            ExpressionAttributeValues={":delta": delta, ":zero": 0},
+            ReturnValues="UPDATED_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None  # user was deleted meanwhile
+        raise
+    return res["Attributes"][field]
+
+
+async def adjust_user_counters(field: str, deltas: dict) -> dict:
+    """Apply aggregated counter deltas, one update per user, and sync them to OpenSearch
+
+    Returns the new counter value of every user that still exists.
+    """
+    semaphore = asyncio.Semaphore(COUNTER_CONCURRENCY)
+
+    async def adjust(user_id: str, delta: int):
+        async with semaphore:
+            return user_id, await run_in_threadpool(_adjust, field, user_id, delta)
+
+    results = await asyncio.gather(*(adjust(u, d) for u, d in deltas.items() if d))
+    new_values = {user_id: int(value) for user_id, value in results if value is not None}
+
+    if new_values:
+        await run_in_threadpool(update_docs, USERS_INDEX, {user_id: {field: value} for user_id, value in new_values.items()})
+        await run_in_threadpool(users_changed, new_values)
+    return new_values
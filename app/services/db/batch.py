@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from app.services.db.session import dynamodb, MAIN_TABLE_NAME
+from app.services.db.expressions import build_projection
+from app.serialization import stored_record
+
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+MAX_ATTEMPTS = 5
+# BatchWriteItem calls allowed in flight per batch_write_items() call
+WRITE_CONCURRENCY = 8
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _backoff(attempt: int):
+    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+
+
+def batch_get_chunk(table_name: str, keys: list, projection: dict) -> list:
+    request = {table_name: {"Keys": keys, **projection}}
+    items = []
+    for attempt in range(MAX_ATTEMPTS):
+        res = dynamodb.batch_get_item(RequestItems=request)
+        items.extend(res.get("Responses", {}).get(table_name, []))
+        request = res.get("UnprocessedKeys") or {}
+        if not request:
+            return items
+        _backoff(attempt)
+    raise RuntimeError(f"BatchGetItem left {len(request[table_name]['Keys'])} keys unprocessed after retries")
+
+
+async def batch_get_items(keys: list, table_name: str = MAIN_TABLE_NAME,
+                          fields: Optional[list] = None) -> dict:
+    """Fetch keys in concurrent 100-key BatchGetItem chunks
+
+    Unprocessed keys are retried with backoff. Returns items by (PK, SK);
+    missing items are simply absent.
+    """
+    unique = list({(k["PK"], k["SK"]): k for k in keys}.values())
+    projection = build_projection(fields) if fields else {}
+    results = await asyncio.gather(*(
+        run_in_threadpool(batch_get_chunk, table_name, chunk, projection)
+        for chunk in chunks(unique, BATCH_GET_LIMIT)
+    ))
+    return {(item["PK"], item["SK"]): item for chunk in results for item in chunk}
+
+
+def batch_write_chunk(table_name: str, requests: list) -> None:
+    request = {table_name: requests}
+    for attempt in range(MAX_ATTEMPTS):
+        res = dynamodb.batch_write_item(RequestItems=request)
+        request = res.get("UnprocessedItems") or {}
+        if not request:
+            return
+        _backoff(attempt)
+    raise RuntimeError(f"BatchWriteItem left {len(request[table_name])} writes unprocessed after retries")
+
+
+async def batch_write_items(requests: list, table_name: str = MAIN_TABLE_NAME) -> None:
+    """Run PutRequest/DeleteRequest writes in concurrent 25-item BatchWriteItem chunks"""
+    semaphore = asyncio.Semaphore(WRITE_CONCURRENCY)
+
+    async def write(chunk: list):
+        async with semaphore:
+            await run_in_threadpool(batch_write_chunk, table_name, chunk)
+
+    await asyncio.gather(*(write(chunk) for chunk in chunks(requests, BATCH_WRITE_LIMIT)))
+
+
+async def batch_delete_keys(keys: list, table_name: str = MAIN_TABLE_NAME) -> None:
+    unique = list({(k["PK"], k["SK"]): k for k in keys}.values())
+    await batch_write_items([{"DeleteRequest": {"Key": key}} for key in unique], table_name)
+
+
+async def fetch_records(model: type, prefix: str, ids: list, fields: Optional[list] = None) -> dict:
+    """Response records of `model` for entity ids stored under `prefix#id`, keyed by id"""
+    items = await batch_get_items([{"PK": f"{prefix}#{i}", "SK": f"{prefix}#{i}"} for i in ids], fields=fields)
+    records = {}
+    for item in items.values():
+        record = stored_record(model, item, fields)
+        records[record["id"]] = record
+    return records
@@ -0,0 +1,40 @@
+from typing import Optional
+
+
+def build_update_expression(changes: dict) -> dict:
+    """Build update_item kwargs that SET changed fields and REMOVE fields set to None"""
+    set_parts, remove_parts = [], []
+    names, values = {}, {}
+    for i, (field, value) in enumerate(changes.items()):
+        names[f"#f{i}"] = field
+        if value is None:
+            remove_parts.append(f"#f{i}")
+        else:
+            set_parts.append(f"#f{i} = :v{i}")
+            values[f":v{i}"] = value
+
+    clauses = []
+    if set_parts:
+        clauses.append("SET " + ", ".join(set_parts))
+    if remove_parts:
+        clauses.append("REMOVE " + ", ".join(remove_parts))
+
+    kwargs = {"UpdateExpression": " ".join(clauses), "ExpressionAttributeNames": names}
+    if values:
+        kwargs["ExpressionAttributeValues"] = values
+    return kwargs
+
+
+def build_projection(fields: list, names: Optional[dict] = None) -> dict:
+    """ProjectionExpression kwargs reading only `fields` plus the item key
+
+    `id` is skipped, models derive it from the key.
+    `names` are extra ExpressionAttributeNames (e.g. for a FilterExpression)
+    merged into the result.
+    """
+    attributes = dict.fromkeys(["PK", "SK", *(f for f in fields if f != "id")])
+    projection_names = {f"#p{i}": attr for i, attr in enumerate(attributes)}
+    return {
+        "ProjectionExpression": ", ".join(projection_names),
+        "ExpressionAttributeNames": {**(names or {}), **projection_names},
+    }
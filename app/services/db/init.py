@@ -1,7 +1,5 @@
-from .session import MAIN_TABLE_NAME, EMAIL_TABLE_NAME
-import boto3
+from .session import MAIN_TABLE_NAME, EMAIL_TABLE_NAME, dynamodb
 from botocore.exceptions import ClientError
-from botocore.config import Config
 from app.config import settings
 
 def create_tables():
@@ -13,20 +11,10 @@ def create_tables():
     
     print(f"Development environment detected. Creating tables for local development...")
     
-    # Create DynamoDB client for table creation (development only)
-    dynamodb_client = boto3.client(
-        'dynamodb',
-        region_name=settings.database.aws_region,
-        endpoint_url=settings.database.dynamodb_endpoint,
-        aws_access_key_id="dummy",
-        aws_secret_access_key="dummy",
-        config=Config(
-            retries={'max_attempts': settings.database.max_retries, 'mode': 'standard'},
-            connect_timeout=settings.database.connect_timeout,
-            read_timeout=settings.database.read_timeout
-        )
-    )
-    
+    # Table management goes through the session's client, so the memory
+    # backend gets its tables the same way DynamoDB Local does
+    dynamodb_client = dynamodb.meta.client
+
     try:
         dynamodb_client.create_table(
             TableName=MAIN_TABLE_NAME,
@@ -43,6 +31,7 @@ def create_tables():
                 {'AttributeName': 'type', 'AttributeType': 'S'},
                 {'AttributeName': 'email', 'AttributeType': 'S'},
                 {'AttributeName': 'slug', 'AttributeType': 'S'},
+                {'AttributeName': 'attendedAt', 'AttributeType': 'S'},
             ],
             GlobalSecondaryIndexes=[
                 {
@@ -96,10 +85,33 @@ def create_tables():
                     ],
                     'Projection': {'ProjectionType': 'ALL'},
                 },
+                # Sparse, only attendance rows carry attendedAt: an event's
+                # latest attendees and a user's latest check-ins
+                {
+                    'IndexName': 'EventAttendeesIndex',
+                    'KeySchema': [
+                        {'AttributeName': 'SK', 'KeyType': 'HASH'},
+                        {'AttributeName': 'attendedAt', 'KeyType': 'RANGE'},
+                    ],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                },
+                {
+                    'IndexName': 'UserAttendanceIndex',
+                    'KeySchema': [
+                        {'AttributeName': 'PK', 'KeyType': 'HASH'},
+                        {'AttributeName': 'attendedAt', 'KeyType': 'RANGE'},
+                    ],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                },
             ],
             BillingMode='PAY_PER_REQUEST'
         )
         print("CRM main table created with GSIs.")
+        # Idempotency records and retained attendance expire on their own
+        dynamodb_client.update_time_to_live(
+            TableName=MAIN_TABLE_NAME,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expiresAt'}
+        )
     except Exception as e:
         print(f"{MAIN_TABLE_NAME} creation skipped or failed: {e}")
 
@@ -113,7 +125,8 @@ def create_tables():
             AttributeDefinitions=[
                 {'AttributeName': 'PK', 'AttributeType': 'S'},
                 {'AttributeName': 'SK', 'AttributeType': 'S'},
-                {'AttributeName': 'type', 'AttributeType': 'S'}
+                {'AttributeName': 'type', 'AttributeType': 'S'},
+                {'AttributeName': 'campaignStatus', 'AttributeType': 'S'}
             ],
             GlobalSecondaryIndexes=[
                 {
@@ -137,11 +150,24 @@ def create_tables():
                         {'AttributeName': 'type', 'KeyType': 'HASH'}
                     ],
                     'Projection': {'ProjectionType': 'ALL'}
+                },
+                {
+                    'IndexName': 'StatusIndex',
+                    'KeySchema': [
+                        {'AttributeName': 'campaignStatus', 'KeyType': 'HASH'},
+                        {'AttributeName': 'SK', 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {'ProjectionType': 'ALL'}
                 }
             ],
             BillingMode='PAY_PER_REQUEST'
         )
         print(f"CRM {EMAIL_TABLE_NAME} table created with GSIs.")
+        # Delivery logs expire per RETENTION_EMAIL_LOG_DAYS
+        dynamodb_client.update_time_to_live(
+            TableName=EMAIL_TABLE_NAME,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expiresAt'}
+        )
     except Exception as e:
         print(f"{EMAIL_TABLE_NAME} creation skipped or failed: {e}")
 
@@ -151,22 +177,12 @@ def delete_table(table_name):
         print("Production environment detected. Table deletion not allowed - tables are managed by Terraform.")
         return
     
-    # Create client with environment-based configuration (development only)
-    dynamodb = boto3.client("dynamodb", 
-        region_name=settings.database.aws_region,
-        aws_access_key_id="dummy",
-        aws_secret_access_key="dummy",
-        config=Config(
-            retries={'max_attempts': 3, 'mode': 'standard'},
-            connect_timeout=settings.database.connect_timeout,
-            read_timeout=settings.database.read_timeout
-        ), 
-        endpoint_url=settings.database.dynamodb_endpoint)
-    
+    dynamodb_client = dynamodb.meta.client
+
     try:
-        dynamodb.delete_table(TableName=table_name)
+        dynamodb_client.delete_table(TableName=table_name)
         print(f"Deleting table: {table_name}...")
-        waiter = dynamodb.get_waiter('table_not_exists')
+        waiter = dynamodb_client.get_waiter('table_not_exists')
         waiter.wait(TableName=table_name)
         print(f" {table_name} deleted.")
     except ClientError as e:
@@ -175,6 +191,40 @@ def delete_table(table_name):
         else:
             raise
 
+def backfill_uniqueness_guards():
+    """Write email/slug guard items for users and events created before guards existed"""
+    from boto3.dynamodb.conditions import Key
+    from .session import table
+    from .transactions import email_guard_item, slug_guard_item, GUARD_RELEASE_CONDITION
+
+    guards = {
+        "user": lambda item: email_guard_item(item["email"], item["PK"].split("#", 1)[1]),
+        "event": lambda item: slug_guard_item(item["slug"], item["PK"].split("#", 1)[1]),
+    }
+    for item_type, make_guard in guards.items():
+        written = 0
+        kwargs = {"IndexName": "TypeIndex", "KeyConditionExpression": Key("type").eq(item_type)}
+        while True:
+            res = table.query(**kwargs)
+            for item in res.get("Items", []):
+                try:
+                    guard = make_guard(item)
+                    table.put_item(
+                        Item=guard,
+                        ConditionExpression=GUARD_RELEASE_CONDITION,
+                        ExpressionAttributeNames={"#ref": "ref"},
+                        ExpressionAttributeValues={":ref": guard["ref"]},
+                    )
+                    written += 1
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                    print(f"Guard already taken for {item['PK']}, resolve the duplicate manually.")
+            if "LastEvaluatedKey" not in res:
+                break
+            kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+        print(f"Backfilled {written} {item_type} guards.")
+
 def reset_all_table():
     try:
         print("Attempting to reset tables...")
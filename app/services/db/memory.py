@@ -0,0 +1,1153 @@
+"""In-process DynamoDB stand-in for tests and benchmarks
+
+Selected with DB_BACKEND=memory. It implements the slice of the boto3
+resource API the app uses -- Table get/put/update/delete/query/scan, batch
+get/write, and transactions and table management on `meta.client` -- with
+DynamoDB's expression language, GSIs, pagination and error codes, so code
+runs against it unchanged. Like DynamoDB it rejects reserved words used as
+attribute names and ExpressionAttributeNames/Values that no expression of
+the call uses. DB_MEMORY_LATENCY_MS adds a fixed delay to every call to
+model the network round trip.
+"""
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Optional
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer, Binary
+from botocore.exceptions import ClientError
+
+# Stand-in for DynamoDB's 1 MB page limit
+PAGE_ITEMS = 1000
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+TRANSACTION_LIMIT = 100
+
+MISSING = object()
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+class _ValidationError(Exception):
+    pass
+
+
+def _error(code: str, message: str, operation: str, **extra) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}, **extra}, operation)
+
+
+def _normalize(value: Any) -> Any:
+    """Round-trip a value through boto3's type serializer, as a real write would (ints become Decimal)"""
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+# ---------------------------------------------------------------------------
+# Expressions
+
+_TOKEN = re.compile(r"\s*(?:(#\w+)|(:\w+)|(\d+)|([A-Za-z_]\w*)|(<>|<=|>=|[=<>(),.\[\]+\-]))")
+_COMPARATORS = {"=", "<>", "<", "<=", ">", ">="}
+_CONDITION_FUNCTIONS = {"attribute_exists", "attribute_not_exists", "attribute_type", "begins_with", "contains"}
+_UPDATE_CLAUSES = {"SET", "REMOVE", "ADD", "DELETE"}
+# Words an expression cannot use as a bare attribute name
+_RESERVED_WORDS = frozenset("""
+ABORT ABSOLUTE ACTION ADD AFTER AGENT AGGREGATE ALL ALLOCATE ALTER ANALYZE AND ANY ARCHIVE ARE ARRAY AS ASC
+ASCII ASENSITIVE ASSERTION ASYMMETRIC AT ATOMIC ATTACH ATTRIBUTE AUTH AUTHORIZATION AUTHORIZE AUTO AVG BACK BACKUP
+BASE BATCH BEFORE BEGIN BETWEEN BIGINT BINARY BIT BLOB BLOCK BOOLEAN BOTH BREADTH BUCKET BULK BY BYTE CALL CALLED
+CALLING CAPACITY CASCADE CASCADED CASE CAST CATALOG CHAR CHARACTER CHECK CLASS CLOB CLOSE CLUSTER CLUSTERED
+CLUSTERING CLUSTERS COALESCE COLLATE COLLATION COLLECTION COLUMN COLUMNS COMBINE COMMENT COMMIT COMPACT COMPILE
+COMPRESS CONDITION CONFLICT CONNECT CONNECTION CONSISTENCY CONSISTENT CONSTRAINT CONSTRAINTS CONSTRUCTOR CONSUMED
+CONTINUE CONVERT COPY CORRESPONDING COUNT COUNTER CREATE CROSS CUBE CURRENT CURSOR CYCLE DATA DATABASE DATE
+DATETIME DAY DEALLOCATE DEC DECIMAL DECLARE DEFAULT DEFERRABLE DEFERRED DEFINE DEFINED DEFINITION DELETE DELIMITED
+DEPTH DEREF DESC DESCRIBE DESCRIPTOR DETACH DETERMINISTIC DIAGNOSTICS DIRECTORIES DISABLE DISCONNECT DISTINCT
+DISTRIBUTE DO DOMAIN DOUBLE DROP DUMP DURATION DYNAMIC EACH ELEMENT ELSE ELSEIF EMPTY ENABLE END EQUAL EQUALS ERROR
+ESCAPE ESCAPED EVAL EVALUATE EXCEEDED EXCEPT EXCEPTION EXCEPTIONS EXCLUSIVE EXEC EXECUTE EXISTS EXIT EXPLAIN
+EXPLODE EXPORT EXPRESSION EXTENDED EXTERNAL EXTRACT FAIL FALSE FAMILY FETCH FIELDS FILE FILTER FILTERING FINAL
+FINISH FIRST FIXED FLATTERN FLOAT FOR FORCE FOREIGN FORMAT FORWARD FOUND FREE FROM FULL FUNCTION FUNCTIONS GENERAL
+GENERATE GET GLOB GLOBAL GO GOTO GRANT GREATER GROUP GROUPING HANDLER HASH HAVE HAVING HEAP HIDDEN HOLD HOUR
+IDENTIFIED IDENTITY IF IGNORE IMMEDIATE IMPORT IN INCLUDING INCLUSIVE INCREMENT INCREMENTAL INDEX INDEXED INDEXES
+INDICATOR INFINITE INITIALLY INLINE INNER INNTER INOUT INPUT INSENSITIVE INSERT INSTEAD INT INTEGER INTERSECT
+INTERVAL INTO INVALIDATE IS ISOLATION ITEM ITEMS ITERATE JOIN KEY KEYS LAG LANGUAGE LARGE LAST LATERAL LEAD
+LEADING LEAVE LEFT LENGTH LESS LEVEL LIKE LIMIT LIMITED LINES LIST LOAD LOCAL LOCALTIME LOCALTIMESTAMP LOCATION
+LOCATOR LOCK LOCKS LOG LOGED LONG LOOP LOWER MAP MATCH MATERIALIZED MAX MAXLEN MEMBER MERGE METHOD METRICS MIN
+MINUS MINUTE MISSING MOD MODE MODIFIES MODIFY MODULE MONTH MULTI MULTISET NAME NAMES NATIONAL NATURAL NCHAR NCLOB
+NEW NEXT NO NONE NOT NULL NULLIF NUMBER NUMERIC OBJECT OF OFFLINE OFFSET OLD ON ONLINE ONLY OPAQUE OPEN OPERATOR
+OPTION OR ORDER ORDINALITY OTHER OTHERS OUT OUTER OUTPUT OVER OVERLAPS OVERRIDE OWNER PAD PARALLEL PARAMETER
+PARAMETERS PARTIAL PARTITION PARTITIONED PARTITIONS PATH PERCENT PERCENTILE PERMISSION PERMISSIONS PIPE PIPELINED
+PLAN POOL POSITION PRECISION PREPARE PRESERVE PRIMARY PRIOR PRIVATE PRIVILEGES PROCEDURE PROCESSED PROJECT
+PROJECTION PROPERTY PROVISIONING PUBLIC PUT QUERY QUIT QUORUM RAISE RANDOM RANGE RANK RAW READ READS REAL REBUILD
+RECORD RECURSIVE REDUCE REF REFERENCE REFERENCES REFERENCING REGEXP REGION REINDEX RELATIVE RELEASE REMAINDER
+RENAME REPEAT REPLACE REQUEST RESET RESIGNAL RESOURCE RESPONSE RESTORE RESTRICT RESULT RETURN RETURNING RETURNS
+REVERSE REVOKE RIGHT ROLE ROLES ROLLBACK ROLLUP ROUTINE ROW ROWS RULE RULES SAMPLE SATISFIES SAVE SAVEPOINT SCAN
+SCHEMA SCOPE SCROLL SEARCH SECOND SECTION SEGMENT SEGMENTS SELECT SELF SEMI SENSITIVE SEPARATE SEQUENCE
+SERIALIZABLE SESSION SET SETS SHARD SHARE SHARED SHORT SHOW SIGNAL SIMILAR SIZE SKEWED SMALLINT SNAPSHOT SOME
+SOURCE SPACE SPACES SPARSE SPECIFIC SPECIFICTYPE SPLIT SQL SQLCODE SQLERROR SQLEXCEPTION SQLSTATE SQLWARNING START
+STATE STATIC STATUS STORAGE STORE STORED STREAM STRING STRUCT STYLE SUB SUBMULTISET SUBPARTITION SUBSTRING SUBTYPE
+SUM SUPER SYMMETRIC SYNONYM SYSTEM TABLE TABLESAMPLE TEMP TEMPORARY TERMINATED TEXT THAN THEN THROUGHPUT TIME
+TIMESTAMP TIMEZONE TINYINT TO TOKEN TOTAL TOUCH TRAILING TRANSACTION TRANSFORM TRANSLATE TRANSLATION TREAT TRIGGER
+TRIM TRUE TRUNCATE TTL TUPLE TYPE UNDER UNDO UNION UNIQUE UNIT UNKNOWN UNLOGGED UNNEST UNPROCESSED UNSIGNED UNTIL
+UPDATE UPPER URL USAGE USE USER USERS USING UUID VACUUM VALUE VALUED VALUES VARCHAR VARIABLE VARIANCE VARINT
+VARYING VIEW VIEWS VIRTUAL VOID WAIT WHEN WHENEVER WHERE WHILE WINDOW WITH WITHIN WITHOUT WORK WRAPPED WRITE YEAR
+ZONE
+""".split())
+
+
+@lru_cache(maxsize=4096)
+def _placeholders(expression: str) -> frozenset:
+    """The #name and :value placeholders an expression refers to"""
+    return frozenset(value for kind, value in _tokenize(expression) if kind in ("name", "value"))
+
+
+def _tokenize(expression: str) -> list:
+    tokens, pos = [], 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = _TOKEN.match(expression, pos)
+        if not m or m.end() == pos:
+            raise _ValidationError(f"Invalid expression: unexpected token at '{expression[pos:pos + 10]}'")
+        kind = ("name", "value", "number", "ident", "op")[m.lastindex - 1]
+        tokens.append((kind, m.group(m.lastindex)))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser producing tuple ASTs"""
+
+    def __init__(self, expression: str, names: dict):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names
+
+    def peek(self, offset: int = 0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise _ValidationError("Invalid expression: unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def expect(self, text: str):
+        kind, value = self.next()
+        if value != text and (kind != "ident" or value.upper() != text):
+            raise _ValidationError(f"Invalid expression: expected '{text}', got '{value}'")
+
+    def keyword(self, word: str) -> bool:
+        kind, value = self.peek()
+        if kind == "ident" and value.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def done(self):
+        if self.peek()[0] is not None:
+            raise _ValidationError(f"Invalid expression: unexpected token '{self.peek()[1]}'")
+
+    # paths and operands
+
+    def name(self) -> str:
+        kind, value = self.next()
+        if kind == "name":
+            if value not in self.names:
+                raise _ValidationError(f"An expression attribute name used in the document path is not defined; attribute name: {value}")
+            return self.names[value]
+        if kind == "ident":
+            if value.upper() in _RESERVED_WORDS:
+                raise _ValidationError(f"Invalid expression: Attribute name is a reserved keyword; reserved keyword: {value}")
+            return value
+        raise _ValidationError(f"Invalid expression: expected an attribute name, got '{value}'")
+
+    def path(self) -> tuple:
+        elements = [self.name()]
+        while True:
+            if self.peek()[1] == ".":
+                self.next()
+                elements.append(self.name())
+            elif self.peek()[1] == "[":
+                self.next()
+                kind, value = self.next()
+                if kind != "number":
+                    raise _ValidationError("Invalid expression: list index must be a number")
+                elements.append(int(value))
+                self.expect("]")
+            else:
+                return ("path", tuple(elements))
+
+    def operand(self) -> tuple:
+        kind, value = self.peek()
+        if kind == "value":
+            self.next()
+            return ("value", value)
+        if kind == "ident" and value.lower() == "size" and self.peek(1)[1] == "(":
+            self.next()
+            self.expect("(")
+            path = self.path()
+            self.expect(")")
+            return ("size", path)
+        return self.path()
+
+    # conditions
+
+    def condition(self) -> tuple:
+        node = self.conjunction()
+        while self.keyword("OR"):
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self) -> tuple:
+        node = self.negation()
+        while self.keyword("AND"):
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self) -> tuple:
+        if self.keyword("NOT"):
+            return ("not", self.negation())
+        return self.predicate()
+
+    def predicate(self) -> tuple:
+        kind, value = self.peek()
+        if value == "(":
+            self.next()
+            node = self.condition()
+            self.expect(")")
+            return node
+        if kind == "ident" and value.lower() in _CONDITION_FUNCTIONS and self.peek(1)[1] == "(":
+            self.next()
+            self.expect("(")
+            args = [self.operand()]
+            while self.peek()[1] == ",":
+                self.next()
+                args.append(self.operand())
+            self.expect(")")
+            return ("func", value.lower(), tuple(args))
+
+        left = self.operand()
+        kind, value = self.peek()
+        if value in _COMPARATORS:
+            self.next()
+            return ("cmp", value, left, self.operand())
+        if self.keyword("BETWEEN"):
+            low = self.operand()
+            self.expect("AND")
+            return ("between", left, low, self.operand())
+        if self.keyword("IN"):
+            self.expect("(")
+            options = [self.operand()]
+            while self.peek()[1] == ",":
+                self.next()
+                options.append(self.operand())
+            self.expect(")")
+            return ("in", left, tuple(options))
+        raise _ValidationError(f"Invalid expression: expected a comparison, got '{value}'")
+
+    # update expressions
+
+    def update(self) -> list:
+        actions = []
+        seen = set()
+        while self.peek()[0] is not None:
+            kind, clause = self.next()
+            clause = clause.upper()
+            if kind != "ident" or clause not in _UPDATE_CLAUSES or clause in seen:
+                raise _ValidationError(f"Invalid UpdateExpression: unexpected token '{clause}'")
+            seen.add(clause)
+            while True:
+                path = self.path()
+                if clause == "SET":
+                    self.expect("=")
+                    actions.append((clause, path[1], self.set_value()))
+                elif clause == "REMOVE":
+                    actions.append((clause, path[1], None))
+                else:
+                    actions.append((clause, path[1], self.operand()))
+                if self.peek()[1] != ",":
+                    break
+                self.next()
+        if not actions:
+            raise _ValidationError("Invalid UpdateExpression: The expression can not be empty")
+        return actions
+
+    def set_value(self) -> tuple:
+        left = self.set_operand()
+        if self.peek()[1] in ("+", "-"):
+            op = self.next()[1]
+            return ("arith", op, left, self.set_operand())
+        return left
+
+    def set_operand(self) -> tuple:
+        kind, value = self.peek()
+        if kind == "ident" and value in ("if_not_exists", "list_append") and self.peek(1)[1] == "(":
+            self.next()
+            self.expect("(")
+            first = self.set_operand() if value == "list_append" else self.path()
+            self.expect(",")
+            second = self.set_operand()
+            self.expect(")")
+            return (value, first, second)
+        return self.operand()
+
+
+def _get_path(item: dict, path: tuple) -> Any:
+    value = item
+    for element in path:
+        if isinstance(element, int):
+            if not isinstance(value, list) or element >= len(value):
+                return MISSING
+            value = value[element]
+        else:
+            if not isinstance(value, dict) or element not in value:
+                return MISSING
+            value = value[element]
+    return value
+
+
+def _set_path(item: dict, path: tuple, value: Any):
+    parent = _get_path(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int) and isinstance(parent, list):
+        if last < len(parent):
+            parent[last] = value
+        else:
+            parent.append(value)
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent[last] = value
+    else:
+        raise _ValidationError("The document path provided in the update expression is invalid for update")
+
+
+def _remove_path(item: dict, path: tuple):
+    parent = _get_path(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int) and isinstance(parent, list) and last < len(parent):
+        del parent[last]
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+def _type_code(value: Any) -> str:
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, (int, Decimal)):
+        return "N"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, (bytes, Binary)):
+        return "B"
+    if value is None:
+        return "NULL"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, set):
+        sample = next(iter(value))
+        return {"N": "NS", "S": "SS", "B": "BS"}[_type_code(sample)]
+    return "?"
+
+
+def _compare(op: str, a: Any, b: Any) -> bool:
+    if a is MISSING or b is MISSING:
+        return False
+    same_type = _type_code(a) == _type_code(b)
+    if op == "=":
+        return same_type and a == b
+    if op == "<>":
+        return not same_type or a != b
+    if not same_type or _type_code(a) not in ("N", "S", "B"):
+        return False
+    if op == "<":
+        return a < b
+    if op == "<=":
+        return a <= b
+    if op == ">":
+        return a > b
+    return a >= b
+
+
+def _compile_operand(node: tuple):
+    kind = node[0]
+    if kind == "path":
+        path = node[1]
+        return lambda item, values: _get_path(item, path)
+    if kind == "value":
+        placeholder = node[1]
+
+        def value(item, values):
+            if placeholder not in values:
+                raise _ValidationError(f"An expression attribute value used in expression is not defined; attribute value: {placeholder}")
+            return values[placeholder]
+        return value
+    if kind == "size":
+        path = node[1][1]
+
+        def size(item, values):
+            value = _get_path(item, path)
+            if isinstance(value, (str, bytes, list, dict, set)):
+                return Decimal(len(value))
+            return MISSING
+        return size
+    raise _ValidationError(f"Invalid operand {kind}")
+
+
+def _compile_condition(node: tuple):
+    kind = node[0]
+    if kind == "and":
+        left, right = _compile_condition(node[1]), _compile_condition(node[2])
+        return lambda item, values: left(item, values) and right(item, values)
+    if kind == "or":
+        left, right = _compile_condition(node[1]), _compile_condition(node[2])
+        return lambda item, values: left(item, values) or right(item, values)
+    if kind == "not":
+        inner = _compile_condition(node[1])
+        return lambda item, values: not inner(item, values)
+    if kind == "cmp":
+        op, left, right = node[1], _compile_operand(node[2]), _compile_operand(node[3])
+        return lambda item, values: _compare(op, left(item, values), right(item, values))
+    if kind == "between":
+        subject, low, high = (_compile_operand(n) for n in node[1:])
+
+        def between(item, values):
+            value = subject(item, values)
+            return _compare(">=", value, low(item, values)) and _compare("<=", value, high(item, values))
+        return between
+    if kind == "in":
+        subject = _compile_operand(node[1])
+        options = [_compile_operand(n) for n in node[2]]
+
+        def in_(item, values):
+            value = subject(item, values)
+            return any(_compare("=", value, option(item, values)) for option in options)
+        return in_
+    if kind == "func":
+        name, args = node[1], [_compile_operand(n) for n in node[2]]
+        if name == "attribute_exists":
+            return lambda item, values: args[0](item, values) is not MISSING
+        if name == "attribute_not_exists":
+            return lambda item, values: args[0](item, values) is MISSING
+        if name == "attribute_type":
+            return lambda item, values: (
+                args[0](item, values) is not MISSING
+                and _type_code(args[0](item, values)) == args[1](item, values)
+            )
+        if name == "begins_with":
+            def begins_with(item, values):
+                value, prefix = args[0](item, values), args[1](item, values)
+                if isinstance(value, str) and isinstance(prefix, str):
+                    return value.startswith(prefix)
+                if isinstance(value, (bytes, Binary)) and isinstance(prefix, (bytes, Binary)):
+                    return bytes(value).startswith(bytes(prefix))
+                return False
+            return begins_with
+        if name == "contains":
+            def contains(item, values):
+                value, operand = args[0](item, values), args[1](item, values)
+                if isinstance(value, str) and isinstance(operand, str):
+                    return operand in value
+                if isinstance(value, (set, list)):
+                    return operand in value
+                return False
+            return contains
+    raise _ValidationError(f"Invalid condition {kind}")
+
+
+def _compile_set_value(node: tuple):
+    kind = node[0]
+    if kind == "arith":
+        op, left, right = node[1], _compile_set_value(node[2]), _compile_set_value(node[3])
+
+        def arith(item, values):
+            a, b = left(item, values), right(item, values)
+            if a is MISSING or b is MISSING:
+                raise _ValidationError("The provided expression refers to an attribute that does not exist in the item")
+            if _type_code(a) != "N" or _type_code(b) != "N":
+                raise _ValidationError("An operand in the update expression has an incorrect data type")
+            return a + b if op == "+" else a - b
+        return arith
+    if kind == "if_not_exists":
+        path, fallback = node[1][1], _compile_set_value(node[2])
+
+        def if_not_exists(item, values):
+            value = _get_path(item, path)
+            return fallback(item, values) if value is MISSING else value
+        return if_not_exists
+    if kind == "list_append":
+        first, second = _compile_set_value(node[1]), _compile_set_value(node[2])
+
+        def list_append(item, values):
+            a, b = first(item, values), second(item, values)
+            if not isinstance(a, list) or not isinstance(b, list):
+                raise _ValidationError("An operand in the update expression has an incorrect data type")
+            return a + b
+        return list_append
+    operand = _compile_operand(node)
+
+    def plain_operand(item, values):
+        value = operand(item, values)
+        if value is MISSING:
+            raise _ValidationError("The provided expression refers to an attribute that does not exist in the item")
+        return value
+    return plain_operand
+
+
+@lru_cache(maxsize=4096)
+def _parse_condition(expression: str, names: tuple):
+    parser = _Parser(expression, dict(names))
+    node = parser.condition()
+    parser.done()
+    return node, _compile_condition(node)
+
+
+@lru_cache(maxsize=4096)
+def _parse_update(expression: str, names: tuple):
+    parser = _Parser(expression, dict(names))
+    actions = [
+        (clause, path, _compile_set_value(value) if clause == "SET" else value and _compile_operand(value))
+        for clause, path, value in parser.update()
+    ]
+    return actions
+
+
+@lru_cache(maxsize=4096)
+def _parse_projection(expression: str, names: tuple) -> tuple:
+    parser = _Parser(expression, dict(names))
+    paths = [parser.path()[1]]
+    while parser.peek()[1] == ",":
+        parser.next()
+        paths.append(parser.path()[1])
+    parser.done()
+    return tuple(paths)
+
+
+def _project(item: dict, paths: tuple) -> dict:
+    result = {}
+    for path in paths:
+        top = path[0]
+        if len(path) == 1 or any(isinstance(e, int) for e in path):
+            if top in item:
+                result[top] = _copy(item[top])
+            continue
+        value = _get_path(item, path)
+        if value is MISSING:
+            continue
+        target = result
+        for element in path[:-1]:
+            target = target.setdefault(element, {})
+        target[path[-1]] = _copy(value)
+    return result
+
+
+class _Expressions:
+    """Expression arguments of one call, with boto3 condition objects built to strings"""
+
+    def __init__(self, kwargs: dict, operation: str):
+        self.names = dict(kwargs.get("ExpressionAttributeNames") or {})
+        self.values = {k: _normalize(v) for k, v in (kwargs.get("ExpressionAttributeValues") or {}).items()}
+        self.strings = {}
+        builder = ConditionExpressionBuilder()
+        for arg in ("KeyConditionExpression", "FilterExpression", "ConditionExpression"):
+            expression = kwargs.get(arg)
+            if isinstance(expression, ConditionBase):
+                built = builder.build_expression(expression, is_key_condition=arg == "KeyConditionExpression")
+                self.names.update(built.attribute_name_placeholders)
+                self.values.update({k: _normalize(v) for k, v in built.attribute_value_placeholders.items()})
+                expression = built.condition_expression
+            if expression:
+                self.strings[arg] = expression
+        if kwargs.get("UpdateExpression"):
+            self.strings["UpdateExpression"] = kwargs["UpdateExpression"]
+        if kwargs.get("ProjectionExpression"):
+            self.strings["ProjectionExpression"] = kwargs["ProjectionExpression"]
+        self._names_key = tuple(sorted(self.names.items()))
+        self._check_unused(kwargs, operation)
+
+    def _check_unused(self, kwargs: dict, operation: str):
+        """Reject given names and values that no expression refers to, as DynamoDB does"""
+        names = set(kwargs.get("ExpressionAttributeNames") or {})
+        values = set(kwargs.get("ExpressionAttributeValues") or {})
+        if not names and not values:
+            return
+        if not self.strings:
+            kind = "ExpressionAttributeNames" if names else "ExpressionAttributeValues"
+            raise _error("ValidationException", f"{kind} can only be specified when using expressions", operation)
+        try:
+            used = frozenset().union(*map(_placeholders, self.strings.values()))
+        except _ValidationError as e:
+            raise _error("ValidationException", str(e), operation)
+        for kind, given in (("ExpressionAttributeNames", names), ("ExpressionAttributeValues", values)):
+            unused = sorted(given - used)
+            if unused:
+                raise _error("ValidationException",
+                             f"Value provided in {kind} unused in expressions: keys: {{{', '.join(unused)}}}", operation)
+
+    def condition(self, arg: str):
+        expression = self.strings.get(arg)
+        if not expression:
+            return None, None
+        return _parse_condition(expression, self._names_key)
+
+    def check(self, arg: str, item: Optional[dict]) -> bool:
+        _, condition = self.condition(arg)
+        return condition is None or condition(item or {}, self.values)
+
+    def update(self) -> list:
+        return _parse_update(self.strings["UpdateExpression"], self._names_key)
+
+    def project(self, item: dict) -> dict:
+        expression = self.strings.get("ProjectionExpression")
+        if not expression:
+            return _copy(item)
+        return _project(item, _parse_projection(expression, self._names_key))
+
+
+# ---------------------------------------------------------------------------
+# Tables
+
+class _Index:
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str], projection: dict):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.projection = projection or {"ProjectionType": "ALL"}
+        self.partitions: dict = {}
+
+
+class _Table:
+    def __init__(self, definition: dict):
+        self.definition = definition
+        self.name = definition["TableName"]
+        self.hash_key, self.range_key = self._key_schema(definition["KeySchema"])
+        self.indexes = {}
+        for gsi in definition.get("GlobalSecondaryIndexes", []) + definition.get("LocalSecondaryIndexes", []):
+            hash_key, range_key = self._key_schema(gsi["KeySchema"])
+            self.indexes[gsi["IndexName"]] = _Index(gsi["IndexName"], hash_key, range_key, gsi.get("Projection"))
+        self.items: dict = {}
+        self.partitions: dict = {}
+        self.ttl_attribute: Optional[str] = None
+        self.created = time.time()
+
+    @staticmethod
+    def _key_schema(schema: list) -> tuple:
+        hash_key = next(k["AttributeName"] for k in schema if k["KeyType"] == "HASH")
+        range_key = next((k["AttributeName"] for k in schema if k["KeyType"] == "RANGE"), None)
+        return hash_key, range_key
+
+    @property
+    def key_attributes(self) -> tuple:
+        return (self.hash_key, self.range_key) if self.range_key else (self.hash_key,)
+
+    def key_of(self, key: dict, operation: str) -> tuple:
+        if set(key) != set(self.key_attributes):
+            raise _error("ValidationException", "The provided key element does not match the schema", operation)
+        for attr in self.key_attributes:
+            if _type_code(key[attr]) not in ("S", "N", "B"):
+                raise _error("ValidationException", "The provided key element does not match the schema", operation)
+        return (key[self.hash_key], key[self.range_key] if self.range_key else None)
+
+    def item_key(self, item: dict, operation: str) -> tuple:
+        missing = [attr for attr in self.key_attributes if attr not in item]
+        if missing:
+            raise _error("ValidationException", f"One or more parameter values were invalid: Missing the key {missing[0]} in the item", operation)
+        return self.key_of({attr: item[attr] for attr in self.key_attributes}, operation)
+
+    def get(self, key: tuple) -> Optional[dict]:
+        return self.items.get(key)
+
+    def write(self, key: tuple, item: Optional[dict]):
+        """Store or (with item=None) remove an item, keeping every index in step"""
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.partitions[key[0]].pop(key[1], None)
+            if not self.partitions[key[0]]:
+                del self.partitions[key[0]]
+            for index in self.indexes.values():
+                hash_value = old.get(index.hash_key)
+                bucket = index.partitions.get(hash_value) if hash_value is not None else None
+                if bucket is not None:
+                    bucket.pop(key, None)
+                    if not bucket:
+                        del index.partitions[hash_value]
+        if item is None:
+            return
+        self.items[key] = item
+        self.partitions.setdefault(key[0], {})[key[1]] = item
+        for index in self.indexes.values():
+            hash_value = item.get(index.hash_key)
+            if _type_code(hash_value) not in ("S", "N", "B"):
+                continue
+            if index.range_key and _type_code(item.get(index.range_key)) not in ("S", "N", "B"):
+                continue
+            index.partitions.setdefault(hash_value, {})[key] = item
+
+    def describe(self) -> dict:
+        return {
+            **{k: v for k, v in self.definition.items() if k != "TableName"},
+            "TableName": self.name,
+            "TableStatus": "ACTIVE",
+            "ItemCount": len(self.items),
+            "CreationDateTime": self.created,
+        }
+
+
+class _Store:
+    """Tables of one in-memory backend, guarded by a single lock"""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.lock = threading.RLock()
+        self.tables: dict = {}
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name: str, operation: str) -> _Table:
+        table = self.tables.get(name)
+        if table is None:
+            raise _error("ResourceNotFoundException", "Requested resource not found", operation)
+        return table
+
+
+class _Waiter:
+    def wait(self, **kwargs):
+        pass
+
+
+class MemoryDynamoDBClient:
+    """The low-level client calls the app makes through `dynamodb.meta.client`"""
+
+    def __init__(self, store: _Store):
+        self._store = store
+
+    def create_table(self, **kwargs) -> dict:
+        self._store.delay()
+        with self._store.lock:
+            if kwargs["TableName"] in self._store.tables:
+                raise _error("ResourceInUseException", f"Table already exists: {kwargs['TableName']}", "CreateTable")
+            table = _Table(kwargs)
+            self._store.tables[table.name] = table
+            return {"TableDescription": table.describe()}
+
+    def delete_table(self, TableName: str) -> dict:
+        self._store.delay()
+        with self._store.lock:
+            table = self._store.table(TableName, "DeleteTable")
+            del self._store.tables[TableName]
+            return {"TableDescription": {**table.describe(), "TableStatus": "DELETING"}}
+
+    def describe_table(self, TableName: str) -> dict:
+        self._store.delay()
+        with self._store.lock:
+            return {"Table": self._store.table(TableName, "DescribeTable").describe()}
+
+    def list_tables(self, **kwargs) -> dict:
+        self._store.delay()
+        with self._store.lock:
+            return {"TableNames": sorted(self._store.tables)}
+
+    def update_time_to_live(self, TableName: str, TimeToLiveSpecification: dict) -> dict:
+        self._store.delay()
+        with self._store.lock:
+            table = self._store.table(TableName, "UpdateTimeToLive")
+            enabled = TimeToLiveSpecification["Enabled"]
+            table.ttl_attribute = TimeToLiveSpecification["AttributeName"] if enabled else None
+            return {"TimeToLiveSpecification": TimeToLiveSpecification}
+
+    def get_waiter(self, name: str) -> _Waiter:
+        return _Waiter()
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Delete items whose TTL attribute has passed, as DynamoDB's TTL sweeper eventually would"""
+        now = time.time() if now is None else now
+        purged = 0
+        with self._store.lock:
+            for table in self._store.tables.values():
+                if not table.ttl_attribute:
+                    continue
+                for key, item in list(table.items.items()):
+                    expires = item.get(table.ttl_attribute)
+                    if _type_code(expires) == "N" and expires < now:
+                        table.write(key, None)
+                        purged += 1
+        return purged
+
+    def transact_write_items(self, TransactItems: list, **kwargs) -> dict:
+        self._store.delay()
+        if len(TransactItems) > TRANSACTION_LIMIT:
+            raise _error("ValidationException", f"Member must have length less than or equal to {TRANSACTION_LIMIT}", "TransactWriteItems")
+        with self._store.lock:
+            planned, reasons, seen = [], [], set()
+            for op in TransactItems:
+                (kind, args), = op.items()
+                table = self._store.table(args["TableName"], "TransactWriteItems")
+                expressions = _Expressions(args, "TransactWriteItems")
+                if kind == "Put":
+                    item = {k: _normalize(v) for k, v in args["Item"].items()}
+                    key = table.item_key(item, "TransactWriteItems")
+                else:
+                    key = table.key_of({k: _normalize(v) for k, v in args["Key"].items()}, "TransactWriteItems")
+                if (table.name, key) in seen:
+                    raise _error("ValidationException", "Transaction request cannot include multiple operations on one item", "TransactWriteItems")
+                seen.add((table.name, key))
+
+                existing = table.get(key)
+                try:
+                    passed = expressions.check("ConditionExpression", existing)
+                    if kind == "Put":
+                        new = item
+                    elif kind == "Delete":
+                        new = None
+                    elif kind == "Update":
+                        new = _apply_update(table, key, existing, expressions)
+                    elif kind == "ConditionCheck":
+                        new = existing
+                    else:
+                        raise _ValidationError(f"Unsupported transaction operation {kind}")
+                except _ValidationError as e:
+                    raise _error("ValidationException", str(e), "TransactWriteItems")
+                if passed:
+                    reasons.append({"Code": "None"})
+                else:
+                    reasons.append({"Code": "ConditionalCheckFailed", "Message": "The conditional request failed"})
+                if kind != "ConditionCheck":
+                    planned.append((table, key, new))
+
+            if any(r["Code"] != "None" for r in reasons):
+                codes = ", ".join(r["Code"] for r in reasons)
+                raise _error(
+                    "TransactionCanceledException",
+                    f"Transaction cancelled, please refer cancellation reasons for specific reasons [{codes}]",
+                    "TransactWriteItems",
+                    CancellationReasons=reasons,
+                )
+            for table, key, new in planned:
+                table.write(key, new)
+        return {}
+
+
+def _apply_update(table: _Table, key: tuple, existing: Optional[dict], expressions: _Expressions) -> dict:
+    """The item after applying UpdateExpression, all operands read from the item before the update"""
+    base = existing or {table.hash_key: key[0], **({table.range_key: key[1]} if table.range_key else {})}
+    new = _copy(base)
+    resolved = []
+    for clause, path, value in expressions.update():
+        if path[0] in table.key_attributes:
+            raise _ValidationError(f"One or more parameter values were invalid: Cannot update attribute {path[0]}. This attribute is part of the key")
+        resolved.append((clause, path, value(base, expressions.values) if value else None))
+    for clause, path, value in resolved:
+        if clause == "SET":
+            _set_path(new, path, value)
+        elif clause == "REMOVE":
+            _remove_path(new, path)
+        elif clause == "ADD":
+            current = _get_path(new, path)
+            if current is MISSING:
+                _set_path(new, path, value)
+            elif _type_code(current) == "N" and _type_code(value) == "N":
+                _set_path(new, path, current + value)
+            elif isinstance(current, set) and isinstance(value, set):
+                _set_path(new, path, current | value)
+            else:
+                raise _ValidationError("An operand in the update expression has an incorrect data type")
+        elif clause == "DELETE":
+            current = _get_path(new, path)
+            if isinstance(current, set) and isinstance(value, set):
+                remaining = current - value
+                if remaining:
+                    _set_path(new, path, remaining)
+                else:
+                    _remove_path(new, path)
+    return new
+
+
+class MemoryTable:
+    """boto3 `Table` resource over an in-memory table"""
+
+    def __init__(self, store: _Store, name: str):
+        self._store = store
+        self.name = name
+        self.table_name = name
+        self.meta = SimpleNamespace(client=MemoryDynamoDBClient(store))
+
+    @property
+    def table_status(self) -> str:
+        self._store.delay()
+        with self._store.lock:
+            self._store.table(self.name, "DescribeTable")
+        return "ACTIVE"
+
+    def _table(self, operation: str) -> _Table:
+        return self._store.table(self.name, operation)
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "GetItem")
+        with self._store.lock:
+            table = self._table("GetItem")
+            item = table.get(table.key_of({k: _normalize(v) for k, v in Key.items()}, "GetItem"))
+            if item is None:
+                return {}
+            try:
+                return {"Item": expressions.project(item)}
+            except _ValidationError as e:
+                raise _error("ValidationException", str(e), "GetItem")
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "PutItem")
+        item = {k: _normalize(v) for k, v in Item.items()}
+        with self._store.lock:
+            table = self._table("PutItem")
+            key = table.item_key(item, "PutItem")
+            existing = table.get(key)
+            self._check(expressions, existing, "PutItem")
+            table.write(key, item)
+        if kwargs.get("ReturnValues") == "ALL_OLD" and existing is not None:
+            return {"Attributes": _copy(existing)}
+        return {}
+
+    def update_item(self, Key: dict, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "UpdateItem")
+        with self._store.lock:
+            table = self._table("UpdateItem")
+            key = table.key_of({k: _normalize(v) for k, v in Key.items()}, "UpdateItem")
+            existing = table.get(key)
+            self._check(expressions, existing, "UpdateItem")
+            try:
+                new = _apply_update(table, key, existing, expressions)
+            except _ValidationError as e:
+                raise _error("ValidationException", str(e), "UpdateItem")
+            table.write(key, new)
+
+        return_values = kwargs.get("ReturnValues", "NONE")
+        if return_values == "ALL_NEW":
+            return {"Attributes": _copy(new)}
+        if return_values == "ALL_OLD":
+            return {"Attributes": _copy(existing)} if existing else {}
+        if return_values in ("UPDATED_NEW", "UPDATED_OLD"):
+            source = new if return_values == "UPDATED_NEW" else (existing or {})
+            touched = {path[0] for _, path, _ in expressions.update()}
+            return {"Attributes": {k: _copy(source[k]) for k in touched if k in source}}
+        return {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "DeleteItem")
+        with self._store.lock:
+            table = self._table("DeleteItem")
+            key = table.key_of({k: _normalize(v) for k, v in Key.items()}, "DeleteItem")
+            existing = table.get(key)
+            self._check(expressions, existing, "DeleteItem")
+            table.write(key, None)
+        if kwargs.get("ReturnValues") == "ALL_OLD" and existing is not None:
+            return {"Attributes": _copy(existing)}
+        return {}
+
+    @staticmethod
+    def _check(expressions: _Expressions, existing: Optional[dict], operation: str):
+        try:
+            passed = expressions.check("ConditionExpression", existing)
+        except _ValidationError as e:
+            raise _error("ValidationException", str(e), operation)
+        if not passed:
+            raise _error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    def query(self, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "Query")
+        with self._store.lock:
+            table = self._table("Query")
+            index = self._index(table, kwargs, "Query")
+            hash_key = index.hash_key if index else table.hash_key
+            try:
+                node, key_condition = expressions.condition("KeyConditionExpression")
+                if node is None:
+                    raise _ValidationError("Either the KeyConditions or KeyConditionExpression parameter must be specified in the request.")
+                hash_value = _hash_value(node, hash_key, expressions.values)
+                if index:
+                    candidates = list(index.partitions.get(hash_value, {}).values())
+                else:
+                    candidates = list(table.partitions.get(hash_value, {}).values())
+                candidates.sort(key=self._order(table, index))
+                if kwargs.get("ScanIndexForward", True) is False:
+                    candidates.reverse()
+                return self._page(table, index, candidates, key_condition, expressions, kwargs, "Query")
+            except _ValidationError as e:
+                raise _error("ValidationException", str(e), "Query")
+
+    def scan(self, **kwargs) -> dict:
+        self._store.delay()
+        expressions = _Expressions(kwargs, "Scan")
+        with self._store.lock:
+            table = self._table("Scan")
+            index = self._index(table, kwargs, "Scan")
+            if index:
+                candidates = [item for bucket in index.partitions.values() for item in bucket.values()]
+            else:
+                candidates = list(table.items.values())
+            total_segments = kwargs.get("TotalSegments")
+            if total_segments:
+                segment = kwargs["Segment"]
+                candidates = [
+                    item for item in candidates
+                    if zlib.crc32(str(item[table.hash_key]).encode()) % total_segments == segment
+                ]
+            candidates.sort(key=self._order(table, None))
+            try:
+                return self._page(table, index, candidates, None, expressions, kwargs, "Scan")
+            except _ValidationError as e:
+                raise _error("ValidationException", str(e), "Scan")
+
+    @staticmethod
+    def _index(table: _Table, kwargs: dict, operation: str) -> Optional[_Index]:
+        name = kwargs.get("IndexName")
+        if not name:
+            return None
+        if name not in table.indexes:
+            raise _error("ValidationException", f"The table does not have the specified index: {name}", operation)
+        if kwargs.get("ConsistentRead"):
+            raise _error("ValidationException", "Consistent reads are not supported on global secondary indexes", operation)
+        return table.indexes[name]
+
+    @staticmethod
+    def _order(table: _Table, index: Optional[_Index]):
+        def table_key(item):
+            return (item[table.hash_key], item[table.range_key]) if table.range_key else (item[table.hash_key],)
+        if index is None:
+            return table_key
+        if index.range_key:
+            return lambda item: (item[index.range_key], *table_key(item))
+        return table_key
+
+    def _page(self, table: _Table, index: Optional[_Index], candidates: list, key_condition,
+              expressions: _Expressions, kwargs: dict, operation: str) -> dict:
+        order = self._order(table, index)
+        start = kwargs.get("ExclusiveStartKey")
+        if start:
+            start_position = order({k: _normalize(v) for k, v in start.items()})
+            reverse = kwargs.get("ScanIndexForward", True) is False
+            candidates = [
+                item for item in candidates
+                if (order(item) < start_position if reverse else order(item) > start_position)
+            ]
+        limit = min(kwargs.get("Limit") or PAGE_ITEMS, PAGE_ITEMS)
+        _, filter_condition = expressions.condition("FilterExpression")
+
+        evaluated, items, more = [], [], False
+        for item in candidates:
+            if key_condition and not key_condition(item, expressions.values):
+                continue
+            if len(evaluated) == limit:
+                more = True
+                break
+            evaluated.append(item)
+            if filter_condition is None or filter_condition(item, expressions.values):
+                items.append(item)
+
+        res = {"Count": len(items), "ScannedCount": len(evaluated)}
+        if kwargs.get("Select") != "COUNT":
+            res["Items"] = [expressions.project(self._index_view(table, index, item)) for item in items]
+        if more:
+            last = evaluated[-1]
+            key_attrs = set(table.key_attributes)
+            if index:
+                key_attrs.update(a for a in (index.hash_key, index.range_key) if a)
+            res["LastEvaluatedKey"] = {a: last[a] for a in key_attrs}
+        return res
+
+    @staticmethod
+    def _index_view(table: _Table, index: Optional[_Index], item: dict) -> dict:
+        if index is None or index.projection.get("ProjectionType") == "ALL":
+            return item
+        keep = set(table.key_attributes) | {index.hash_key, index.range_key}
+        if index.projection.get("ProjectionType") == "INCLUDE":
+            keep.update(index.projection.get("NonKeyAttributes", []))
+        return {k: v for k, v in item.items() if k in keep}
+
+
+def _hash_value(node: tuple, hash_key: str, values: dict) -> Any:
+    """The partition key value a KeyConditionExpression pins down"""
+    if node[0] == "and":
+        for child in node[1:]:
+            try:
+                return _hash_value(child, hash_key, values)
+            except _ValidationError:
+                continue
+    elif node[0] == "cmp" and node[1] == "=":
+        for subject, operand in ((node[2], node[3]), (node[3], node[2])):
+            if subject == ("path", (hash_key,)) and operand[0] == "value":
+                if operand[1] not in values:
+                    raise _ValidationError(f"An expression attribute value used in expression is not defined; attribute value: {operand[1]}")
+                return values[operand[1]]
+    raise _ValidationError("Query condition missed key schema element: " + hash_key)
+
+
+class MemoryDynamoDB:
+    """boto3 DynamoDB service resource over in-memory tables"""
+
+    def __init__(self, latency_ms: float = 0):
+        self._store = _Store(latency_ms)
+        self.meta = SimpleNamespace(client=MemoryDynamoDBClient(self._store))
+
+    def Table(self, name: str) -> MemoryTable:
+        return MemoryTable(self._store, name)
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        self._store.delay()
+        if sum(len(request["Keys"]) for request in RequestItems.values()) > BATCH_GET_LIMIT:
+            raise _error("ValidationException", f"Too many items requested for the BatchGetItem call", "BatchGetItem")
+        responses = {}
+        with self._store.lock:
+            for name, request in RequestItems.items():
+                table = self._store.table(name, "BatchGetItem")
+                expressions = _Expressions(request, "BatchGetItem")
+                keys = [table.key_of({k: _normalize(v) for k, v in key.items()}, "BatchGetItem") for key in request["Keys"]]
+                if len(set(keys)) != len(keys):
+                    raise _error("ValidationException", "Provided list of item keys contains duplicates", "BatchGetItem")
+                try:
+                    responses[name] = [expressions.project(table.items[key]) for key in keys if key in table.items]
+                except _ValidationError as e:
+                    raise _error("ValidationException", str(e), "BatchGetItem")
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        self._store.delay()
+        if sum(len(requests) for requests in RequestItems.values()) > BATCH_WRITE_LIMIT:
+            raise _error("ValidationException", "Too many items requested for the BatchWriteItem call", "BatchWriteItem")
+        with self._store.lock:
+            planned = []
+            for name, requests in RequestItems.items():
+                table = self._store.table(name, "BatchWriteItem")
+                keys = set()
+                for request in requests:
+                    if "PutRequest" in request:
+                        item = {k: _normalize(v) for k, v in request["PutRequest"]["Item"].items()}
+                        key = table.item_key(item, "BatchWriteItem")
+                    else:
+                        item = None
+                        key = table.key_of({k: _normalize(v) for k, v in request["DeleteRequest"]["Key"].items()}, "BatchWriteItem")
+                    if key in keys:
+                        raise _error("ValidationException", "Provided list of item keys contains duplicates", "BatchWriteItem")
+                    keys.add(key)
+                    planned.append((table, key, item))
+            for table, key, item in planned:
+                table.write(key, item)
+        return {"UnprocessedItems": {}}
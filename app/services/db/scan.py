@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, Optional
+from app.services.db.session import table
+
+
+def query_pages(target: Optional[Any] = None, **kwargs) -> Iterator[list]:
+    """Yield the item pages of a query, following LastEvaluatedKey"""
+    target = target or table
+    while True:
+        res = target.query(**kwargs)
+        yield res.get("Items", [])
+        if "LastEvaluatedKey" not in res:
+            return
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def scan_segment(segment: int, total_segments: int, target: Any, **kwargs) -> Iterator[list]:
+    """Yield the item pages of one parallel-scan segment"""
+    kwargs = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+    while True:
+        res = target.scan(**kwargs)
+        yield res.get("Items", [])
+        if "LastEvaluatedKey" not in res:
+            return
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def parallel_scan(total_segments: int, handle_page: Callable[[list], None],
+                  target: Optional[Any] = None, **kwargs) -> None:
+    """Scan a table with one worker thread per segment
+
+    `handle_page` runs in the segment's worker for every page, so per-page
+    work (bulk indexing, batch writes) is parallelised with the scan itself.
+    Extra kwargs (FilterExpression, ProjectionExpression, ...) go to scan().
+    The first worker error is re-raised once all workers stop.
+    """
+    target = target or table
+
+    def run(segment: int):
+        for page in scan_segment(segment, total_segments, target, **kwargs):
+            if page:
+                handle_page(page)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        futures = [executor.submit(run, segment) for segment in range(total_segments)]
+        for future in futures:
+            future.result()
@@ -1,37 +1,67 @@
-import boto3
-from typing import Optional, Any
-from botocore.config import Config
+import threading
+from typing import Optional, Any, Callable
 from app.config import settings
 
-# Determine environment and configure DynamoDB connection accordingly
-if settings.app.production:
-    # Production: Use IAM roles, no explicit credentials, no local endpoint
-    dynamodb = boto3.resource(
-        'dynamodb',
-        region_name=settings.database.aws_region,
-        config=Config(
-            retries={'max_attempts': settings.database.max_retries, 'mode': 'standard'},
-            connect_timeout=settings.database.connect_timeout,
-            read_timeout=settings.database.read_timeout,
-            max_pool_connections=settings.database.max_pool_connections
-        )
+
+class LazyClient:
+    """Proxy that builds its target on first use
+
+    Importing this module no longer constructs the boto3 resource, so the
+    import is cheap and the connection pool is created once, either by the
+    startup warm-up or by the first request.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> Any:
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    @property
+    def initialized(self) -> bool:
+        return self._target is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def _create_dynamodb():
+    # Determine environment and configure DynamoDB connection accordingly
+    if settings.database.backend == "memory":
+        # In-process tables for tests and benchmarks, see memory.py
+        from app.services.db.memory import MemoryDynamoDB
+        return MemoryDynamoDB(latency_ms=settings.database.memory_latency_ms)
+
+    import boto3
+    from botocore.config import Config
+    config = Config(
+        retries={'max_attempts': settings.database.max_retries, 'mode': 'standard'},
+        connect_timeout=settings.database.connect_timeout,
+        read_timeout=settings.database.read_timeout,
+        max_pool_connections=settings.database.max_pool_connections
     )
-else:
+    if settings.app.production:
+        # Production: Use IAM roles, no explicit credentials, no local endpoint
+        return boto3.resource('dynamodb', region_name=settings.database.aws_region, config=config)
     # Development: Use dummy credentials for local DynamoDB
-    dynamodb = boto3.resource(
+    return boto3.resource(
         'dynamodb',
         region_name=settings.database.aws_region,
         endpoint_url=settings.database.dynamodb_endpoint,
         aws_access_key_id="dummy",
         aws_secret_access_key="dummy",
-        config=Config(
-            retries={'max_attempts': settings.database.max_retries, 'mode': 'standard'},
-            connect_timeout=settings.database.connect_timeout,
-            read_timeout=settings.database.read_timeout,
-            max_pool_connections=settings.database.max_pool_connections
-        )
+        config=config
     )
 
+
+dynamodb: Any = LazyClient(_create_dynamodb)
+
 MAIN_TABLE_NAME = settings.database.main_table_name
 EMAIL_TABLE_NAME = settings.database.email_table_name
 
@@ -53,19 +83,16 @@ def get_email_table():
     """Get the email table"""
     return get_table(EMAIL_TABLE_NAME)
 
-# For backward compatibility, create table objects
-# In production, these will fail if tables don't exist (which is expected)
-# In development, these will be None if tables haven't been created yet
-table: Optional[Any] = None
-email_table: Optional[Any] = None
-
-try:
-    table = dynamodb.Table(MAIN_TABLE_NAME)  # type: ignore
-    email_table = dynamodb.Table(EMAIL_TABLE_NAME)  # type: ignore
-except Exception:
-    # Tables don't exist yet - this is normal in development before table creation
-    # In production, this would indicate a configuration problem
-    if settings.app.production:
-        print(f"Warning: Could not initialize DynamoDB tables in production environment. Tables may not exist.")
-    table = None
-    email_table = None
\ No newline at end of file
+def key_exists(key: dict, target: Optional[Any] = None) -> bool:
+    """Check an item exists reading only its key attributes"""
+    res = (target or table).get_item(Key=key, ProjectionExpression="PK")
+    return "Item" in res
+
+# Table handles used across the app, resolved together with the resource
+table: Any = LazyClient(get_main_table)
+email_table: Any = LazyClient(get_email_table)
+
+def init_clients() -> None:
+    """Build the DynamoDB resource and table handles now instead of on first use"""
+    for client in (dynamodb, table, email_table):
+        client.resolve()
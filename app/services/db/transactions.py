@@ -0,0 +1,98 @@
+from typing import Optional
+from botocore.exceptions import ClientError
+from app.services.db.session import dynamodb, table, MAIN_TABLE_NAME
+
+# Operations are built with plain Python values: the resource's client
+# serializes them to DynamoDB attribute values like Table methods do.
+
+# Condition that holds when a guard item is absent or already owned by `:ref`
+GUARD_RELEASE_CONDITION = "attribute_not_exists(PK) OR #ref = :ref"
+
+
+def email_guard_key(email: str) -> dict:
+    """Key of the item that reserves an email address for a single user"""
+    key = f"email#{str(email).lower()}"
+    return {"PK": key, "SK": key}
+
+
+def slug_guard_key(slug: str) -> dict:
+    """Key of the item that reserves an event slug for a single event"""
+    key = f"slug#{slug}"
+    return {"PK": key, "SK": key}
+
+
+def email_guard_item(email: str, user_id: str) -> dict:
+    return {**email_guard_key(email), "type": "email_guard", "ref": user_id}
+
+
+def slug_guard_item(slug: str, event_id: str) -> dict:
+    return {**slug_guard_key(slug), "type": "slug_guard", "ref": event_id}
+
+
+def put_op(item: dict, condition: Optional[str] = None, names: Optional[dict] = None,
+           values: Optional[dict] = None, table_name: str = MAIN_TABLE_NAME) -> dict:
+    op = {"TableName": table_name, "Item": item}
+    if condition:
+        op["ConditionExpression"] = condition
+    if names:
+        op["ExpressionAttributeNames"] = names
+    if values:
+        op["ExpressionAttributeValues"] = values
+    return {"Put": op}
+
+
+def delete_op(key: dict, condition: Optional[str] = None, names: Optional[dict] = None,
+              values: Optional[dict] = None, table_name: str = MAIN_TABLE_NAME) -> dict:
+    op = {"TableName": table_name, "Key": key}
+    if condition:
+        op["ConditionExpression"] = condition
+    if names:
+        op["ExpressionAttributeNames"] = names
+    if values:
+        op["ExpressionAttributeValues"] = values
+    return {"Delete": op}
+
+
+def update_op(key: dict, update_expression: str, condition: Optional[str] = None,
+              names: Optional[dict] = None, values: Optional[dict] = None,
+              table_name: str = MAIN_TABLE_NAME) -> dict:
+    op = {"TableName": table_name, "Key": key, "UpdateExpression": update_expression}
+    if condition:
+        op["ConditionExpression"] = condition
+    if names:
+        op["ExpressionAttributeNames"] = names
+    if values:
+        op["ExpressionAttributeValues"] = values
+    return {"Update": op}
+
+
+def release_guard_op(key: dict, ref: str) -> dict:
+    """Delete a guard item unless it belongs to another entity"""
+    return delete_op(key, GUARD_RELEASE_CONDITION, names={"#ref": "ref"}, values={":ref": ref})
+
+
+def transact_write(ops: list) -> None:
+    """Run write operations as one all-or-nothing DynamoDB transaction"""
+    dynamodb.meta.client.transact_write_items(TransactItems=ops)
+
+
+def delete_releasing_guard(key: dict, guard_key: dict, ref: str) -> None:
+    """Delete an item and release its guard in one transaction
+
+    A guard that belongs to another entity (a legacy duplicate the guard
+    backfill left to the other record) is kept and the item is deleted alone.
+    """
+    try:
+        transact_write([delete_op(key), release_guard_op(guard_key, ref)])
+    except ClientError as e:
+        if failed_conditions(e) != [1]:
+            raise
+        table.delete_item(Key=key)
+
+
+def failed_conditions(error: ClientError) -> list:
+    """Indexes of the operations whose condition check cancelled a transaction"""
+    if error.response.get("Error", {}).get("Code") != "TransactionCanceledException":
+        return []
+    reasons = error.response.get("CancellationReasons", [])
+    return [i for i, reason in enumerate(reasons) if reason.get("Code") == "ConditionalCheckFailed"]
@@ -0,0 +1,30 @@
+"""Per-request time budget
+
+DeadlineMiddleware starts a budget of OPENSEARCH_REQUEST_BUDGET seconds for
+every request. Calls to slow dependencies take their timeout from what is
+left of it instead of their own fixed timeout, so several calls in one
+request (and its background tasks) cannot add up to more than the budget.
+The budget travels in a context variable, which threadpool calls and
+background tasks inherit from the request.
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def start(seconds: float) -> None:
+    _deadline.set(time.monotonic() + seconds)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left of the current budget, None outside a request"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def timeout(default: float) -> float:
+    """`default`, shortened to what is left of the budget"""
+    left = remaining()
+    return default if left is None else min(default, left)
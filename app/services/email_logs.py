@@ -0,0 +1,224 @@
+"""Per-recipient delivery logs of email campaigns
+
+Two storage formats share the campaign's `req_email#{email_id}` partition:
+
+    items    one `user#{id}` item per recipient (the original format)
+    compact  recipients and statuses in zlib-compressed `chunk#` items of
+             EMAIL_LOG_CHUNK_SIZE recipients each; failed recipients are
+             also written as individual items so they stay queryable per
+             user and can be retried
+
+A compact 1M-recipient campaign is a few hundred item writes instead of a
+million (each also copied into three GSIs). Readers merge both formats, so
+campaigns written before or after switching EMAIL_LOG_FORMAT read the same.
+
+The campaign item (`email#{email_id}`) carries one `<status>Count`
+attribute per EmailStatusEnum value. They start at zero when the
+campaign is written, grow as each delivered batch is logged, and move in
+the same transaction as any later status change, so a summary is one
+GetItem. Individual log items carry a `campaignStatus`
+key (`{email_id}#{status}`) indexed by StatusIndex, so listing one
+status of a campaign reads only those items.
+"""
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from app.config import settings
+from app.models import Email, EmailStatusEnum, status_count_attribute
+from app.services.db.batch import BATCH_WRITE_LIMIT, batch_write_chunk, chunks
+from app.services.db.scan import query_pages
+from app.services.db.session import email_table, EMAIL_TABLE_NAME
+from app.services.retention import with_expiry
+from app.services.db.transactions import put_op, update_op, transact_write, failed_conditions
+
+CHUNK_PREFIX = "chunk#"
+
+
+def encode_chunk(statuses: Dict[str, EmailStatusEnum]) -> bytes:
+    lines = "\n".join(f"{user_id}\t{EmailStatusEnum(status).value}" for user_id, status in statuses.items())
+    return zlib.compress(lines.encode(), 6)
+
+
+def decode_chunk(data) -> Dict[str, EmailStatusEnum]:
+    # boto3 hands binary attributes back wrapped in Binary
+    raw = zlib.decompress(getattr(data, "value", data)).decode()
+    return {user_id: EmailStatusEnum(status) for user_id, status in
+            (line.split("\t", 1) for line in raw.splitlines())}
+
+
+def chunk_item(email_id: str, index: int, statuses: Dict[str, EmailStatusEnum], created_at: datetime) -> dict:
+    return {
+        "PK": f"req_email#{email_id}",
+        # The campaign id keeps chunks of different campaigns apart in UserIndex
+        "SK": f"{CHUNK_PREFIX}{email_id}#{index:05d}",
+        "type": "email_log_chunk",
+        "recipients": len(statuses),
+        "data": encode_chunk(statuses),
+        "createdAt": created_at.isoformat(),
+    }
+
+
+# Statuses compact logs keep only in chunks; any other is also an individual item
+CHUNKED_STATUSES = (EmailStatusEnum.sent,)
+
+
+def batch_log_items(email_id: str, index: int, statuses: Dict[str, EmailStatusEnum], created_at: datetime,
+                    log_format: str = None) -> List[dict]:
+    """Items recording one EMAIL_LOG_CHUNK_SIZE batch of recipients, `index` being its chunk number"""
+    log_format = log_format or settings.email.log_format
+    individual = statuses if log_format != "compact" else {
+        user_id: status for user_id, status in statuses.items() if status not in CHUNKED_STATUSES
+    }
+    items = [
+        Email(user_id=user_id, email_id=email_id, status=status, createdAt=created_at).to_dynamodb_item()
+        for user_id, status in individual.items()
+    ]
+    if log_format == "compact":
+        items.append(chunk_item(email_id, index, statuses, created_at))
+    return [with_expiry(item) for item in items]
+
+
+def record_batch(email_id: str, index: int, statuses: Dict[str, EmailStatusEnum], created_at: datetime) -> None:
+    """Write one delivered batch's logs, each entry once with its result, and add it to the counters"""
+    requests = [{"PutRequest": {"Item": item}} for item in batch_log_items(email_id, index, statuses, created_at)]
+    for chunk in chunks(requests, BATCH_WRITE_LIMIT):
+        batch_write_chunk(EMAIL_TABLE_NAME, chunk)
+    counts = Counter(EmailStatusEnum(status) for status in statuses.values())
+    if not counts:
+        return
+    names = {f"#c{i}": status_count_attribute(status) for i, status in enumerate(counts)}
+    values = {f":c{i}": count for i, count in enumerate(counts.values())}
+    pk = f"email#{email_id}"
+    email_table.update_item(
+        Key={"PK": pk, "SK": pk},
+        UpdateExpression="ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(counts))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def _entry(email_id: str, user_id: str, status: EmailStatusEnum, created_at: str) -> dict:
+    return {"createdAt": created_at, "user_id": user_id, "email_id": email_id, "status": status}
+
+
+def read_campaign_logs(email_id: str, status: Optional[EmailStatusEnum] = None) -> List[dict]:
+    """Every recipient's log entry, individual items taking precedence over chunks
+
+    Statuses other than `sent` are always stored as individual items, so
+    filtering on one of them is a StatusIndex query that skips the chunks.
+    """
+    if status is not None and EmailStatusEnum(status) not in CHUNKED_STATUSES:
+        pages = query_pages(
+            email_table,
+            IndexName="StatusIndex",
+            KeyConditionExpression=Key("campaignStatus").eq(f"{email_id}#{EmailStatusEnum(status).value}"),
+        )
+        return [_entry(email_id, item["SK"].split("#", 1)[1], EmailStatusEnum(item["status"]), item["createdAt"])
+                for page in pages for item in page]
+
+    from_chunks, individual = {}, {}
+    pages = query_pages(email_table, KeyConditionExpression=Key("PK").eq(f"req_email#{email_id}"))
+    for page in pages:
+        for item in page:
+            if item["SK"].startswith(CHUNK_PREFIX):
+                for user_id, chunk_status in decode_chunk(item["data"]).items():
+                    from_chunks[user_id] = (chunk_status, item["createdAt"])
+            elif item.get("type") == "email_log":
+                individual[item["SK"].split("#", 1)[1]] = (EmailStatusEnum(item["status"]), item["createdAt"])
+    merged = {**from_chunks, **individual}
+    return [
+        _entry(email_id, user_id, entry_status, created_at)
+        for user_id, (entry_status, created_at) in merged.items()
+        if status is None or entry_status == status
+    ]
+
+
+def status_counts(statuses: Dict[str, EmailStatusEnum]) -> Dict[EmailStatusEnum, int]:
+    counts = Counter(EmailStatusEnum(status) for status in statuses.values())
+    return {status: counts.get(status, 0) for status in EmailStatusEnum}
+
+
+def read_campaign_summary(email_id: str) -> Optional[dict]:
+    """The campaign's status counters, read with one GetItem"""
+    pk = f"email#{email_id}"
+    count_names = {f"#c{i}": status_count_attribute(status) for i, status in enumerate(EmailStatusEnum)}
+    res = email_table.get_item(
+        Key={"PK": pk, "SK": pk},
+        ProjectionExpression=", ".join(["#s", "totalRecipients", *count_names]),
+        ExpressionAttributeNames={"#s": "status", **count_names},
+    )
+    item = res.get("Item")
+    if item is None:
+        return None
+    return {
+        "email_id": email_id,
+        "status": item.get("status"),
+        "totalRecipients": item.get("totalRecipients", 0),
+        "statusCounts": {status: int(item.get(status_count_attribute(status), 0)) for status in EmailStatusEnum},
+    }
+
+
+def _current_log(email_id: str, user_id: str) -> Optional[dict]:
+    """The recipient's individual log item, or one built from its compact chunk entry"""
+    res = email_table.get_item(Key={"PK": f"req_email#{email_id}", "SK": f"user#{user_id}"}, ConsistentRead=True)
+    if "Item" in res:
+        return res["Item"]
+    pages = query_pages(
+        email_table,
+        KeyConditionExpression=Key("PK").eq(f"req_email#{email_id}") & Key("SK").begins_with(f"{CHUNK_PREFIX}{email_id}#"),
+    )
+    for page in pages:
+        for item in page:
+            status = decode_chunk(item["data"]).get(user_id)
+            if status is not None:
+                return {"status": status, "createdAt": item["createdAt"], "fromChunk": True}
+    return None
+
+
+def update_log_status(email_id: str, user_id: str, status: EmailStatusEnum, attempts: int = 3) -> Optional[dict]:
+    """Change one recipient's status and move the campaign counters with it atomically
+
+    Returns the new log entry, or None when the recipient is not part of
+    the campaign. A concurrent change of the same log makes the transaction
+    fail its condition; the change is then re-read and retried.
+    """
+    status = EmailStatusEnum(status)
+    with_counters = True
+    for _ in range(attempts):
+        current = _current_log(email_id, user_id)
+        if current is None:
+            return None
+        old = EmailStatusEnum(current["status"])
+        created_at = datetime.fromisoformat(current["createdAt"])
+        if old == status:
+            return _entry(email_id, user_id, status, current["createdAt"])
+
+        log = with_expiry(Email(email_id=email_id, user_id=user_id, status=status, createdAt=created_at).to_dynamodb_item())
+        if current.get("fromChunk"):
+            log_op = put_op(log, "attribute_not_exists(PK)", table_name=EMAIL_TABLE_NAME)
+        else:
+            log_op = put_op(log, "#s = :old", names={"#s": "status"}, values={":old": old.value},
+                            table_name=EMAIL_TABLE_NAME)
+        pk = f"email#{email_id}"
+        counters_op = update_op(
+            {"PK": pk, "SK": pk},
+            "ADD #new :one, #old :minus_one",
+            condition="attribute_exists(#old)",
+            names={"#new": status_count_attribute(status), "#old": status_count_attribute(old)},
+            values={":one": 1, ":minus_one": -1},
+            table_name=EMAIL_TABLE_NAME,
+        )
+        try:
+            transact_write([log_op, counters_op] if with_counters else [log_op])
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            if 1 in failed_conditions(e):
+                # Campaigns sent before counters existed only get their log updated
+                with_counters = False
+            continue
+        return _entry(email_id, user_id, status, current["createdAt"])
+    raise RuntimeError(f"Log status of {user_id} in {email_id} kept changing, gave up after {attempts} attempts")
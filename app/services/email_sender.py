@@ -1,3 +1,334 @@
-def send_bulk_emails(emails: list, subject: str, body: str):
-    # Mock email sending
-    return [{email: "sent"} for email in emails]
+"""Email delivery
+
+`send_bulk_emails` splits the recipients into chunks that `pool_size`
+workers send concurrently through the configured provider. Every provider
+call first takes tokens from the provider's token bucket, so the provider's
+rate limit holds however many workers run, and transient failures
+(dropped connections, throttling, 4xx SMTP replies) are retried with
+exponential backoff. The result maps each recipient to `sent` or `error`.
+
+Providers:
+    mock  - accepts every recipient (default, tests)
+    smtp  - one message per recipient over a pool of persistent connections
+    api   - batched JSON requests to an HTTP delivery service; subclass
+            APIProvider and `register_provider` it for a specific service
+"""
+import logging
+import queue
+import random
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import settings
+from app.models import EmailStatusEnum
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryError(Exception):
+    """The whole batch was rejected, retrying will not help"""
+
+
+class TransientDeliveryError(Exception):
+    """The batch may succeed when retried"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket, `rate` tokens per second up to `burst`
+
+    A request larger than the bucket is let through once the bucket is
+    full and leaves it in debt, so the long-run rate still holds.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                needed = min(tokens, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmailProvider(ABC):
+    """Delivers batches of up to `batch_size` recipients
+
+    `send_batch` returns the recipients that were rejected, with a reason,
+    and raises TransientDeliveryError when the batch should be retried.
+    """
+    name = "base"
+    batch_size = 1
+
+    @abstractmethod
+    def send_batch(self, recipients: List[str], subject: str, body: str) -> Dict[str, str]:
+        """Send one batch, returning the rejected recipients with their reasons"""
+
+    def close(self) -> None:
+        pass
+
+
+class MockProvider(EmailProvider):
+    name = "mock"
+    batch_size = 1000
+
+    def send_batch(self, recipients: List[str], subject: str, body: str) -> Dict[str, str]:
+        return {}
+
+
+class SMTPProvider(EmailProvider):
+    """One message per recipient over up to `pool_size` persistent SMTP connections"""
+    name = "smtp"
+
+    def __init__(self, host: str, port: int, sender: str, pool_size: int = 8, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = False, timeout: int = 10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection; one that broke while in use is dropped instead of returned"""
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                try:
+                    conn = self._connect()
+                except (smtplib.SMTPException, OSError) as e:
+                    raise TransientDeliveryError(f"SMTP connect failed: {e}") from e
+            try:
+                yield conn
+            except (TransientDeliveryError, DeliveryError):
+                # A refused message leaves the session usable
+                self._idle.put(conn)
+                raise
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                self._discard(conn)
+                raise TransientDeliveryError(f"SMTP connection lost: {e}") from e
+            except BaseException:
+                self._discard(conn)
+                raise
+            self._idle.put(conn)
+
+    def _message(self, to: str, subject: str, body: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+        return message
+
+    def send_batch(self, recipients: List[str], subject: str, body: str) -> Dict[str, str]:
+        failed = {}
+        with self.connection() as conn:
+            for to in recipients:
+                try:
+                    conn.send_message(self._message(to, subject, body))
+                except smtplib.SMTPRecipientsRefused as e:
+                    code, reason = e.recipients[to]
+                    if 400 <= code < 500:
+                        raise TransientDeliveryError(f"{code} {reason.decode(errors='replace')}") from e
+                    failed[to] = f"{code} {reason.decode(errors='replace')}"
+                except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    if 400 <= e.smtp_code < 500:
+                        raise TransientDeliveryError(f"{e.smtp_code} {e.smtp_error.decode(errors='replace')}") from e
+                    failed[to] = f"{e.smtp_code} {e.smtp_error.decode(errors='replace')}"
+        return failed
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class APIProvider(EmailProvider):
+    """Batched JSON requests to an HTTP delivery service over a pooled session
+
+    The default request and response shapes are generic; a service with its
+    own API overrides `build_payload` and `parse_response`.
+    """
+    name = "api"
+
+    def __init__(self, url: str, api_key: Optional[str], sender: str, batch_size: int = 100,
+                 pool_size: int = 8, timeout: int = 10):
+        if not url:
+            raise ValueError("EMAIL_API_URL is required for the api provider")
+        self.url = url
+        self.sender = sender
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def build_payload(self, recipients: List[str], subject: str, body: str) -> dict:
+        return {"from": self.sender, "to": recipients, "subject": subject, "text": body}
+
+    def parse_response(self, response: requests.Response, recipients: List[str]) -> Dict[str, str]:
+        """Rejected recipients from a 2xx response, `{"failed": {address: reason}}` by default"""
+        if not response.content:
+            return {}
+        return dict(response.json().get("failed") or {})
+
+    def send_batch(self, recipients: List[str], subject: str, body: str) -> Dict[str, str]:
+        try:
+            response = self.session.post(self.url, json=self.build_payload(recipients, subject, body),
+                                         timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientDeliveryError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientDeliveryError(f"{response.status_code} {response.text[:200]}")
+        if response.status_code >= 400:
+            raise DeliveryError(f"{response.status_code} {response.text[:200]}")
+        return self.parse_response(response, recipients)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _smtp_provider() -> EmailProvider:
+    email = settings.email
+    return SMTPProvider(email.smtp_host, email.smtp_port, email.from_address, pool_size=email.pool_size,
+                        username=email.smtp_username, password=email.smtp_password,
+                        starttls=email.smtp_starttls, timeout=email.smtp_timeout)
+
+
+def _api_provider() -> EmailProvider:
+    email = settings.email
+    return APIProvider(email.api_url, email.api_key, email.from_address,
+                       batch_size=email.api_batch_size, pool_size=email.pool_size)
+
+
+PROVIDERS: Dict[str, Callable[[], EmailProvider]] = {
+    "mock": MockProvider,
+    "smtp": _smtp_provider,
+    "api": _api_provider,
+}
+
+
+def register_provider(name: str, factory: Callable[[], EmailProvider]) -> None:
+    """Make a provider selectable with EMAIL_PROVIDER=<name>"""
+    PROVIDERS[name] = factory
+
+
+class EmailSender:
+    """Concurrent, rate-limited, retrying delivery through one provider"""
+
+    def __init__(self, provider: EmailProvider, concurrency: int = 8, chunk_size: int = 100,
+                 rate_per_second: float = 50, burst: int = 100, max_retries: int = 3,
+                 retry_backoff_seconds: float = 0.5):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+
+    def _deliver(self, batch: List[str], subject: str, body: str) -> Dict[str, str]:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(len(batch))
+            try:
+                return self.provider.send_batch(batch, subject, body)
+            except TransientDeliveryError as e:
+                if attempt == self.max_retries:
+                    return {to: str(e) for to in batch}
+                time.sleep(self.retry_backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5))
+            except DeliveryError as e:
+                return {to: str(e) for to in batch}
+            except Exception as e:
+                logger.exception(f"{self.provider.name} provider failed a batch of {len(batch)}")
+                return {to: str(e) for to in batch}
+
+    def _send_chunk(self, chunk: List[str], subject: str, body: str) -> Dict[str, EmailStatusEnum]:
+        results = {}
+        size = self.provider.batch_size
+        for i in range(0, len(chunk), size):
+            batch = chunk[i:i + size]
+            failed = self._deliver(batch, subject, body)
+            for to in batch:
+                results[to] = EmailStatusEnum.error if to in failed else EmailStatusEnum.sent
+            for to, reason in failed.items():
+                logger.warning(f"Delivery to {to} failed: {reason}")
+        return results
+
+    def send(self, recipients: List[str], subject: str, body: str) -> Dict[str, EmailStatusEnum]:
+        chunks = [recipients[i:i + self.chunk_size] for i in range(0, len(recipients), self.chunk_size)]
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(chunks)))) as pool:
+            for part in pool.map(lambda chunk: self._send_chunk(chunk, subject, body), chunks):
+                results.update(part)
+        return results
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> EmailSender:
+    """The process-wide sender for EMAIL_PROVIDER, built on first use"""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                email = settings.email
+                if email.provider not in PROVIDERS:
+                    raise ValueError(f"Unknown email provider {email.provider!r}, expected one of {sorted(PROVIDERS)}")
+                _sender = EmailSender(
+                    PROVIDERS[email.provider](),
+                    concurrency=email.pool_size,
+                    chunk_size=email.chunk_size,
+                    rate_per_second=email.rate_per_second,
+                    burst=email.burst,
+                    max_retries=email.max_retries,
+                    retry_backoff_seconds=email.retry_backoff_seconds,
+                )
+    return _sender
+
+
+def send_bulk_emails(emails: list, subject: str, body: str) -> Dict[str, EmailStatusEnum]:
+    """Deliver to every address, returning each one's status"""
+    return get_sender().send(emails, subject, body)
@@ -0,0 +1,166 @@
+"""Streaming CSV/NDJSON exports of users
+
+Rows come from an async generator of pages and go out in a chunked
+StreamingResponse, one chunk per page, so memory stays at a few pages
+however many rows are exported and the first rows are sent as soon as the
+first page is read.
+
+    scan_user_records    parallel scan of the table, one thread per segment
+    search_user_records  search_after pages over an OpenSearch point in time
+"""
+import asyncio
+import concurrent.futures
+import csv
+import io
+import logging
+import threading
+from typing import AsyncIterator, Literal, Optional
+import orjson
+from boto3.dynamodb.conditions import Attr
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.models import User
+from app.serialization import stored_record
+from app.services.db.expressions import build_projection
+from app.services.db.scan import scan_segment
+from app.services.db.session import table
+from app.services.opensearch.client import get_opensearch_client
+from app.services.opensearch.indices import USERS_INDEX
+
+logger = logging.getLogger(__name__)
+
+ExportFormat = Literal["csv", "ndjson"]
+
+PAGE_SIZE = 1000
+PIT_KEEP_ALIVE = "2m"
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+_DONE = object()
+
+
+async def scan_pages(segments: int, **scan_kwargs) -> AsyncIterator[list]:
+    """Item pages of a parallel scan in arrival order, at most `segments` pages buffered
+
+    Every segment is scanned by its own thread, which blocks while the
+    buffer is full, so a slow client slows the scan instead of growing
+    memory. Closing the generator (client gone) stops the threads at their
+    next page.
+    """
+    loop = asyncio.get_running_loop()
+    pages = asyncio.Queue(maxsize=segments)
+    stop = threading.Event()
+
+    def put(page):
+        if stop.is_set():
+            return
+        future = asyncio.run_coroutine_threadsafe(pages.put(page), loop)
+        while not stop.is_set():
+            try:
+                return future.result(timeout=0.5)
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+
+    def run(segment: int):
+        try:
+            for page in scan_segment(segment, segments, table, **scan_kwargs):
+                if stop.is_set():
+                    return
+                if page:
+                    put(page)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    for segment in range(segments):
+        threading.Thread(target=run, args=(segment,), daemon=True, name=f"export-scan-{segment}").start()
+    running = segments
+    try:
+        while running:
+            page = await pages.get()
+            if page is _DONE:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+
+
+async def scan_user_records(segments: int, fields: Optional[list] = None) -> AsyncIterator[list]:
+    """Pages of user records read straight from the table"""
+    kwargs = {"FilterExpression": Attr("type").eq("user")}
+    if fields:
+        kwargs.update(build_projection(fields))
+    async for page in scan_pages(segments, **kwargs):
+        yield [stored_record(User, item, fields) for item in page]
+
+
+async def search_user_records(query: dict, fields: Optional[list] = None,
+                              page_size: int = PAGE_SIZE) -> AsyncIterator[list]:
+    """Pages of `users` docs matching `query`, in id order
+
+    A point in time keeps the pages consistent while documents change and
+    search_after has no deep-offset cost, unlike from/size paging.
+    """
+    client = get_opensearch_client()
+    pit = await run_in_threadpool(client.create_pit, index=USERS_INDEX, params={"keep_alive": PIT_KEEP_ALIVE})
+    pit_id = pit["pit_id"]
+    body = {
+        "query": query,
+        "size": page_size,
+        "sort": [{"id": "asc"}],
+        "track_total_hits": False,
+        "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+    }
+    if fields:
+        body["_source"] = list(dict.fromkeys(["id", *fields]))
+    try:
+        while True:
+            res = await run_in_threadpool(client.search, body=body)
+            hits = res["hits"]["hits"]
+            if hits:
+                yield [hit["_source"] for hit in hits]
+            if len(hits) < page_size:
+                return
+            body["search_after"] = hits[-1]["sort"]
+            # The id may change between pages, the latest one is the one to keep alive and free
+            pit_id = body["pit"]["id"] = res.get("pit_id", pit_id)
+    finally:
+        try:
+            await run_in_threadpool(client.delete_pit, body={"pit_id": [pit_id]})
+        except Exception as e:
+            logger.warning(f"Could not delete point in time {pit_id}: {e}")
+
+
+def export_columns(fields: Optional[list]) -> list:
+    return ["id", *fields] if fields else list(User.model_fields)
+
+
+async def csv_chunks(pages: AsyncIterator[list], columns: list) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue().encode()
+    async for page in pages:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([row.get(column) for column in columns] for row in page)
+        yield buffer.getvalue().encode()
+
+
+async def ndjson_chunks(pages: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    async for page in pages:
+        yield b"".join(orjson.dumps({k: v for k, v in row.items() if v is not None}) + b"\n" for row in page)
+
+
+def export_response(pages: AsyncIterator[list], fmt: ExportFormat, fields: Optional[list],
+                    filename: str) -> StreamingResponse:
+    chunks = csv_chunks(pages, export_columns(fields)) if fmt == "csv" else ndjson_chunks(pages)
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
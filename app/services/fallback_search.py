@@ -0,0 +1,138 @@
+"""UserFilter search on DynamoDB, used while OpenSearch is unavailable
+
+Users are found through the main table's attribute GSIs: CompanyIndex,
+JobTitleIndex and CityStateIndex (`city_state` is "{city}#{state}", so
+only a filter with both city and state can use it). The usable indexes
+are read concurrently, every page of each; the first index to be read in
+full is the most selective one and its users are the candidates, the
+other queries are stopped at their next page. The candidates are then
+intersected with the other indexed criteria on their own attributes,
+which are exactly those indexes' keys, and the remaining criteria (a lone
+city or state, counter ranges) are applied with `filter_matches`.
+
+Index keys match whole values exactly, case included, where OpenSearch
+matches any word of the value; a filter without company, jobTitle or
+city+state has no index to use and is rejected rather than scanning the
+table. Results are ordered by id.
+
+Users written before `city_state` was set on creation need it backfilled
+for CityStateIndex to find them:
+
+    python -m app.services.fallback_search backfill
+"""
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from boto3.dynamodb.conditions import Attr, Key
+from app.models import User, UserFilter
+from app.serialization import stored_record
+from app.services.db.scan import parallel_scan, query_pages
+from app.services.db.session import table
+from app.services.opensearch.queries import filter_matches
+
+DEFAULT_SEGMENTS = 8
+
+
+class FilterNotIndexed(ValueError):
+    """The filter has no criterion a GSI can answer"""
+
+
+def index_queries(filter: UserFilter) -> List[Tuple[str, str, str]]:
+    """(index, key attribute, value) of every GSI the filter can use"""
+    queries = []
+    if filter.company:
+        queries.append(("CompanyIndex", "company", filter.company))
+    if filter.jobTitle:
+        queries.append(("JobTitleIndex", "jobTitle", filter.jobTitle))
+    if filter.city and filter.state:
+        queries.append(("CityStateIndex", "city_state", f"{filter.city}#{filter.state}"))
+    return queries
+
+
+def _race(queries: List[Tuple[str, str, str]]) -> Tuple[str, list]:
+    """The index read in full first and its user items; the other reads stop at their next page"""
+    done = threading.Event()
+    winner = []
+    lock = threading.Lock()
+
+    def read(index: str, attribute: str, value: str):
+        items = []
+        pages = query_pages(IndexName=index, KeyConditionExpression=Key(attribute).eq(value),
+                            FilterExpression=Attr("type").eq("user"))
+        for page in pages:
+            if done.is_set():
+                return
+            items.extend(page)
+        with lock:
+            if not winner:
+                winner.append((index, items))
+                done.set()
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futures = [pool.submit(read, *query) for query in queries]
+        for future in futures:
+            future.result()
+    return winner[0]
+
+
+def _exact(item: dict, queries: List[Tuple[str, str, str]]) -> bool:
+    return all(item.get(attribute) == value for _, attribute, value in queries)
+
+
+def fallback_user_docs(filter: UserFilter, page: int = 0, size: int = 10,
+                       fields: Optional[list] = None) -> Tuple[int, List[dict]]:
+    """Total and one page of matching users, shaped like search_user_docs results"""
+    queries = index_queries(filter)
+    if not queries:
+        raise FilterNotIndexed("Filter needs company, jobTitle or both city and state")
+    _, candidates = _race(queries)
+    matches = sorted(
+        (item for item in candidates if _exact(item, queries) and filter_matches(filter, item)),
+        key=lambda item: item["PK"],
+    )
+    docs = [
+        {k: v for k, v in stored_record(User, item, fields).items() if v is not None}
+        for item in matches[page * size:(page + 1) * size]
+    ]
+    return len(matches), docs
+
+
+def backfill_city_state(segments: int = DEFAULT_SEGMENTS) -> dict:
+    """Set `city_state` on users that have a city and state but no index key"""
+    counts = {"updated": 0}
+    lock = threading.Lock()
+
+    def handle_page(items: list):
+        for item in items:
+            table.update_item(
+                Key={"PK": item["PK"], "SK": item["SK"]},
+                UpdateExpression="SET city_state = :cs",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={":cs": f"{item['city']}#{item['state']}"},
+            )
+        with lock:
+            counts["updated"] += len(items)
+
+    parallel_scan(
+        segments,
+        handle_page,
+        FilterExpression=Attr("type").eq("user") & Attr("city").exists() & Attr("state").exists()
+        & Attr("city_state").not_exists(),
+        ProjectionExpression="PK, SK, city, #st",
+        ExpressionAttributeNames={"#st": "state"},
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DynamoDB fallback for user search")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="Set city_state on users written without it")
+    backfill.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan workers")
+    args = parser.parse_args()
+    print(backfill_city_state(args.segments))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Idempotency-Key support for create/send endpoints
+
+A key is claimed with a conditional put before the work runs and the
+response is stored on the claim once it succeeds, so a retried request gets
+the first response back instead of running again. Completed responses are
+also kept in a small in-process cache that serves most retries without a
+DynamoDB read. Records expire through the table's `expiresAt` TTL.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Annotated, Any, Awaitable, Callable, Optional
+import orjson
+from botocore.exceptions import ClientError
+from fastapi import Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from app.config import settings
+from app.serialization import FastJSONResponse
+from app.services.db.session import table
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+
+IdempotencyKey = Annotated[Optional[str], Header(alias=IDEMPOTENCY_HEADER, max_length=255)]
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+# A new request may take over the key when it is unused, expired, or held by
+# a request whose lock lapsed (the process died before finishing)
+CLAIM_CONDITION = "attribute_not_exists(PK) OR expiresAt < :now OR (#s = :in_progress AND lockedUntil < :now)"
+
+
+class LocalResponseCache:
+    """Bounded LRU of completed responses, entries expire with their record"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pk: str) -> Optional[dict]:
+        with self._lock:
+            record = self._items.get(pk)
+            if record is None:
+                return None
+            if record["expiresAt"] < time.time():
+                del self._items[pk]
+                return None
+            self._items.move_to_end(pk)
+            return record
+
+    def put(self, pk: str, record: dict) -> None:
+        with self._lock:
+            self._items[pk] = record
+            self._items.move_to_end(pk)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+local_cache = LocalResponseCache(settings.app.idempotency_cache_size)
+
+
+def fingerprint(payload: BaseModel) -> str:
+    """Hash of the fields the client sent, server-filled defaults (ids, timestamps) are left out"""
+    body = orjson.dumps(payload.model_dump(mode="json", exclude_unset=True), option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(body).hexdigest()
+
+
+def claim(pk: str, request_hash: str) -> Optional[dict]:
+    """Claim the key for this request, or return the record already holding it"""
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item={
+                "PK": pk,
+                "SK": pk,
+                "type": "idempotency",
+                "state": IN_PROGRESS,
+                "fingerprint": request_hash,
+                "lockedUntil": now + settings.app.idempotency_lock_seconds,
+                "expiresAt": now + settings.app.idempotency_ttl_hours * 3600,
+            },
+            ConditionExpression=CLAIM_CONDITION,
+            ExpressionAttributeNames={"#s": "state"},
+            ExpressionAttributeValues={":now": now, ":in_progress": IN_PROGRESS},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        res = table.get_item(Key={"PK": pk, "SK": pk}, ConsistentRead=True)
+        return res.get("Item") or {"state": IN_PROGRESS, "fingerprint": request_hash}
+    return None
+
+
+def complete(pk: str, response: Response) -> dict:
+    """Store the response on the claimed record"""
+    res = table.update_item(
+        Key={"PK": pk, "SK": pk},
+        UpdateExpression="SET #s = :done, statusCode = :code, #b = :body REMOVE lockedUntil",
+        ExpressionAttributeNames={"#s": "state", "#b": "body"},
+        ExpressionAttributeValues={
+            ":done": DONE,
+            ":code": response.status_code,
+            ":body": response.body.decode(),
+        },
+        ReturnValues="ALL_NEW",
+    )
+    return res["Attributes"]
+
+
+def release(pk: str) -> None:
+    """Drop an unfinished claim so the client can retry the request"""
+    try:
+        table.delete_item(
+            Key={"PK": pk, "SK": pk},
+            ConditionExpression="#s = :in_progress",
+            ExpressionAttributeNames={"#s": "state"},
+            ExpressionAttributeValues={":in_progress": IN_PROGRESS},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def replay(record: dict, request_hash: str) -> Response:
+    if record["fingerprint"] != request_hash:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used with a different request")
+    if record["state"] != DONE:
+        raise HTTPException(status_code=409, detail=f"A request with this {IDEMPOTENCY_HEADER} is still in progress")
+    return Response(
+        content=record["body"],
+        status_code=int(record["statusCode"]),
+        media_type="application/json",
+        headers={REPLAY_HEADER: "true"},
+    )
+
+
+async def run_idempotent(key: Optional[str], scope: str, payload: BaseModel,
+                         work: Callable[[], Awaitable[Any]], exclude_none: bool = False) -> Any:
+    """Run `work` once per (scope, key) and replay its response on retries
+
+    Without a key the work simply runs. A key reused with a different
+    payload is rejected with 422, and one whose first request is still
+    running with 409. When the work raises, the claim is released so a
+    retry runs it again.
+    """
+    if key is None:
+        return await work()
+
+    pk = f"idem#{scope}#{key}"
+    request_hash = fingerprint(payload)
+
+    record = local_cache.get(pk)
+    if record is None:
+        record = await run_in_threadpool(claim, pk, request_hash)
+    if record is not None:
+        if record.get("state") == DONE:
+            local_cache.put(pk, record)
+        return replay(record, request_hash)
+
+    try:
+        result = await work()
+    except BaseException:
+        await run_in_threadpool(release, pk)
+        raise
+
+    response = result if isinstance(result, Response) else FastJSONResponse(result, exclude_none=exclude_none)
+    try:
+        local_cache.put(pk, await run_in_threadpool(complete, pk, response))
+    except Exception as e:
+        # The work is done, a retry after the lock lapses would redo it
+        logger.warning(f"Could not store idempotent response for {pk}: {e}")
+    return response
@@ -0,0 +1,49 @@
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from fastapi.concurrency import run_in_threadpool
+from app.models import Job, JobStatusEnum
+from app.serialization import stored_record
+from app.services.db.session import table
+from app.services.db.expressions import build_update_expression
+
+logger = logging.getLogger(__name__)
+
+# Called by job work as `await progress(processed=..., total=...)`
+Progress = Callable[..., Awaitable[None]]
+
+
+def create_job(kind: str, target: str) -> Job:
+    """Record a pending background job so its progress can be polled"""
+    job = Job(kind=kind, target=target)
+    table.put_item(Item=job.to_dynamodb_item())
+    return job
+
+
+def update_job(job_id: str, **fields) -> None:
+    fields["updatedAt"] = datetime.now().isoformat()
+    if isinstance(fields.get("status"), JobStatusEnum):
+        fields["status"] = fields["status"].value
+    pk = f"job#{job_id}"
+    table.update_item(Key={"PK": pk, "SK": pk}, **build_update_expression(fields))
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    pk = f"job#{job_id}"
+    item = table.get_item(Key={"PK": pk, "SK": pk}).get("Item")
+    return stored_record(Job, item) if item else None
+
+
+async def run_job(job: Job, work: Callable[[Progress], Awaitable[None]]) -> None:
+    """Run `work` as the job, recording running/done/error and its progress reports"""
+    async def progress(**fields):
+        await run_in_threadpool(update_job, job.id, **fields)
+
+    await progress(status=JobStatusEnum.running)
+    try:
+        await work(progress)
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.kind} {job.target}) failed")
+        await progress(status=JobStatusEnum.error, error=str(e))
+        return
+    await progress(status=JobStatusEnum.done)
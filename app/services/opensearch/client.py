@@ -1,7 +1,132 @@
-from opensearchpy import OpenSearch
+import logging
+import threading
+import time
 from app.config import settings
+from app.services import deadline
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+# Below this a call would time out before the cluster could answer
+MIN_TIMEOUT = 0.05
 
 def get_opensearch_client():
+    """The process-wide OpenSearch client, built on first use
+
+    The client is thread-safe and owns the connection pool, so every
+    request shares one instead of opening its own connections.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+class OpenSearchUnavailable(Exception):
+    """Raised instead of calling OpenSearch while the breaker is open or the request budget is spent"""
+
+class CircuitBreaker:
+    """Stops calls to OpenSearch after OPENSEARCH_BREAKER_FAILURES failures in a row
+
+    While open, calls fail at once instead of each waiting for a timeout.
+    After OPENSEARCH_BREAKER_RESET_SECONDS one call is let through as a
+    probe: its success closes the breaker, its failure opens it again.
+    Callers let through by `allow` must report the outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probing else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= settings.opensearch.breaker_reset_seconds:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("OpenSearch circuit breaker closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= settings.opensearch.breaker_failures):
+                if not self._probing:
+                    logger.warning(f"OpenSearch circuit breaker opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+breaker = CircuitBreaker()
+
+def guarded(fn, *args, timeout: float, **kwargs):
+    """Call `fn` (a client method or helper) through the breaker with `request_timeout`
+
+    `timeout` is shortened to what is left of the request budget.
+    """
+    timeout = deadline.timeout(timeout)
+    if timeout < MIN_TIMEOUT:
+        raise OpenSearchUnavailable("Request budget for OpenSearch calls is spent")
+    if not breaker.allow():
+        raise OpenSearchUnavailable("OpenSearch circuit breaker is open")
+    try:
+        result = fn(*args, request_timeout=timeout, **kwargs)
+    except Exception as e:
+        if search_unavailable(e):
+            breaker.record_failure()
+        else:
+            # The cluster answered, the request itself was wrong
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+def search_unavailable(error: Exception) -> bool:
+    """Whether an OpenSearch call failed because the cluster is down, overloaded or too slow
+
+    Query errors (4xx) are not: they would fail the same way after a retry.
+    """
+    from opensearchpy.exceptions import ConnectionError, TransportError
+    if isinstance(error, (ConnectionError, OpenSearchUnavailable)):
+        return True
+    return isinstance(error, TransportError) and isinstance(error.status_code, int) and \
+        (error.status_code >= 500 or error.status_code == 429)
+
+def _timeouts() -> dict:
+    # Calls without their own request_timeout (admin paths, reindex) still
+    # give up; a dead node is not retried for every request
+    return {
+        "timeout": settings.opensearch.timeout,
+        "max_retries": settings.opensearch.max_retries,
+        "retry_on_timeout": False,
+    }
+
+def _create_client():
+    if settings.opensearch.mode == "memory":
+        # One shared in-process cluster for tests and benchmarks, see memory.py
+        from app.services.opensearch.memory import MemoryOpenSearch
+        return MemoryOpenSearch(latency_ms=settings.opensearch.memory_latency_ms)
+
+    from opensearchpy import OpenSearch
     if settings.opensearch.mode == "cloud":
         if not settings.opensearch.host:
             raise ValueError("OpenSearch host is required for cloud mode")
@@ -14,7 +139,8 @@ def get_opensearch_client():
             hosts=[{"host": settings.opensearch.host, "port": 443}],
             http_auth=auth,
             use_ssl=True,
-            verify_certs=True
+            verify_certs=True,
+            **_timeouts()
         )
     else:  # Local
         # Parse host and port from endpoint
@@ -38,5 +164,6 @@ def get_opensearch_client():
             hosts=[{"host": host, "port": port}],
             http_auth=(settings.opensearch.username, settings.opensearch.password),
             use_ssl=settings.opensearch.use_ssl,
-            verify_certs=settings.opensearch.verify_certs
+            verify_certs=settings.opensearch.verify_certs,
+            **_timeouts()
         )
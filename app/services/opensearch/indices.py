@@ -0,0 +1,108 @@
+import secrets
+from datetime import datetime, timezone
+from opensearchpy.exceptions import RequestError
+
+USERS_INDEX = "users"
+
+_text_with_keyword = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+
+# `.suggest` is indexed as shingles plus edge n-grams, so a type-ahead
+# prefix is a term lookup instead of a prefix scan over the dictionary
+_text_with_suggest = {"type": "text", "fields": {
+    "keyword": {"type": "keyword", "ignore_above": 256},
+    "suggest": {"type": "search_as_you_type"},
+}}
+
+SUGGEST_FIELDS = ["firstName", "lastName", "email", "company"]
+
+USERS_MAPPING = {
+    "properties": {
+        "id": {"type": "keyword"},
+        "firstName": _text_with_suggest,
+        "lastName": _text_with_suggest,
+        "email": _text_with_suggest,
+        "phoneNumber": {"type": "keyword"},
+        "avatar": {"type": "keyword", "index": False},
+        "gender": {"type": "keyword"},
+        "jobTitle": _text_with_keyword,
+        "company": _text_with_suggest,
+        "city": _text_with_keyword,
+        "state": _text_with_keyword,
+        "attendedCount": {"type": "integer"},
+        "hostedCount": {"type": "integer"},
+    }
+}
+
+EVENTS_INDEX = "events"
+
+EVENTS_MAPPING = {
+    "properties": {
+        "id": {"type": "keyword"},
+        "slug": {"type": "keyword"},
+        "title": _text_with_keyword,
+        "description": {"type": "text"},
+        "startAt": {"type": "date"},
+        "endAt": {"type": "date"},
+        "venue": _text_with_keyword,
+        "maxCapacity": {"type": "integer"},
+        "owner": {"type": "keyword"},
+        "hosts": {"type": "keyword"},
+    }
+}
+
+# Partial update that also drops fields: `params.remove` are deleted from
+# the doc, then `params.doc` is merged into it
+UPDATE_SCRIPT = "for (f in params.remove) { ctx._source.remove(f) } ctx._source.putAll(params.doc)"
+
+
+def versioned_index_name(alias: str) -> str:
+    """Millisecond timestamp plus a random suffix, so rebuilds started together get distinct names"""
+    now = datetime.now(timezone.utc)
+    return f"{alias}_v{now.strftime('%Y%m%d%H%M%S')}{now.microsecond // 1000:03d}_{secrets.token_hex(3)}"
+
+
+def create_versioned_index(client, alias: str, mapping: dict) -> str:
+    """Create a new concrete index for `alias`, tuned for bulk loading"""
+    name = versioned_index_name(alias)
+    client.indices.create(index=name, body={
+        "settings": {"index": {"refresh_interval": "-1"}},
+        "mappings": mapping,
+    })
+    return name
+
+
+def alias_targets(client, alias: str) -> list:
+    """Concrete indices currently behind `alias`"""
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return list(client.indices.get_alias(name=alias).keys())
+
+
+def swap_alias(client, alias: str, new_index: str) -> list:
+    """Atomically point `alias` at `new_index`, returning the indices it left
+
+    A legacy concrete index named like the alias is dropped in the same
+    request, since an alias cannot be created while it exists.
+    """
+    client.indices.put_settings(index=new_index, body={"index": {"refresh_interval": "1s"}})
+    client.indices.refresh(index=new_index)
+
+    old = alias_targets(client, alias)
+    actions = [{"add": {"index": new_index, "alias": alias}}]
+    actions += [{"remove": {"index": index, "alias": alias}} for index in old]
+    if not old and client.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    client.indices.update_aliases(body={"actions": actions})
+    return old
+
+
+def ensure_index(client, alias: str, mapping: dict) -> None:
+    """Create `alias` as a plain index with `mapping` unless an index or alias already has the name"""
+    if client.indices.exists(index=alias):
+        return
+    try:
+        client.indices.create(index=alias, body={"mappings": mapping})
+    except RequestError as e:
+        # Another worker created it first
+        if e.error != "resource_already_exists_exception":
+            raise
@@ -0,0 +1,736 @@
+"""In-process OpenSearch stand-in for tests and benchmarks
+
+Selected with OPENSEARCH_MODE=memory. It covers the client calls the app
+makes -- document index/get/mget/update/delete, bulk (so opensearchpy's
+helpers work), search with from/size, sort, search_after, _source
+filtering, scroll and point in time, and the index/alias management in
+indices.py. Queries
+support bool, match, match_phrase, multi_match, term(s), range, prefix,
+exists, ids and match_all; scores are 1.0 and unsorted hits keep indexing
+order. Updates take a partial `doc` or the indices.UPDATE_SCRIPT script.
+OPENSEARCH_MEMORY_LATENCY_MS adds a fixed delay to every call.
+"""
+import copy
+import itertools
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Optional
+from opensearchpy.exceptions import NotFoundError, RequestError
+from opensearchpy.serializer import JSONSerializer
+from app.services.opensearch.indices import UPDATE_SCRIPT
+
+MAX_RESULT_WINDOW = 10000
+MISSING = object()
+_TOKEN = re.compile(r"\w+")
+
+
+def _tokens(value: Any) -> list:
+    if isinstance(value, list):
+        return [t for v in value for t in _tokens(v)]
+    if value is None:
+        return []
+    return _TOKEN.findall(str(value).lower())
+
+
+def _field(source: dict, field: str) -> Any:
+    """Value of a (dotted) field, `.keyword`-style subfields read their parent field"""
+    value = source
+    for part in field.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            if "." in field:
+                return _field(source, field.rsplit(".", 1)[0])
+            return MISSING
+    return value
+
+
+def _values(value: Any) -> list:
+    if value is MISSING or value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _not_found(error: str, reason: str) -> NotFoundError:
+    return NotFoundError(404, error, {"error": {"type": error, "reason": reason}, "status": 404})
+
+
+def _bad_request(error: str, reason: str) -> RequestError:
+    return RequestError(400, error, {"error": {"type": error, "reason": reason}, "status": 400})
+
+
+class _Index:
+    def __init__(self, name: str, body: Optional[dict] = None):
+        body = body or {}
+        self.name = name
+        self.mappings = body.get("mappings", {})
+        self.settings = body.get("settings", {})
+        self.docs: OrderedDict = OrderedDict()
+        self.versions: dict = {}
+
+
+# ---------------------------------------------------------------------------
+# Queries
+
+def _match(source: dict, field: str, spec: Any) -> bool:
+    if not isinstance(spec, dict):
+        spec = {"query": spec}
+    query_tokens = _tokens(spec["query"])
+    value = _field(source, field)
+    if value is MISSING:
+        return False
+    doc_values = _values(value)
+    if doc_values and not isinstance(doc_values[0], str):
+        return any(str(v) == str(spec["query"]) for v in doc_values)
+    doc_tokens = set(_tokens(doc_values))
+    if not query_tokens:
+        return False
+    if spec.get("operator", "or").lower() == "and":
+        return all(t in doc_tokens for t in query_tokens)
+    return any(t in doc_tokens for t in query_tokens)
+
+
+def _match_phrase(source: dict, field: str, spec: Any, prefix: bool = False) -> bool:
+    phrase = _tokens(spec["query"] if isinstance(spec, dict) else spec)
+    if not phrase:
+        return False
+    for value in _values(_field(source, field)):
+        tokens = _tokens(value)
+        for i in range(len(tokens) - len(phrase) + 1):
+            window = tokens[i:i + len(phrase)]
+            if window[:-1] == phrase[:-1] and (
+                window[-1].startswith(phrase[-1]) if prefix else window[-1] == phrase[-1]
+            ):
+                return True
+    return False
+
+
+def _multi_match(source: dict, spec: dict) -> bool:
+    fields = spec.get("fields") or list(source)
+    kind = spec.get("type", "best_fields")
+    query_tokens = _tokens(spec["query"])
+    if kind == "bool_prefix":
+        # Every term but the last must match, the last one as a prefix
+        doc_tokens = set(_tokens([_field(source, f) for f in fields if _field(source, f) is not MISSING]))
+        if not query_tokens:
+            return False
+        *terms, last = query_tokens
+        return all(t in doc_tokens for t in terms) and any(t.startswith(last) for t in doc_tokens)
+    if kind == "phrase_prefix":
+        return any(_match_phrase(source, f, spec["query"], prefix=True) for f in fields)
+    if kind == "phrase":
+        return any(_match_phrase(source, f, spec["query"]) for f in fields)
+    operator = spec.get("operator", "or")
+    return any(_match(source, f, {"query": spec["query"], "operator": operator}) for f in fields)
+
+
+def _term(value: Any, expected: Any) -> bool:
+    return any(v == expected or str(v) == str(expected) for v in _values(value))
+
+
+def _range(value: Any, bounds: dict) -> bool:
+    for v in _values(value):
+        ok = True
+        for op, bound in bounds.items():
+            if op not in ("gt", "gte", "lt", "lte") or bound is None:
+                continue
+            try:
+                if op == "gt":
+                    ok &= v > bound
+                elif op == "gte":
+                    ok &= v >= bound
+                elif op == "lt":
+                    ok &= v < bound
+                else:
+                    ok &= v <= bound
+            except TypeError:
+                ok = False
+        if ok:
+            return True
+    return False
+
+
+def _one(spec: dict) -> tuple:
+    (field, value), = spec.items()
+    return field, value
+
+
+def _matches(doc_id: str, source: dict, query: Optional[dict]) -> bool:
+    if not query:
+        return True
+    (kind, spec), = query.items()
+    if kind == "match_all":
+        return True
+    if kind == "match_none":
+        return False
+    if kind == "bool":
+        clauses = {
+            occur: clause if isinstance(clause, list) else [clause]
+            for occur in ("must", "filter", "should", "must_not")
+            for clause in [spec.get(occur, [])]
+        }
+        must, should, must_not = clauses["must"] + clauses["filter"], clauses["should"], clauses["must_not"]
+        if not all(_matches(doc_id, source, q) for q in must):
+            return False
+        if any(_matches(doc_id, source, q) for q in must_not):
+            return False
+        minimum = spec.get("minimum_should_match", 0 if must else 1)
+        if should and sum(_matches(doc_id, source, q) for q in should) < int(minimum):
+            return False
+        return True
+    if kind == "match":
+        field, value = _one(spec)
+        return _match(source, field, value)
+    if kind == "match_phrase":
+        field, value = _one(spec)
+        return _match_phrase(source, field, value)
+    if kind == "match_phrase_prefix":
+        field, value = _one(spec)
+        return _match_phrase(source, field, value, prefix=True)
+    if kind == "multi_match":
+        return _multi_match(source, spec)
+    if kind == "term":
+        field, value = _one(spec)
+        expected = value["value"] if isinstance(value, dict) else value
+        if field == "_id":
+            return doc_id == expected
+        return _term(_field(source, field), expected)
+    if kind == "terms":
+        field, options = next((k, v) for k, v in spec.items() if k != "boost")
+        if field == "_id":
+            return doc_id in options
+        return any(_term(_field(source, field), option) for option in options)
+    if kind == "range":
+        field, bounds = _one(spec)
+        return _range(_field(source, field), bounds)
+    if kind == "prefix":
+        field, value = _one(spec)
+        prefix = value["value"] if isinstance(value, dict) else value
+        return any(str(v).startswith(prefix) for v in _values(_field(source, field)))
+    if kind == "exists":
+        return _field(source, spec["field"]) not in (MISSING, None)
+    if kind == "ids":
+        return doc_id in spec["values"]
+    raise _bad_request("parsing_exception", f"unknown query [{kind}]")
+
+
+def _sort_spec(sort: Any) -> list:
+    """Normalise `sort` to [(field, descending, missing_last)]"""
+    if sort is None:
+        return []
+    if not isinstance(sort, list):
+        sort = [sort]
+    spec = []
+    for entry in sort:
+        if isinstance(entry, str):
+            field, _, order = entry.partition(":")
+            spec.append((field, (order or ("desc" if field == "_score" else "asc")) == "desc"))
+        else:
+            field, options = _one(entry)
+            order = options if isinstance(options, str) else options.get("order", "asc")
+            spec.append((field, order == "desc"))
+    return spec
+
+
+def _sort_value(doc_id: str, source: dict, position: int, field: str) -> Any:
+    if field == "_id":
+        return doc_id
+    if field in ("_doc", "_score"):
+        return position if field == "_doc" else 1.0
+    values = _values(_field(source, field))
+    return min(values) if values else None
+
+
+class _Reverse:
+    """Sort wrapper inverting comparisons for descending keys"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(values: list, spec: list) -> tuple:
+    key = []
+    for value, (_, descending) in zip(values, spec):
+        # Docs without the field sort last in either direction
+        present = (0, value) if value is not None else (1, 0)
+        key.append((present[0], _Reverse(present[1]) if descending else present[1]))
+    return tuple(key)
+
+
+def _filter_source(source: dict, selector: Any) -> Optional[dict]:
+    if selector is None or selector is True:
+        return copy.deepcopy(source)
+    if selector is False:
+        return None
+    if isinstance(selector, str):
+        selector = [s for s in selector.split(",") if s]
+    includes, excludes = selector, []
+    if isinstance(selector, dict):
+        includes = selector.get("includes", selector.get("include", []))
+        excludes = selector.get("excludes", selector.get("exclude", []))
+    result = {k: copy.deepcopy(v) for k, v in source.items() if not includes or k in includes}
+    for field in excludes:
+        result.pop(field, None)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Client
+
+class MemoryIndicesClient:
+    def __init__(self, client: "MemoryOpenSearch"):
+        self._client = client
+
+    def create(self, index: str, body: Optional[dict] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            if index in self._client._indices or index in self._client._aliases:
+                raise _bad_request("resource_already_exists_exception", f"index [{index}] already exists")
+            self._client._indices[index] = _Index(index, body)
+            for alias in (body or {}).get("aliases", {}):
+                self._client._aliases.setdefault(alias, set()).add(index)
+        return {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+    def delete(self, index: str, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            names = self._client._resolve(index, allow_missing=False)
+            for name in names:
+                del self._client._indices[name]
+                for targets in self._client._aliases.values():
+                    targets.discard(name)
+            self._client._aliases = {a: t for a, t in self._client._aliases.items() if t}
+        return {"acknowledged": True}
+
+    def exists(self, index: str, **kwargs) -> bool:
+        self._client._delay()
+        with self._client._lock:
+            return all(
+                name in self._client._indices or name in self._client._aliases
+                for name in index.split(",")
+            )
+
+    def exists_alias(self, name: str, index: Optional[str] = None, **kwargs) -> bool:
+        self._client._delay()
+        with self._client._lock:
+            targets = self._client._aliases.get(name, set())
+            return bool(targets) and (index is None or index in targets)
+
+    def get_alias(self, index: Optional[str] = None, name: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            result = {}
+            for alias, targets in self._client._aliases.items():
+                if name is not None and alias != name:
+                    continue
+                for target in targets:
+                    if index is None or target == index:
+                        result.setdefault(target, {"aliases": {}})["aliases"][alias] = {}
+            if name is not None and not result:
+                raise _not_found("alias_missing_exception", f"alias [{name}] missing")
+            return result
+
+    def update_aliases(self, body: dict, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            aliases = {alias: set(targets) for alias, targets in self._client._aliases.items()}
+            removed = []
+            for action in body["actions"]:
+                (kind, spec), = action.items()
+                if kind == "add":
+                    if spec["index"] not in self._client._indices:
+                        raise _not_found("index_not_found_exception", f"no such index [{spec['index']}]")
+                    if spec["alias"] in self._client._indices and spec["alias"] not in (
+                        a.get("remove_index", {}).get("index") for a in body["actions"]
+                    ):
+                        raise _bad_request("invalid_alias_name_exception", f"an index exists with the same name as the alias [{spec['alias']}]")
+                    aliases.setdefault(spec["alias"], set()).add(spec["index"])
+                elif kind == "remove":
+                    if spec["index"] not in aliases.get(spec["alias"], set()):
+                        raise _not_found("aliases_not_found_exception", f"aliases [{spec['alias']}] missing")
+                    aliases[spec["alias"]].discard(spec["index"])
+                elif kind == "remove_index":
+                    if spec["index"] not in self._client._indices:
+                        raise _not_found("index_not_found_exception", f"no such index [{spec['index']}]")
+                    removed.append(spec["index"])
+            for name in removed:
+                del self._client._indices[name]
+            self._client._aliases = {a: t for a, t in aliases.items() if t}
+        return {"acknowledged": True}
+
+    def put_alias(self, index: str, name: str, **kwargs) -> dict:
+        return self.update_aliases({"actions": [{"add": {"index": index, "alias": name}}]})
+
+    def put_settings(self, body: dict, index: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            for name in self._client._resolve(index or "_all", allow_missing=False):
+                settings = self._client._indices[name].settings
+                for key, value in body.items():
+                    if isinstance(value, dict):
+                        settings.setdefault(key, {}).update(value)
+                    else:
+                        settings[key] = value
+        return {"acknowledged": True}
+
+    def get_settings(self, index: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            return {
+                name: {"settings": copy.deepcopy(self._client._indices[name].settings)}
+                for name in self._client._resolve(index or "_all", allow_missing=False)
+            }
+
+    def get_mapping(self, index: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            return {
+                name: {"mappings": copy.deepcopy(self._client._indices[name].mappings)}
+                for name in self._client._resolve(index or "_all", allow_missing=False)
+            }
+
+    def put_mapping(self, body: dict, index: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        with self._client._lock:
+            for name in self._client._resolve(index or "_all", allow_missing=False):
+                mappings = self._client._indices[name].mappings
+                mappings.setdefault("properties", {}).update(body.get("properties", {}))
+        return {"acknowledged": True}
+
+    def refresh(self, index: Optional[str] = None, **kwargs) -> dict:
+        self._client._delay()
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+
+class MemoryOpenSearch:
+    """opensearchpy `OpenSearch` client over in-memory indices"""
+
+    def __init__(self, latency_ms: float = 0):
+        self._latency = latency_ms / 1000
+        self._lock = threading.RLock()
+        self._indices: dict = {}
+        self._aliases: dict = {}
+        self._scrolls: dict = {}
+        self._pits: dict = {}
+        self._scroll_ids = itertools.count(1)
+        self.indices = MemoryIndicesClient(self)
+        # opensearchpy.helpers serialise bulk actions with the client's serializer
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def _delay(self):
+        if self._latency:
+            time.sleep(self._latency)
+
+    def _resolve(self, index: Optional[str], allow_missing: bool = True) -> list:
+        """Concrete index names for a comma-separated list of indices/aliases"""
+        if index in (None, "_all", "*"):
+            return list(self._indices)
+        names = []
+        for name in index.split(","):
+            if name in self._indices:
+                names.append(name)
+            elif name in self._aliases:
+                names.extend(sorted(self._aliases[name]))
+            elif "*" in name:
+                pattern = re.compile(re.escape(name).replace(r"\*", ".*") + "$")
+                names.extend(n for n in self._indices if pattern.match(n))
+            elif not allow_missing:
+                raise _not_found("index_not_found_exception", f"no such index [{name}]")
+        return names
+
+    def _write_index(self, index: str, create: bool = True) -> _Index:
+        if index in self._aliases:
+            targets = self._aliases[index]
+            if len(targets) != 1:
+                raise _bad_request("illegal_argument_exception", f"no write index is defined for alias [{index}]")
+            index = next(iter(targets))
+        if index not in self._indices:
+            if not create:
+                raise _not_found("index_not_found_exception", f"no such index [{index}]")
+            self._indices[index] = _Index(index)
+        return self._indices[index]
+
+    # documents
+
+    def info(self, **kwargs) -> dict:
+        self._delay()
+        return {"name": "memory", "cluster_name": "memory", "version": {"distribution": "opensearch", "number": "2.x"}}
+
+    def ping(self, **kwargs) -> bool:
+        self._delay()
+        return True
+
+    def _put(self, target: _Index, doc_id: Optional[str], source: dict, op_type: str = "index") -> dict:
+        doc_id = str(doc_id) if doc_id is not None else f"mem{next(self._scroll_ids)}"
+        if op_type == "create" and doc_id in target.docs:
+            return {"_index": target.name, "_id": doc_id, "status": 409,
+                    "error": {"type": "version_conflict_engine_exception", "reason": "document already exists"}}
+        result = "updated" if doc_id in target.docs else "created"
+        target.docs[doc_id] = copy.deepcopy(source)
+        target.versions[doc_id] = target.versions.get(doc_id, 0) + 1
+        return {"_index": target.name, "_id": doc_id, "_version": target.versions[doc_id],
+                "result": result, "status": 201 if result == "created" else 200}
+
+    def _update(self, target: _Index, doc_id: str, body: dict) -> dict:
+        doc_id = str(doc_id)
+        if doc_id not in target.docs:
+            if body.get("doc_as_upsert"):
+                return self._put(target, doc_id, body["doc"])
+            if "upsert" in body:
+                return self._put(target, doc_id, body["upsert"])
+            return {"_index": target.name, "_id": doc_id, "status": 404,
+                    "error": {"type": "document_missing_exception", "reason": f"[{doc_id}]: document missing"}}
+        merged = target.docs[doc_id]
+        changed = False
+        doc = body.get("doc", {})
+        if "script" in body:
+            script = body["script"]
+            if script.get("source") != UPDATE_SCRIPT:
+                return {"_index": target.name, "_id": doc_id, "status": 400,
+                        "error": {"type": "illegal_argument_exception", "reason": "unsupported script"}}
+            doc = script["params"]["doc"]
+            for key in script["params"]["remove"]:
+                changed = merged.pop(key, MISSING) is not MISSING or changed
+        for key, value in doc.items():
+            if merged.get(key, MISSING) != value:
+                merged[key] = copy.deepcopy(value)
+                changed = True
+        if changed:
+            target.versions[doc_id] += 1
+        return {"_index": target.name, "_id": doc_id, "_version": target.versions[doc_id],
+                "result": "updated" if changed else "noop", "status": 200}
+
+    def _remove(self, target: _Index, doc_id: str) -> dict:
+        doc_id = str(doc_id)
+        if target.docs.pop(doc_id, None) is None:
+            return {"_index": target.name, "_id": doc_id, "result": "not_found", "status": 404}
+        target.versions.pop(doc_id, None)
+        return {"_index": target.name, "_id": doc_id, "result": "deleted", "status": 200}
+
+    @staticmethod
+    def _raise_for(result: dict) -> dict:
+        if result["status"] == 404:
+            error = result.get("error", {"type": "not_found", "reason": "document missing"})
+            raise NotFoundError(404, error["type"], {**result, "found": False})
+        if result["status"] >= 400:
+            raise RequestError(result["status"], result["error"]["type"], result)
+        return {k: v for k, v in result.items() if k not in ("status", "error")}
+
+    def index(self, index: str, body: dict, id: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            return self._raise_for(self._put(self._write_index(index), id, body, kwargs.get("op_type", "index")))
+
+    def create(self, index: str, id: str, body: dict, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            return self._raise_for(self._put(self._write_index(index), id, body, "create"))
+
+    def update(self, index: str, id: str, body: dict, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            return self._raise_for(self._update(self._write_index(index, create=False), id, body))
+
+    def delete(self, index: str, id: str, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            return self._raise_for(self._remove(self._write_index(index, create=False), id))
+
+    def get(self, index: str, id: str, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            for name in self._resolve(index, allow_missing=False):
+                source = self._indices[name].docs.get(str(id))
+                if source is not None:
+                    return {"_index": name, "_id": str(id), "found": True,
+                            "_version": self._indices[name].versions[str(id)],
+                            "_source": _filter_source(source, kwargs.get("_source"))}
+            raise NotFoundError(404, "not_found", {"_index": index, "_id": str(id), "found": False})
+
+    def exists(self, index: str, id: str, **kwargs) -> bool:
+        try:
+            self.get(index, id)
+            return True
+        except NotFoundError:
+            return False
+
+    def mget(self, body: dict, index: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        requests = [{"_id": i, "_index": index} for i in body.get("ids", [])] + body.get("docs", [])
+        docs = []
+        with self._lock:
+            for request in requests:
+                doc_id, name = str(request["_id"]), request.get("_index") or index
+                found = None
+                for concrete in self._resolve(name):
+                    if doc_id in self._indices[concrete].docs:
+                        found = concrete
+                        break
+                if found:
+                    docs.append({"_index": found, "_id": doc_id, "found": True,
+                                 "_version": self._indices[found].versions[doc_id],
+                                 "_source": _filter_source(self._indices[found].docs[doc_id],
+                                                           request.get("_source", kwargs.get("_source")))})
+                else:
+                    docs.append({"_index": name, "_id": doc_id, "found": False})
+        return {"docs": docs}
+
+    def bulk(self, body: Any, index: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        if isinstance(body, (list, tuple)):
+            lines = [line if isinstance(line, str) else json.dumps(line) for line in body]
+        else:
+            lines = body.decode() if isinstance(body, bytes) else body
+            lines = lines.splitlines()
+        lines = iter(json.loads(line) for line in lines if line.strip())
+
+        items = []
+        with self._lock:
+            for action in lines:
+                (op, meta), = action.items()
+                name = meta.get("_index") or index
+                doc_id = meta.get("_id")
+                source = next(lines) if op in ("index", "create", "update") else None
+                try:
+                    if op in ("index", "create"):
+                        result = self._put(self._write_index(name), doc_id, source, op)
+                    elif op == "update":
+                        result = self._update(self._write_index(name, create=False), doc_id, source)
+                    elif op == "delete":
+                        result = self._remove(self._write_index(name, create=False), doc_id)
+                    else:
+                        raise _bad_request("illegal_argument_exception", f"Malformed action/metadata line [{op}]")
+                except (NotFoundError, RequestError) as e:
+                    result = {"_index": name, "_id": doc_id, "status": e.status_code,
+                              "error": {"type": e.error, "reason": str(e.info)}}
+                items.append({op: result})
+        errors = any(item[op]["status"] >= 400 and not (op == "delete" and item[op]["status"] == 404)
+                     for item in items for op in item)
+        return {"took": 0, "errors": errors, "items": items}
+
+    # search
+
+    def _hits(self, index: Optional[str], body: dict, source_selector: Any, views: Optional[list] = None) -> tuple:
+        query = body.get("query")
+        spec = _sort_spec(body.get("sort"))
+        matches = []
+        if views is None:
+            views = [(name, self._indices[name].docs) for name in self._resolve(index or "_all")]
+        for name, docs in views:
+            for position, (doc_id, source) in enumerate(docs.items()):
+                if _matches(doc_id, source, query):
+                    matches.append((name, doc_id, source, position))
+        if spec:
+            keyed = [
+                (_sort_key(values, spec), values, match)
+                for match in matches
+                for values in [[_sort_value(match[1], match[2], match[3], f) for f, _ in spec]]
+            ]
+            if "search_after" in body:
+                after = _sort_key(body["search_after"], spec)
+                keyed = [k for k in keyed if after < k[0]]
+            keyed.sort(key=lambda k: k[0])
+            ordered = [(match, values) for _, values, match in keyed]
+        else:
+            ordered = [(match, None) for match in matches]
+
+        hits = []
+        for (name, doc_id, source, _), values in ordered:
+            hit = {"_index": name, "_id": doc_id, "_score": None if spec else 1.0}
+            filtered = _filter_source(source, source_selector)
+            if filtered is not None:
+                hit["_source"] = filtered
+            if values is not None:
+                hit["sort"] = values
+            hits.append(hit)
+        return hits
+
+    def _response(self, hits: list, total: int, **extra) -> dict:
+        return {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": total, "relation": "eq"}, "max_score": 1.0 if hits else None, "hits": hits},
+            **extra,
+        }
+
+    def search(self, body: Optional[dict] = None, index: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        body = dict(body or {})
+        for param in ("from_", "size", "sort", "_source"):
+            if kwargs.get(param) is not None:
+                body.setdefault(param.rstrip("_") if param == "from_" else param, kwargs[param])
+        if isinstance(body.get("sort"), str) and "," in body["sort"]:
+            body["sort"] = body["sort"].split(",")
+        start, size = int(body.get("from", 0)), int(body.get("size", 10))
+        if kwargs.get("scroll") is None and start + size > MAX_RESULT_WINDOW:
+            raise _bad_request("illegal_argument_exception", f"Result window is too large, from + size must be less than or equal to: [{MAX_RESULT_WINDOW}]")
+
+        pit = body.get("pit")
+        with self._lock:
+            if pit is not None:
+                if index is not None:
+                    raise _bad_request("illegal_argument_exception", "[indices] cannot be used with point in time")
+                if pit.get("id") not in self._pits:
+                    raise _not_found("search_context_missing_exception", f"No search context found for id [{pit.get('id')}]")
+                hits = self._hits(None, body, body.get("_source"), self._pits[pit["id"]])
+                return self._response(hits[start:start + size], len(hits), pit_id=pit["id"])
+            if index is not None and not self._resolve(index) and not kwargs.get("ignore_unavailable"):
+                raise _not_found("index_not_found_exception", f"no such index [{index}]")
+            hits = self._hits(index, body, body.get("_source"))
+
+        if kwargs.get("scroll"):
+            scroll_id = str(next(self._scroll_ids))
+            self._scrolls[scroll_id] = (hits[size:], size, len(hits))
+            return self._response(hits[:size], len(hits), _scroll_id=scroll_id)
+        return self._response(hits[start:start + size], len(hits))
+
+    def scroll(self, body: Optional[dict] = None, scroll_id: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        scroll_id = scroll_id or (body or {}).get("scroll_id")
+        if scroll_id not in self._scrolls:
+            raise _not_found("search_context_missing_exception", f"No search context found for id [{scroll_id}]")
+        remaining, size, total = self._scrolls[scroll_id]
+        self._scrolls[scroll_id] = (remaining[size:], size, total)
+        return self._response(remaining[:size], total, _scroll_id=scroll_id)
+
+    def clear_scroll(self, body: Optional[dict] = None, scroll_id: Any = None, **kwargs) -> dict:
+        self._delay()
+        ids = scroll_id or (body or {}).get("scroll_id") or []
+        for sid in [ids] if isinstance(ids, str) else ids:
+            self._scrolls.pop(sid, None)
+        return {"succeeded": True, "num_freed": len(ids)}
+
+    def create_pit(self, index: str, params: Optional[dict] = None, **kwargs) -> dict:
+        """Point in time: searches with its id see the indices as they are now"""
+        self._delay()
+        with self._lock:
+            names = self._resolve(index)
+            if not names:
+                raise _not_found("index_not_found_exception", f"no such index [{index}]")
+            pit_id = f"pit-{next(self._scroll_ids)}"
+            self._pits[pit_id] = [(name, dict(self._indices[name].docs)) for name in names]
+        return {"pit_id": pit_id, "_shards": {"total": len(names), "successful": len(names), "skipped": 0, "failed": 0},
+                "creation_time": int(time.time() * 1000)}
+
+    def delete_pit(self, body: Optional[dict] = None, **kwargs) -> dict:
+        self._delay()
+        ids = (body or {}).get("pit_id") or []
+        with self._lock:
+            freed = [pit_id for pit_id in ids if self._pits.pop(pit_id, None) is not None]
+        return {"pits": [{"pit_id": pit_id, "successful": pit_id in freed} for pit_id in ids]}
+
+    def count(self, body: Optional[dict] = None, index: Optional[str] = None, **kwargs) -> dict:
+        self._delay()
+        with self._lock:
+            return {"count": len(self._hits(index, body or {}, False))}
@@ -0,0 +1,65 @@
+"""OpenSearch queries for UserFilter, and the same filter evaluated in Python
+
+`filter_matches` gives the answer `user_query` would for one stored user,
+so membership kept outside OpenSearch (saved segments) can be updated as
+users change without a search. Text criteria are `match` queries: any
+word of the criterion, compared case-insensitively, selects the user, as
+with the standard analyzer.
+"""
+import re
+from app.models import UserFilter
+
+_WORD = re.compile(r"\w+")
+
+TEXT_CRITERIA = ("company", "jobTitle", "city", "state")
+
+
+def user_query(filter: UserFilter) -> dict:
+    """OpenSearch query matching the users selected by `filter`"""
+    must_clauses = []
+
+    if filter.company:
+        must_clauses.append({"match": {"company": filter.company}})
+    if filter.jobTitle:
+        must_clauses.append({"match": {"jobTitle": filter.jobTitle}})
+    if filter.city:
+        must_clauses.append({"match": {"city": filter.city}})
+    if filter.state:
+        must_clauses.append({"match": {"state": filter.state}})
+
+    if filter.minAttended is not None or filter.maxAttended is not None:
+        attended_range = {}
+        if filter.minAttended is not None:
+            attended_range["gte"] = filter.minAttended
+        if filter.maxAttended is not None:
+            attended_range["lte"] = filter.maxAttended
+        must_clauses.append({"range": {"attendedCount": attended_range}})
+
+    if filter.minHosted is not None or filter.maxHosted is not None:
+        hosted_range = {}
+        if filter.minHosted is not None:
+            hosted_range["gte"] = filter.minHosted
+        if filter.maxHosted is not None:
+            hosted_range["lte"] = filter.maxHosted
+        must_clauses.append({"range": {"hostedCount": hosted_range}})
+
+    return {"bool": {"must": must_clauses}}
+
+
+def _words(value) -> set:
+    return set(_WORD.findall(str(value).lower())) if value is not None else set()
+
+
+def _within(value, low, high) -> bool:
+    value = int(value or 0)
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def filter_matches(filter: UserFilter, record: dict) -> bool:
+    """Whether `user_query(filter)` selects the user stored as `record`"""
+    for field in TEXT_CRITERIA:
+        criterion = getattr(filter, field)
+        if criterion and not _words(criterion) & _words(record.get(field)):
+            return False
+    return (_within(record.get("attendedCount"), filter.minAttended, filter.maxAttended)
+            and _within(record.get("hostedCount"), filter.minHosted, filter.maxHosted))
@@ -0,0 +1,162 @@
+"""Rebuild or reconcile the `users` OpenSearch index from DynamoDB.
+
+    python -m app.services.opensearch.reindex              # rebuild behind the alias
+    python -m app.services.opensearch.reindex --events     # rebuild the `events` index
+    python -m app.services.opensearch.reindex --diff       # fix mismatched docs only
+    python -m app.services.opensearch.reindex --diff --dry-run
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from boto3.dynamodb.conditions import Attr
+from opensearchpy import helpers
+from app.models import Event, User
+from app.serialization import stored_record
+from app.services.db.scan import parallel_scan
+from app.services.db.batch import BATCH_GET_LIMIT, batch_get_chunk
+from app.services.db.session import MAIN_TABLE_NAME
+from app.services.opensearch.client import get_opensearch_client
+from app.services.opensearch.indices import (
+    USERS_INDEX, USERS_MAPPING, EVENTS_INDEX, EVENTS_MAPPING, create_versioned_index, swap_alias,
+)
+
+DEFAULT_SEGMENTS = 8
+USER_FILTER = Attr("type").eq("user")
+KEY_ONLY = {"ProjectionExpression": "PK, SK"}
+
+
+def user_doc(item: dict) -> dict:
+    """The `users` doc of a stored user item, as User.to_opensearch_doc() would index it"""
+    return {k: v for k, v in stored_record(User, item).items() if v is not None}
+
+
+class Report:
+    """Thread-safe counters shared by the scan workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.started = time.monotonic()
+
+    def add(self, **counts):
+        with self._lock:
+            self.counts.update(counts)
+
+    def summary(self) -> dict:
+        return {**self.counts, "seconds": round(time.monotonic() - self.started, 2)}
+
+
+def _bulk(client, actions: list, report: Report):
+    if not actions:
+        return
+    _, errors = helpers.bulk(client, actions, raise_on_error=False, refresh=False)
+    report.add(errors=len(errors))
+
+
+def rebuild_users_index(segments: int = DEFAULT_SEGMENTS, delete_old: bool = False) -> dict:
+    """Load every user into a new index version, swap the alias, then reconcile
+
+    Writes that land on the old index while the load runs are picked up by
+    the reconcile pass that follows the swap.
+    """
+    client = get_opensearch_client()
+    report = Report()
+    new_index = create_versioned_index(client, USERS_INDEX, USERS_MAPPING)
+
+    def handle_page(items: list):
+        actions = [{"_index": new_index, "_id": doc["id"], "_source": doc} for doc in map(user_doc, items)]
+        _bulk(client, actions, report)
+        report.add(scanned=len(items), indexed=len(actions))
+
+    parallel_scan(segments, handle_page, FilterExpression=USER_FILTER)
+    old = swap_alias(client, USERS_INDEX, new_index)
+    if delete_old and old:
+        client.indices.delete(index=",".join(old))
+
+    summary = {"index": new_index, "replaced": old, **report.summary()}
+    summary["reconcile"] = reconcile_users_index(segments)
+    return summary
+
+
+def event_doc(item: dict) -> dict:
+    """The `events` doc of a stored event item"""
+    return {k: v for k, v in stored_record(Event, item).items() if v is not None}
+
+
+def rebuild_events_index(segments: int = DEFAULT_SEGMENTS, delete_old: bool = False) -> dict:
+    """Load every event into a new `events` index version and swap the alias"""
+    client = get_opensearch_client()
+    report = Report()
+    new_index = create_versioned_index(client, EVENTS_INDEX, EVENTS_MAPPING)
+
+    def handle_page(items: list):
+        actions = [{"_index": new_index, "_id": doc["id"], "_source": doc} for doc in map(event_doc, items)]
+        _bulk(client, actions, report)
+        report.add(scanned=len(items), indexed=len(actions))
+
+    parallel_scan(segments, handle_page, FilterExpression=Attr("type").eq("event"))
+    old = swap_alias(client, EVENTS_INDEX, new_index)
+    if delete_old and old:
+        client.indices.delete(index=",".join(old))
+    return {"index": new_index, "replaced": old, **report.summary()}
+
+
+def reconcile_users_index(segments: int = DEFAULT_SEGMENTS, fix: bool = True) -> dict:
+    """Compare DynamoDB users with indexed docs and repair only the differences
+
+    Missing or stale docs are re-indexed, docs without a DynamoDB user are
+    deleted. With fix=False the differences are only counted.
+    """
+    client = get_opensearch_client()
+    report = Report()
+
+    def handle_page(items: list):
+        docs = {doc["id"]: doc for doc in map(user_doc, items)}
+        res = client.mget(index=USERS_INDEX, body={"ids": list(docs)})
+        actions = []
+        for hit in res["docs"]:
+            doc = docs[hit["_id"]]
+            if not hit.get("found"):
+                report.add(missing=1)
+            elif hit["_source"] != doc:
+                report.add(mismatched=1)
+            else:
+                continue
+            actions.append({"_index": USERS_INDEX, "_id": doc["id"], "_source": doc})
+        if fix:
+            _bulk(client, actions, report)
+        report.add(scanned=len(items), fixed=len(actions) if fix else 0)
+
+    parallel_scan(segments, handle_page, FilterExpression=USER_FILTER)
+
+    # Orphans are found by checking indexed ids against DynamoDB in key-only
+    # batches, which keeps memory flat instead of holding every user id
+    hits = helpers.scan(client, index=USERS_INDEX, query={"query": {"match_all": {}}}, _source=False)
+    indexed_ids = (hit["_id"] for hit in hits)
+    while ids := list(islice(indexed_ids, BATCH_GET_LIMIT)):
+        keys = [{"PK": f"user#{i}", "SK": f"user#{i}"} for i in ids]
+        found = {item["PK"] for item in batch_get_chunk(MAIN_TABLE_NAME, keys, KEY_ONLY)}
+        orphans = [i for i in ids if f"user#{i}" not in found]
+        report.add(orphaned=len(orphans))
+        if fix:
+            _bulk(client, [{"_op_type": "delete", "_index": USERS_INDEX, "_id": i} for i in orphans], report)
+    return report.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or reconcile the users OpenSearch index")
+    parser.add_argument("--events", action="store_true", help="rebuild the events index instead of users")
+    parser.add_argument("--diff", action="store_true", help="only fix docs that differ from DynamoDB")
+    parser.add_argument("--dry-run", action="store_true", help="with --diff, report differences without fixing")
+    parser.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan workers")
+    parser.add_argument("--delete-old", action="store_true", help="delete the previous index version after the swap")
+    args = parser.parse_args()
+
+    if args.events:
+        print(rebuild_events_index(args.segments, delete_old=args.delete_old))
+    elif args.diff:
+        print(reconcile_users_index(args.segments, fix=not args.dry_run))
+    else:
+        print(rebuild_users_index(args.segments, delete_old=args.delete_old))
@@ -0,0 +1,279 @@
+"""Index updates from write paths, queued for replay while OpenSearch is unavailable
+
+Every write path reaches OpenSearch through this module. Each call goes
+through the client's circuit breaker (`guarded`) with a timeout of at most
+OPENSEARCH_WRITE_TIMEOUT, shortened to what is left of the request budget.
+When the breaker is open, the budget is spent or the call fails with the
+cluster unavailable, the doc is queued instead and the write returns as
+fast as DynamoDB answers.
+
+The queue lives on the main table, one item per doc (PK
+`osqueue#{shard}`, SK `{index}#{id}`), so a doc changed many times during
+an outage is queued once. Replay does not keep the queued operations: it
+reads each doc's current DynamoDB item and indexes it in full, or deletes
+the doc when the item is gone. That is correct whatever order the missed
+updates came in. A write path that indexes a newer version while the bulk
+call is in flight can still be overwritten by it, so the items are read
+again afterwards and a doc whose item changed stays queued for the next
+replay.
+
+Only the worker holding the replay lease (an item on the main table that
+expires after OPENSEARCH_REPLAY_LEASE_SECONDS) replays. The app replays
+every OPENSEARCH_REPLAY_SECONDS while the breaker lets calls through; it
+can also be run by hand:
+
+    python -m app.services.opensearch.sync replay
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+from opensearchpy import helpers
+from opensearchpy.exceptions import NotFoundError
+from app.config import settings
+from app.services.db.batch import BATCH_GET_LIMIT, BATCH_WRITE_LIMIT, batch_get_chunk, batch_write_chunk, chunks
+from app.services.db.scan import query_pages
+from app.services.db.session import MAIN_TABLE_NAME, table
+from app.services.opensearch.client import (
+    OpenSearchUnavailable, get_opensearch_client, guarded, search_unavailable,
+)
+from app.services.opensearch.indices import USERS_INDEX, EVENTS_INDEX, UPDATE_SCRIPT
+from app.services.opensearch.reindex import user_doc, event_doc
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SHARDS = 8
+LEASE_KEY = {"PK": "osqueue#lease", "SK": "osqueue#lease"}
+SOURCES = {USERS_INDEX: ("user", user_doc), EVENTS_INDEX: ("event", event_doc)}
+
+
+def _queue_key(index: str, doc_id: str) -> dict:
+    return {"PK": f"osqueue#{zlib.crc32(doc_id.encode()) % QUEUE_SHARDS}", "SK": f"{index}#{doc_id}"}
+
+
+def enqueue(index: str, doc_ids: List[str]) -> None:
+    """Queue docs for replay; a doc already queued gets a new token (see _replay_entries)"""
+    queued_at = datetime.now(timezone.utc).isoformat()
+    requests = [
+        {"PutRequest": {"Item": {**_queue_key(index, doc_id), "queuedAt": queued_at, "token": uuid.uuid4().hex}}}
+        for doc_id in dict.fromkeys(doc_ids)
+    ]
+    try:
+        for chunk in chunks(requests, BATCH_WRITE_LIMIT):
+            batch_write_chunk(MAIN_TABLE_NAME, chunk)
+    except (ClientError, RuntimeError) as e:
+        logger.error(f"Could not queue {len(doc_ids)} {index} docs for replay, "
+                     f"`reindex --diff` will repair them: {e}")
+
+
+def _call(index: str, doc_ids: List[str], fn, /, *args, **kwargs):
+    """Run one side effect through the breaker; None when it was queued instead"""
+    try:
+        return guarded(fn, *args, timeout=settings.opensearch.write_timeout, **kwargs)
+    except OpenSearchUnavailable:
+        enqueue(index, doc_ids)
+    except NotFoundError:
+        # Partial update of a doc that was never indexed: replay sends the whole doc
+        enqueue(index, doc_ids)
+    except Exception as e:
+        if not search_unavailable(e):
+            raise
+        logger.warning(f"OpenSearch unavailable, queued {len(doc_ids)} {index} docs: {e}")
+        enqueue(index, doc_ids)
+    return None
+
+
+def index_doc(index: str, doc_id: str, body: dict) -> None:
+    _call(index, [doc_id], get_opensearch_client().index, index=index, id=doc_id, body=body)
+
+
+def update_doc(index: str, doc_id: str, doc: dict) -> None:
+    """Partial update of an indexed doc; fields set to None are removed from it"""
+    values = {k: v for k, v in doc.items() if v is not None}
+    remove = [k for k, v in doc.items() if v is None]
+    body = {"doc": values}
+    if remove:
+        body = {"script": {"source": UPDATE_SCRIPT, "lang": "painless", "params": {"doc": values, "remove": remove}}}
+    _call(index, [doc_id], get_opensearch_client().update, index=index, id=doc_id, body=body)
+
+
+def delete_doc(index: str, doc_id: str) -> None:
+    try:
+        _call(index, [doc_id], get_opensearch_client().delete, index=index, id=doc_id)
+    except NotFoundError:
+        pass
+
+
+def update_docs(index: str, docs: Dict[str, dict]) -> None:
+    """Partial updates of many docs in one bulk request; docs it could not update are queued"""
+    if not docs:
+        return
+    actions = [{"_op_type": "update", "_index": index, "_id": doc_id, "doc": doc} for doc_id, doc in docs.items()]
+    result = _call(index, list(docs), helpers.bulk, get_opensearch_client(), actions, raise_on_error=False)
+    if result is None:
+        return
+    failed = [item["update"]["_id"] for item in result[1]]
+    if failed:
+        logger.warning(f"OpenSearch bulk update failed for {len(failed)} {index} docs, queued for replay")
+        enqueue(index, failed)
+
+
+def queued(shard: int) -> List[dict]:
+    return [item for page in query_pages(KeyConditionExpression=Key("PK").eq(f"osqueue#{shard}"),
+                                         ConsistentRead=True)
+            for item in page]
+
+
+def _read_items(prefix: str, ids) -> Dict[str, dict]:
+    keys = [{"PK": f"{prefix}#{i}", "SK": f"{prefix}#{i}"} for i in ids]
+    items = {}
+    for chunk in chunks(keys, BATCH_GET_LIMIT):
+        for item in batch_get_chunk(MAIN_TABLE_NAME, chunk, {"ConsistentRead": True}):
+            items[item["PK"].partition("#")[2]] = item
+    return items
+
+
+def _replay_entries(entries: List[dict]) -> int:
+    """Index the current state of the queued docs and drop the entries that were applied"""
+    by_index: Dict[str, List[dict]] = {}
+    for entry in entries:
+        index, _, _ = entry["SK"].partition("#")
+        by_index.setdefault(index, []).append(entry)
+
+    done = []
+    for index, index_entries in by_index.items():
+        if index not in SOURCES:
+            logger.warning(f"Dropping queued docs of unknown index {index}")
+            done.extend(index_entries)
+            continue
+        prefix, to_doc = SOURCES[index]
+        ids = {entry["SK"].partition("#")[2]: entry for entry in index_entries}
+        items = _read_items(prefix, ids)
+        actions = [
+            {"_index": index, "_id": doc_id, "_source": to_doc(items[doc_id])} if doc_id in items
+            else {"_op_type": "delete", "_index": index, "_id": doc_id}
+            for doc_id in ids
+        ]
+        _, errors = guarded(helpers.bulk, get_opensearch_client(), actions, raise_on_error=False,
+                            timeout=settings.opensearch.timeout)
+        failed = set()
+        for error in errors:
+            (op, result), = error.items()
+            # A doc already gone is what the delete wanted
+            if not (op == "delete" and result.get("status") == 404):
+                failed.add(result["_id"])
+        if failed:
+            logger.warning(f"Replay of {len(failed)} {index} docs failed, kept queued")
+        # A write during the bulk call may have been overwritten with the state read above
+        current = _read_items(prefix, ids)
+        changed = {doc_id for doc_id in ids if current.get(doc_id) != items.get(doc_id)}
+        if changed:
+            logger.info(f"{len(changed)} {index} docs changed during replay, kept queued")
+        failed |= changed
+        done.extend(entry for doc_id, entry in ids.items() if doc_id not in failed)
+
+    for entry in done:
+        try:
+            # A doc queued again meanwhile keeps its entry for the next replay
+            table.delete_item(Key={"PK": entry["PK"], "SK": entry["SK"]},
+                              ConditionExpression="#t = :t",
+                              ExpressionAttributeNames={"#t": "token"},
+                              ExpressionAttributeValues={":t": entry["token"]})
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    return len(done)
+
+
+def _hold_lease(owner: str) -> bool:
+    """Take the replay lease, or extend it when `owner` already holds it"""
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item={**LEASE_KEY, "owner": owner, "leaseUntil": now + settings.opensearch.replay_lease_seconds},
+            ConditionExpression="attribute_not_exists(PK) OR leaseUntil < :now OR #o = :owner",
+            ExpressionAttributeNames={"#o": "owner"},
+            ExpressionAttributeValues={":now": now, ":owner": owner},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+def _release_lease(owner: str) -> None:
+    try:
+        table.delete_item(Key=LEASE_KEY, ConditionExpression="#o = :owner",
+                          ExpressionAttributeNames={"#o": "owner"}, ExpressionAttributeValues={":owner": owner})
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def replay() -> dict:
+    """Replay every queued doc; stops at the first shard OpenSearch cannot take
+
+    Nothing is replayed while another worker holds the replay lease.
+    """
+    counts = {"replayed": 0, "pending": 0}
+    owner = uuid.uuid4().hex
+    if not _hold_lease(owner):
+        return {**counts, "error": "replay lease held by another worker"}
+    try:
+        for shard in range(QUEUE_SHARDS):
+            entries = queued(shard)
+            if not entries:
+                continue
+            try:
+                for batch in chunks(entries, BATCH_GET_LIMIT):
+                    if not _hold_lease(owner):
+                        counts["error"] = "replay lease lost"
+                        return counts
+                    counts["replayed"] += _replay_entries(batch)
+            except Exception as e:
+                if not search_unavailable(e):
+                    raise
+                counts["pending"] = sum(len(queued(s)) for s in range(QUEUE_SHARDS))
+                counts["error"] = str(e)
+                break
+    finally:
+        _release_lease(owner)
+    return counts
+
+
+def queue_depth() -> int:
+    return sum(len(queued(shard)) for shard in range(QUEUE_SHARDS))
+
+
+async def replay_loop() -> None:
+    """Replay the queue every OPENSEARCH_REPLAY_SECONDS for the app's lifetime"""
+    while True:
+        await asyncio.sleep(settings.opensearch.replay_seconds)
+        try:
+            counts = await run_in_threadpool(replay)
+        except Exception:
+            logger.exception("OpenSearch replay failed")
+            continue
+        if counts["replayed"] or counts["pending"]:
+            logger.info(f"OpenSearch replay: {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenSearch updates queued during outages")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("replay", help="Index the current state of every queued doc")
+    commands.add_parser("depth", help="Count the queued docs")
+    args = parser.parse_args()
+    print(replay() if args.command == "replay" else {"queued": queue_depth()})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Co-attendance recommendations
+
+Two events are neighbours when the same users attended both, two users
+when they attended the same events; the neighbour's score is how often
+that happened. Every event and user keeps its neighbours in one item of
+the email table (`recs#event#{id}` / `recs#user#{id}`), a map of at most
+RECOMMEND_NEIGHBOURS ids to scores, so similar events or users are one
+GetItem and a user's event suggestions are one BatchGetItem over the
+lists of the events they attended.
+
+New attendance updates the lists incrementally (`record_attendance`): the
+edge is paired with the user's RECOMMEND_FANOUT latest earlier check-ins
+and the event's RECOMMEND_FANOUT latest earlier attendees, read latest
+first from UserAttendanceIndex and EventAttendeesIndex, which bounds the
+reads and writes per check-in however large an event gets. A bulk
+check-in reads each of its events and users once. A full list evicts
+its lowest neighbour and the newcomer inherits that score (space-saving),
+so frequent neighbours are never lost and memory per list stays fixed,
+at the cost of overestimating the tail. The rebuild command recomputes
+exact lists from a scan of the attendance rows, applying the same pairing
+rule, and replaces every list:
+
+    python -m app.services.recommendations rebuild
+    python -m app.services.recommendations backfill   # attendedAt on rows written before the indexes
+
+Lists keep counting attendance that has since expired (see retention);
+a rebuild only sees the rows still stored. Deleted users and events are
+dropped when recommendations are served.
+"""
+import argparse
+import heapq
+import logging
+import threading
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from app.config import settings
+from app.services.db.batch import BATCH_GET_LIMIT, BATCH_WRITE_LIMIT, WRITE_CONCURRENCY, batch_get_chunk, batch_write_chunk, chunks
+from app.services.db.scan import parallel_scan, query_pages
+from app.services.db.session import email_table, table, EMAIL_TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENTS = 8
+RECS_PREFIX = "recs#"
+KINDS = ("event", "user")
+
+# (user_id, event_id, createdAt) of one attendance row
+Edge = Tuple[str, str, str]
+
+
+def list_key(kind: str, entity_id: str) -> dict:
+    # A distinct SK per list keeps them out of each other's UserIndex partition
+    return {"PK": f"{RECS_PREFIX}{kind}#{entity_id}", "SK": f"neighbours#{kind}#{entity_id}"}
+
+
+def list_item(kind: str, entity_id: str, neighbours: Dict[str, int]) -> dict:
+    return {
+        **list_key(kind, entity_id),
+        "neighbours": neighbours,
+        "version": uuid.uuid4().hex,
+        "updatedAt": datetime.now().isoformat(),
+    }
+
+
+def top_neighbours(neighbours: Dict[str, int], limit: int) -> Dict[str, int]:
+    """The `limit` highest scores, best first, ties broken by id"""
+    return dict(heapq.nsmallest(limit, neighbours.items(), key=lambda entry: (-entry[1], entry[0])))
+
+
+def merge_scores(neighbours: Dict[str, int], adds: Dict[str, int], capacity: int) -> Dict[str, int]:
+    """Add scores to a list of at most `capacity` neighbours (space-saving)"""
+    merged = dict(neighbours)
+    for neighbour_id, score in adds.items():
+        if neighbour_id in merged or len(merged) < capacity:
+            merged[neighbour_id] = merged.get(neighbour_id, 0) + score
+        else:
+            victim = min(merged, key=lambda k: (merged[k], k))
+            merged[neighbour_id] = merged.pop(victim) + score
+    return merged
+
+
+def _scores(item: Optional[dict]) -> Dict[str, int]:
+    return {k: int(v) for k, v in (item or {}).get("neighbours", {}).items()}
+
+
+def read_neighbours(kind: str, entity_id: str) -> Dict[str, int]:
+    return _scores(email_table.get_item(Key=list_key(kind, entity_id)).get("Item"))
+
+
+def read_many(kind: str, entity_ids: Iterable[str], consistent: bool = False) -> Dict[str, dict]:
+    """Neighbour list items by entity id; ids without a list are absent"""
+    keys = [list_key(kind, entity_id) for entity_id in dict.fromkeys(entity_ids)]
+    projection = {"ConsistentRead": True} if consistent else {}
+    items = [item for chunk in chunks(keys, BATCH_GET_LIMIT)
+             for item in batch_get_chunk(EMAIL_TABLE_NAME, chunk, projection)]
+    return {item["PK"].split("#", 2)[2]: item for item in items}
+
+
+def _apply(kind: str, entity_id: str, adds: Dict[str, int], current: Optional[dict], attempts: int = 5) -> None:
+    """Merge scores into one list; a concurrent rewrite fails the version condition and is re-read"""
+    for _ in range(attempts):
+        if current is None:
+            current = email_table.get_item(Key=list_key(kind, entity_id), ConsistentRead=True).get("Item", {})
+        item = list_item(kind, entity_id, merge_scores(_scores(current), adds, settings.recommend.neighbours))
+        try:
+            if current:
+                email_table.put_item(Item=item, ConditionExpression="#v = :v", ExpressionAttributeNames={"#v": "version"},
+                                     ExpressionAttributeValues={":v": current["version"]})
+            else:
+                email_table.put_item(Item=item, ConditionExpression="attribute_not_exists(PK)")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            current = None
+            continue
+        return
+    raise RuntimeError(f"Neighbours of {kind} {entity_id} kept changing, gave up after {attempts} attempts")
+
+
+def _earlier(rows: List[Tuple[str, str]], edge_key: Tuple[str, str], fanout: int) -> List[str]:
+    """Ids of the `fanout` latest (createdAt, id) rows before `edge_key`"""
+    before = [row for row in rows if row < edge_key]
+    return [row_id for _, row_id in heapq.nlargest(fanout, before)]
+
+
+def _user_events(user_id: str) -> List[Tuple[str, str]]:
+    pages = query_pages(
+        KeyConditionExpression=Key("PK").eq(f"user#{user_id}") & Key("SK").begins_with("event#"),
+        FilterExpression=Attr("type").eq("attendance"),
+        ProjectionExpression="SK, createdAt",
+        ConsistentRead=True,
+    )
+    return [(item.get("createdAt", ""), item["SK"].split("#", 1)[1]) for page in pages for item in page]
+
+
+def _latest_rows(index: str, key: str, value: str, other: str,
+                 new_rows: List[Tuple[str, str]], fanout: int) -> List[Tuple[str, str]]:
+    """(attendedAt, id) rows of one event or user, enough to pair each of `new_rows`
+
+    Reads latest first up to the newest new row and stops once the oldest
+    one has `fanout` predecessors, so a check-in costs about one page
+    however many rows the event or user has. The request's own rows are
+    added as they may not be in the index yet.
+    """
+    newest, oldest = max(new_rows), min(new_rows)
+    rows = set(new_rows)
+    pages = query_pages(
+        IndexName=index,
+        KeyConditionExpression=Key(key).eq(value) & Key("attendedAt").lte(newest[0]),
+        ScanIndexForward=False,
+        Limit=fanout + len(new_rows),
+    )
+    for page in pages:
+        rows.update((item["attendedAt"], item[other].split("#", 1)[1]) for item in page)
+        if sum(row < oldest for row in rows) >= fanout:
+            break
+    return list(rows)
+
+
+def edge_pairs(edges: Iterable[Edge]) -> Dict[Tuple[str, str], Counter]:
+    """Score changes per (kind, id) list caused by new attendance rows
+
+    Each edge is paired only with rows older than itself, so the rows of
+    one bulk check-in are not counted twice against each other. Every
+    user and event of the request is read once.
+    """
+    fanout = settings.recommend.fanout
+    by_user, by_event = defaultdict(list), defaultdict(list)
+    for user_id, event_id, created_at in edges:
+        by_user[user_id].append((created_at, event_id))
+        by_event[event_id].append((created_at, user_id))
+
+    adds = defaultdict(Counter)
+    for user_id, new_rows in by_user.items():
+        rows = _latest_rows("UserAttendanceIndex", "PK", f"user#{user_id}", "SK", new_rows, fanout)
+        for created_at, event_id in new_rows:
+            for other in _earlier(rows, (created_at, event_id), fanout):
+                adds["event", event_id][other] += 1
+                adds["event", other][event_id] += 1
+    for event_id, new_rows in by_event.items():
+        rows = _latest_rows("EventAttendeesIndex", "SK", f"event#{event_id}", "PK", new_rows, fanout)
+        for created_at, user_id in new_rows:
+            for other in _earlier(rows, (created_at, user_id), fanout):
+                adds["user", user_id][other] += 1
+                adds["user", other][user_id] += 1
+    return adds
+
+
+def record_attendance(edges: Iterable[Edge]) -> int:
+    """Update the neighbour lists with new attendance rows, returning the lists written"""
+    adds = edge_pairs(edges)
+    current = {kind: read_many(kind, [i for k, i in adds if k == kind], consistent=True) for kind in KINDS}
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as pool:
+        futures = [pool.submit(_apply, kind, entity_id, dict(scores), current[kind].get(entity_id, {}))
+                   for (kind, entity_id), scores in adds.items()]
+        for future in futures:
+            future.result()
+    return len(adds)
+
+
+def sync_recommendations(edges: Iterable[Edge]) -> None:
+    """record_attendance for write paths: a failure is logged, the check-in stands
+
+    Lists that missed a check-in are repaired by the next rebuild.
+    """
+    edges = list(edges)
+    try:
+        record_attendance(edges)
+    except Exception as e:
+        logger.warning(f"Recommendation update failed for {len(edges)} attendance rows: {e}")
+
+
+def similar(kind: str, entity_id: str, k: int) -> List[Tuple[str, int]]:
+    """The `k` best neighbours of an event or user, best first"""
+    return list(top_neighbours(read_neighbours(kind, entity_id), k).items())
+
+
+def suggest_events(user_id: str, limit: int) -> List[Tuple[str, int]]:
+    """Events co-attended with the user's events, scored by the sum of their neighbour scores
+
+    Events the user attended are left out; `limit` bounds the candidates
+    returned, callers filter them further (past or deleted events).
+    """
+    attended = {event_id for _, event_id in _user_events(user_id)}
+    scores = Counter()
+    for item in read_many("event", attended).values():
+        scores.update(_scores(item))
+    for event_id in attended:
+        scores.pop(event_id, None)
+    return list(top_neighbours(scores, limit).items())
+
+
+def rebuild_recommendations(segments: int = DEFAULT_SEGMENTS) -> dict:
+    """Recompute every neighbour list from the attendance rows and replace the stored ones
+
+    Edges and exact scores are held in memory for the duration. Check-ins
+    recorded while the rebuild runs may be overwritten by it.
+    """
+    by_user, by_event = defaultdict(list), defaultdict(list)
+    lock = threading.Lock()
+
+    def handle_page(items: list):
+        with lock:
+            for item in items:
+                user_id, event_id = item["PK"].split("#", 1)[1], item["SK"].split("#", 1)[1]
+                created_at = item.get("createdAt", "")
+                by_user[user_id].append((created_at, event_id))
+                by_event[event_id].append((created_at, user_id))
+
+    parallel_scan(
+        segments,
+        handle_page,
+        FilterExpression=Attr("type").eq("attendance"),
+        ProjectionExpression="PK, SK, createdAt",
+    )
+
+    fanout, limit = settings.recommend.fanout, settings.recommend.neighbours
+    scores = {kind: defaultdict(Counter) for kind in KINDS}
+    for kind, rows_by_entity in (("event", by_user), ("user", by_event)):
+        for rows in rows_by_entity.values():
+            # The same rule as record_attendance: each row pairs with its `fanout` predecessors
+            ordered = [row_id for _, row_id in sorted(rows)]
+            for index, row_id in enumerate(ordered):
+                for other in ordered[max(0, index - fanout):index]:
+                    scores[kind][row_id][other] += 1
+                    scores[kind][other][row_id] += 1
+
+    written = {list_key(kind, entity_id)["PK"] for kind in KINDS for entity_id in scores[kind]}
+    stale = []
+    parallel_scan(
+        segments,
+        lambda items: stale.extend({"PK": i["PK"], "SK": i["SK"]} for i in items if i["PK"] not in written),
+        target=email_table,
+        FilterExpression=Attr("PK").begins_with(RECS_PREFIX),
+        ProjectionExpression="PK, SK",
+    )
+    requests = [{"PutRequest": {"Item": list_item(kind, entity_id, top_neighbours(counts, limit))}}
+                for kind in KINDS for entity_id, counts in scores[kind].items()]
+    requests += [{"DeleteRequest": {"Key": key}} for key in stale]
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as pool:
+        list(pool.map(lambda chunk: batch_write_chunk(EMAIL_TABLE_NAME, chunk), chunks(requests, BATCH_WRITE_LIMIT)))
+    return {"attendance": sum(len(rows) for rows in by_user.values()),
+            "events": len(scores["event"]), "users": len(scores["user"]), "deleted": len(stale)}
+
+
+def backfill_attended_at(segments: int = DEFAULT_SEGMENTS) -> dict:
+    """Set `attendedAt` on attendance rows written before the attendance indexes existed"""
+    counts = {"updated": 0}
+    lock = threading.Lock()
+
+    def handle_page(items: list):
+        for item in items:
+            table.update_item(
+                Key={"PK": item["PK"], "SK": item["SK"]},
+                UpdateExpression="SET attendedAt = :a",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={":a": item["createdAt"]},
+            )
+        with lock:
+            counts["updated"] += len(items)
+
+    parallel_scan(
+        segments,
+        handle_page,
+        FilterExpression=Attr("type").eq("attendance") & Attr("attendedAt").not_exists() & Attr("createdAt").exists(),
+        ProjectionExpression="PK, SK, createdAt",
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Co-attendance recommendation lists")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild", help="Recompute every neighbour list from the attendance rows")
+    rebuild.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan workers")
+    backfill = commands.add_parser("backfill", help="Set attendedAt on attendance rows written without it")
+    backfill.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS, help="parallel scan workers")
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        print(rebuild_recommendations(args.segments))
+    else:
+        print(backfill_attended_at(args.segments))
+
+
+if __name__ == "__main__":
+    main()
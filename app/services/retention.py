@@ -0,0 +1,273 @@
+"""Retention of email delivery logs and attendance history
+
+Items of a type with a retention policy (RETENTION_<TYPE>_DAYS) get an
+`expiresAt` epoch when written. `expiresAt` is both tables' TTL
+attribute, so DynamoDB deletes them without consuming write capacity once
+the policy's days have passed. Before that happens the archive command
+copies them to gzipped NDJSON or Parquet files, locally or on S3:
+
+    python -m app.services.retention archive
+    python -m app.services.retention archive --format parquet --target s3://bucket/crm
+    python -m app.services.retention backfill      # stamp expiresAt on items written before
+
+Each archive run copies the records expiring within
+RETENTION_ARCHIVE_LEAD_DAYS that have no `archivedAt` yet, then sets
+`archivedAt` on them. Records stamped later by `backfill`, or written
+with a shorter policy, are picked up by the next run whatever their
+expiry; a run that fails before marking archives its records again.
+Attendance expiring does not lower attendedCount, which keeps counting
+lifetime check-ins.
+"""
+import argparse
+import base64
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+import orjson
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from app.config import settings
+from app.services.db.scan import parallel_scan
+from app.services.db.session import dynamodb, table, MAIN_TABLE_NAME, EMAIL_TABLE_NAME
+
+DEFAULT_SEGMENTS = 8
+DAY = 86400
+
+# Item types with a retention policy, by table
+RETAINED_TYPES = {
+    EMAIL_TABLE_NAME: ["email_log", "email_log_chunk"],
+    MAIN_TABLE_NAME: ["attendance"],
+}
+
+
+def retention_days(item_type: str) -> int:
+    policies = {
+        "email_log": settings.retention.email_log_days,
+        "email_log_chunk": settings.retention.email_log_days,
+        "attendance": settings.retention.attendance_days,
+    }
+    return policies.get(item_type, 0)
+
+
+def expiry_for(item: dict) -> Optional[int]:
+    days = retention_days(item.get("type", ""))
+    if not days or "createdAt" not in item:
+        return None
+    created = datetime.fromisoformat(item["createdAt"])
+    return int(created.timestamp()) + days * DAY
+
+
+def with_expiry(item: dict) -> dict:
+    """The item with its type's `expiresAt`, unchanged when the type is kept forever"""
+    expires_at = expiry_for(item)
+    return {**item, "expiresAt": expires_at} if expires_at else item
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (bytes, bytearray)) or hasattr(value, "value"):
+        return base64.b64encode(bytes(getattr(value, "value", value))).decode()
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+class ArchiveWriter:
+    """One part file per scan worker under `directory`, gzipped NDJSON or Parquet"""
+
+    def __init__(self, directory: str, fmt: str):
+        if fmt not in ("ndjson", "parquet"):
+            raise ValueError(f"Unknown archive format {fmt!r}, expected ndjson or parquet")
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise RuntimeError("Parquet archives need pyarrow: pip install pyarrow") from None
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fmt = fmt
+        self._lock = threading.Lock()
+        self._parts = {}
+        self.records = 0
+
+    def _part(self):
+        worker = threading.get_ident()
+        with self._lock:
+            if worker not in self._parts:
+                path = os.path.join(self.directory, f"part-{len(self._parts):03d}")
+                if self.fmt == "ndjson":
+                    self._parts[worker] = (path + ".ndjson.gz", gzip.open(path + ".ndjson.gz", "wb"))
+                else:
+                    self._parts[worker] = (path + ".parquet", [])
+            return self._parts[worker]
+
+    def write_page(self, items: list) -> None:
+        _, sink = self._part()
+        rows = [orjson.loads(orjson.dumps(item, default=_json_default)) for item in items]
+        if self.fmt == "ndjson":
+            sink.write(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+        else:
+            sink.extend(rows)
+        with self._lock:
+            self.records += len(items)
+
+    def close(self) -> list:
+        """Finish every part file, returning their paths"""
+        paths = []
+        for path, sink in self._parts.values():
+            if self.fmt == "ndjson":
+                sink.close()
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                pq.write_table(pa.Table.from_pylist(sink), path, compression="zstd")
+            paths.append(path)
+        return paths
+
+
+def _upload(paths: list, local_root: str, target: str) -> list:
+    """Copy archive files under s3://bucket/prefix, keeping their relative paths"""
+    import boto3
+    bucket, _, prefix = target[len("s3://"):].partition("/")
+    s3 = boto3.client("s3", region_name=settings.database.aws_region)
+    uploaded = []
+    for path in paths:
+        key = "/".join(filter(None, [prefix.strip("/"), os.path.relpath(path, local_root).replace(os.sep, "/")]))
+        s3.upload_file(path, bucket, key)
+        uploaded.append(f"s3://{bucket}/{key}")
+    return uploaded
+
+
+def _mark_archived(target, keys: list, segments: int) -> None:
+    archived_at = int(time.time())
+
+    def mark(key: dict):
+        try:
+            target.update_item(
+                Key=key,
+                UpdateExpression="SET archivedAt = :a",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={":a": archived_at},
+            )
+        except ClientError as e:
+            # Expired and deleted by TTL meanwhile
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        list(pool.map(mark, keys))
+
+
+def archive_expiring(target: Optional[str] = None, fmt: Optional[str] = None,
+                     lead_days: Optional[int] = None, segments: int = DEFAULT_SEGMENTS) -> dict:
+    """Archive every retained record expiring before `lead_days` from now and not archived yet"""
+    target = target or settings.retention.archive_target
+    fmt = fmt or settings.retention.archive_format
+    lead_days = settings.retention.archive_lead_days if lead_days is None else lead_days
+    until = int(time.time()) + lead_days * DAY
+    to_s3 = target.startswith("s3://")
+    local_root = tempfile.mkdtemp(prefix="crm-archive-") if to_s3 else target
+    run = datetime.fromtimestamp(until, timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+    summary = {}
+    try:
+        for table_name, item_types in RETAINED_TYPES.items():
+            source = dynamodb.Table(table_name)
+            for item_type in item_types:
+                days = retention_days(item_type)
+                if not days:
+                    continue
+                if lead_days >= days:
+                    # Everything would be archived as soon as it is written
+                    raise ValueError(f"Archive lead of {lead_days} days is not less than "
+                                     f"the {days} days {item_type} records are kept")
+                writer = ArchiveWriter(os.path.join(local_root, item_type, f"until-{run}"), fmt)
+                keys = []
+                lock = threading.Lock()
+
+                def handle_page(items: list):
+                    writer.write_page(items)
+                    with lock:
+                        keys.extend({"PK": item["PK"], "SK": item["SK"]} for item in items)
+
+                parallel_scan(
+                    segments,
+                    handle_page,
+                    target=source,
+                    FilterExpression=Attr("type").eq(item_type) & Attr("expiresAt").lt(until)
+                    & Attr("archivedAt").not_exists(),
+                )
+                paths = writer.close()
+                if to_s3:
+                    paths = _upload(paths, local_root, target)
+                # Only once the files are safely written
+                _mark_archived(source, keys, segments)
+                summary[item_type] = {"records": writer.records, "files": paths}
+    finally:
+        if to_s3:
+            shutil.rmtree(local_root, ignore_errors=True)
+    return summary
+
+
+def backfill_expiry(segments: int = DEFAULT_SEGMENTS) -> dict:
+    """Stamp `expiresAt` on retained items written before their policy existed"""
+    counts = Counter()
+    lock = threading.Lock()
+
+    for table_name, item_types in RETAINED_TYPES.items():
+        target = dynamodb.Table(table_name)
+        for item_type in item_types:
+            if not retention_days(item_type):
+                continue
+
+            def handle_page(items: list):
+                for item in items:
+                    target.update_item(
+                        Key={"PK": item["PK"], "SK": item["SK"]},
+                        UpdateExpression="SET expiresAt = :e",
+                        ConditionExpression="attribute_exists(PK)",
+                        ExpressionAttributeValues={":e": expiry_for(item)},
+                    )
+                with lock:
+                    counts[item_type] += len(items)
+
+            parallel_scan(
+                segments,
+                handle_page,
+                target=target,
+                FilterExpression=Attr("type").eq(item_type) & Attr("expiresAt").not_exists() & Attr("createdAt").exists(),
+                ProjectionExpression="PK, SK, #t, createdAt",
+                ExpressionAttributeNames={"#t": "type"},
+            )
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and expire email logs and attendance history")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive = commands.add_parser("archive", help="Copy records expiring soon to archive files")
+    archive.add_argument("--target", help="Local directory or s3://bucket/prefix (RETENTION_ARCHIVE_TARGET)")
+    archive.add_argument("--format", choices=["ndjson", "parquet"], help="RETENTION_ARCHIVE_FORMAT")
+    archive.add_argument("--lead-days", type=int, help="RETENTION_ARCHIVE_LEAD_DAYS")
+    archive.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS)
+    backfill = commands.add_parser("backfill", help="Set expiresAt on records written without it")
+    backfill.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS)
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        print(archive_expiring(args.target, args.format, args.lead_days, args.segments))
+    else:
+        print(backfill_expiry(args.segments))
+
+
+if __name__ == "__main__":
+    main()
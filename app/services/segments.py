@@ -0,0 +1,375 @@
+"""Saved user segments with materialised membership
+
+A segment is a saved UserFilter stored next to the campaigns in the email
+table (`segment#{id}`). Its members live in the same partition as
+`members#{id}#{bucket}` items, each holding the sorted "user_id<TAB>email"
+lines of its bucket zlib-compressed; a user's bucket is crc32(id) % buckets,
+fixed when the segment is created.
+
+Building a segment pages through the filter's OpenSearch matches once.
+After that, user writes and counter changes call `refresh_members`, which
+re-evaluates only the changed users against every segment with
+`filter_matches` and rewrites only the buckets whose membership moved, in
+the same transaction as the segment's memberCount. A campaign to a
+segment reads its buckets (one query) instead of searching, and a
+segment's size is one GetItem.
+
+Users changed while a segment builds are parked in its `pending` set and
+re-evaluated once the build has written its buckets, so a build never
+loses a change made during it. A refresh that saw the segment before the
+build started writes its buckets directly; the build writes each bucket
+only if its version is still the one read when the build started, and
+re-evaluates the users of a bucket that changed meanwhile.
+"""
+import logging
+import uuid
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+from app.config import settings
+from app.models import Segment, SegmentStatusEnum, UserFilter
+from app.services.db.batch import BATCH_GET_LIMIT, batch_get_chunk, batch_delete_keys, chunks
+from app.services.db.expressions import build_projection
+from app.services.db.scan import query_pages
+from app.services.db.session import email_table, EMAIL_TABLE_NAME, MAIN_TABLE_NAME
+from app.services.db.transactions import put_op, update_op, transact_write, failed_conditions
+from app.services.export import search_user_records
+from app.services.jobs import Progress
+from app.services.opensearch.queries import user_query, filter_matches
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_PREFIX = "members#"
+# Items stop at 400 KB; a bucket this large needs a rebuild with more buckets
+MAX_BUCKET_BYTES = 350_000
+# What a membership decision and a campaign read of a user
+USER_FIELDS = ["email", "company", "jobTitle", "city", "state", "attendedCount", "hostedCount"]
+
+
+def segment_key(segment_id: str) -> dict:
+    pk = f"segment#{segment_id}"
+    return {"PK": pk, "SK": pk}
+
+
+def bucket_key(segment_id: str, bucket: int) -> dict:
+    # The segment id keeps buckets of different segments apart in UserIndex
+    return {"PK": f"segment#{segment_id}", "SK": f"{MEMBERS_PREFIX}{segment_id}#{bucket:04d}"}
+
+
+def bucket_of(user_id: str, buckets: int) -> int:
+    return zlib.crc32(user_id.encode()) % buckets
+
+
+def encode_members(members: Dict[str, str]) -> bytes:
+    lines = "\n".join(f"{user_id}\t{members[user_id]}" for user_id in sorted(members))
+    return zlib.compress(lines.encode(), 6)
+
+
+def decode_members(data) -> Dict[str, str]:
+    # boto3 hands binary attributes back wrapped in Binary
+    raw = zlib.decompress(getattr(data, "value", data)).decode()
+    return dict(line.split("\t", 1) for line in raw.splitlines())
+
+
+def members_item(segment_id: str, bucket: int, members: Dict[str, str]) -> dict:
+    data = encode_members(members)
+    if len(data) > MAX_BUCKET_BYTES:
+        raise ValueError(f"Bucket {bucket} of segment {segment_id} is full, recreate it with more buckets")
+    # No `type`: bucket rewrites stay out of TypeIndex
+    return {
+        **bucket_key(segment_id, bucket),
+        "members": len(members),
+        "data": data,
+        # Every write gets a new version, the condition of the next one
+        "version": uuid.uuid4().hex,
+    }
+
+
+def segment_record(item: dict) -> dict:
+    return Segment(
+        segment_id=item["PK"].split("#", 1)[1],
+        name=item["name"],
+        filter=item["filter"],
+        status=item["status"],
+        memberCount=int(item.get("memberCount", 0)),
+        buckets=int(item["buckets"]),
+        createdAt=item["createdAt"],
+        builtAt=item.get("builtAt"),
+    ).model_dump(mode="json", exclude_none=True)
+
+
+def create_segment(name: str, filter: UserFilter) -> Segment:
+    segment = Segment(name=name, filter=filter, buckets=settings.email.segment_buckets)
+    email_table.put_item(Item=segment.to_dynamodb_item())
+    return segment
+
+
+def read_segment(segment_id: str) -> Optional[dict]:
+    return email_table.get_item(Key=segment_key(segment_id), ConsistentRead=True).get("Item")
+
+
+def list_segments() -> List[dict]:
+    pages = query_pages(email_table, IndexName="TypeIndex", KeyConditionExpression=Key("type").eq("segment"))
+    return [item for page in pages for item in page]
+
+
+def member_buckets(segment_id: str) -> Iterator[Dict[str, str]]:
+    """Members' emails by user id, one bucket at a time"""
+    pages = query_pages(
+        email_table,
+        KeyConditionExpression=Key("PK").eq(f"segment#{segment_id}")
+        & Key("SK").begins_with(f"{MEMBERS_PREFIX}{segment_id}#"),
+    )
+    for page in pages:
+        for item in page:
+            yield decode_members(item["data"])
+
+
+def read_members(segment_id: str) -> Dict[str, str]:
+    """Every member's email by user id, from the segment's buckets"""
+    members = {}
+    for bucket in member_buckets(segment_id):
+        members.update(bucket)
+    return members
+
+
+def _load_users(user_ids: list) -> Dict[str, dict]:
+    # Consistent reads: the change being applied was usually written just before
+    projection = {**build_projection(USER_FIELDS), "ConsistentRead": True}
+    keys = [{"PK": f"user#{i}", "SK": f"user#{i}"} for i in user_ids]
+    items = [item for chunk in chunks(keys, BATCH_GET_LIMIT)
+             for item in batch_get_chunk(MAIN_TABLE_NAME, chunk, projection)]
+    return {item["PK"].split("#", 1)[1]: item for item in items}
+
+
+def _read_buckets(segment_id: str, buckets: Iterable[int]) -> Dict[int, dict]:
+    keys = [bucket_key(segment_id, bucket) for bucket in buckets]
+    items = [item for chunk in chunks(keys, BATCH_GET_LIMIT)
+             for item in batch_get_chunk(EMAIL_TABLE_NAME, chunk, {"ConsistentRead": True})]
+    return {int(item["SK"].rsplit("#", 1)[1]): item for item in items}
+
+
+def _apply_bucket(segment_id: str, bucket: int, adds: Dict[str, str], removes: set,
+                  current: Optional[dict] = None, attempts: int = 5) -> int:
+    """Add and remove members of one bucket, returning the change in member count
+
+    `current` is the bucket item as last read ({} when it does not exist
+    yet). A concurrent rewrite of the bucket fails the version condition;
+    the bucket is then re-read and the change applied again.
+    """
+    key = bucket_key(segment_id, bucket)
+    for _ in range(attempts):
+        if current is None:
+            current = email_table.get_item(Key=key, ConsistentRead=True).get("Item", {})
+        members = decode_members(current["data"]) if "data" in current else {}
+        updated = {user_id: email for user_id, email in members.items() if user_id not in removes}
+        updated.update(adds)
+        if updated == members:
+            return 0
+
+        item = members_item(segment_id, bucket, updated)
+        if current:
+            bucket_op = put_op(item, "#v = :v", names={"#v": "version"}, values={":v": current["version"]},
+                               table_name=EMAIL_TABLE_NAME)
+        else:
+            bucket_op = put_op(item, "attribute_not_exists(PK)", table_name=EMAIL_TABLE_NAME)
+        delta = len(updated) - len(members)
+        count_op = update_op(segment_key(segment_id), "ADD memberCount :d", "attribute_exists(PK)",
+                             values={":d": delta}, table_name=EMAIL_TABLE_NAME)
+        try:
+            transact_write([bucket_op, count_op])
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            if 1 in failed_conditions(e):
+                return 0  # segment deleted meanwhile
+            current = None
+            continue
+        return delta
+    raise RuntimeError(f"Bucket {bucket} of segment {segment_id} kept changing, gave up after {attempts} attempts")
+
+
+def _park(segment_id: str, user_ids: list) -> bool:
+    """Queue users for re-evaluation after the running build, False once it has finished"""
+    try:
+        email_table.update_item(
+            Key=segment_key(segment_id),
+            UpdateExpression="ADD pending :ids",
+            ConditionExpression="#s = :building",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":ids": set(user_ids), ":building": SegmentStatusEnum.building.value},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def refresh_members(user_ids: Iterable[str], segment_ids: Optional[list] = None) -> int:
+    """Re-evaluate changed users against saved segments and patch their membership
+
+    Called after user writes and counter changes; deleted users leave
+    every segment. Returns the net change in members over all segments.
+    """
+    user_ids = list(dict.fromkeys(filter(None, user_ids)))
+    if not user_ids:
+        return 0
+    if segment_ids is None:
+        segments = list_segments()
+    else:
+        segments = [segment for segment in map(read_segment, segment_ids) if segment]
+    if not segments:
+        return 0
+
+    users = _load_users(user_ids)
+    changed = 0
+    for segment in segments:
+        segment_id = segment["PK"].split("#", 1)[1]
+        if segment["status"] == SegmentStatusEnum.building.value and _park(segment_id, user_ids):
+            continue
+        segment_filter = UserFilter(**segment["filter"])
+        buckets = int(segment["buckets"])
+        changes = {}
+        for user_id in user_ids:
+            adds, removes = changes.setdefault(bucket_of(user_id, buckets), ({}, set()))
+            user = users.get(user_id)
+            if user is not None and user.get("email") and filter_matches(segment_filter, user):
+                adds[user_id] = user["email"]
+            else:
+                removes.add(user_id)
+        current = _read_buckets(segment_id, changes)
+        for bucket, (adds, removes) in changes.items():
+            changed += _apply_bucket(segment_id, bucket, adds, removes, current.get(bucket, {}))
+    return changed
+
+
+def sync_members(user_ids: Iterable[str]) -> None:
+    """refresh_members for write paths: a failure is logged, the write it follows stands
+
+    A segment that missed a change is repaired by rebuilding it.
+    """
+    user_ids = list(user_ids)
+    try:
+        refresh_members(user_ids)
+    except Exception as e:
+        logger.warning(f"Segment membership update failed for {len(user_ids)} users: {e}")
+
+
+def start_build(segment_id: str) -> bool:
+    """Mark a segment as building, False when it does not exist"""
+    try:
+        email_table.update_item(
+            Key=segment_key(segment_id),
+            UpdateExpression="SET #s = :building",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":building": SegmentStatusEnum.building.value},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def _finish_build(segment_id: str, member_count: int) -> set:
+    """Mark the segment ready, returning the users parked while it was building"""
+    res = email_table.update_item(
+        Key=segment_key(segment_id),
+        UpdateExpression="SET #s = :ready, memberCount = :n, builtAt = :now REMOVE pending",
+        ConditionExpression="attribute_exists(PK)",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":ready": SegmentStatusEnum.ready.value, ":n": member_count,
+                                   ":now": datetime.now().isoformat()},
+        ReturnValues="ALL_OLD",
+    )
+    return set(res.get("Attributes", {}).get("pending", set()))
+
+
+def _changed_users(before: dict, after: dict) -> set:
+    old = decode_members(before["data"]) if "data" in before else {}
+    new = decode_members(after["data"]) if "data" in after else {}
+    return {user_id for user_id in old.keys() | new.keys() if old.get(user_id) != new.get(user_id)}
+
+
+def _write_built_bucket(segment_id: str, bucket: int, members: Dict[str, str], before: dict,
+                        attempts: int = 5) -> set:
+    """Write a built bucket over the version read when the build started
+
+    A bucket rewritten by refresh_members since then still gets the built
+    members; the users that write changed are returned for re-evaluation.
+    """
+    item = members_item(segment_id, bucket, members)
+    expected, changed = before, set()
+    for _ in range(attempts):
+        if expected:
+            condition = {"ConditionExpression": "#v = :v", "ExpressionAttributeNames": {"#v": "version"},
+                         "ExpressionAttributeValues": {":v": expected["version"]}}
+        else:
+            condition = {"ConditionExpression": "attribute_not_exists(PK)"}
+        try:
+            email_table.put_item(Item=item, **condition)
+            return changed
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        expected = email_table.get_item(Key=bucket_key(segment_id, bucket), ConsistentRead=True).get("Item", {})
+        changed |= _changed_users(before, expected)
+    raise RuntimeError(f"Bucket {bucket} of segment {segment_id} kept changing, gave up after {attempts} attempts")
+
+
+def _write_built_buckets(segment_id: str, members: List[Dict[str, str]], before: Dict[int, dict]) -> set:
+    changed = set()
+    for bucket, bucket_members in enumerate(members):
+        changed |= _write_built_bucket(segment_id, bucket, bucket_members, before.get(bucket, {}))
+    return changed
+
+
+async def build_segment(segment_id: str, progress: Progress) -> None:
+    """Materialise a segment's membership from its filter's OpenSearch matches"""
+    segment = await run_in_threadpool(read_segment, segment_id)
+    if segment is None:
+        raise ValueError(f"Segment {segment_id} not found")
+    buckets = int(segment["buckets"])
+    before = await run_in_threadpool(_read_buckets, segment_id, range(buckets))
+    members = [{} for _ in range(buckets)]
+    processed = 0
+    async for page in search_user_records(user_query(UserFilter(**segment["filter"])), ["email"]):
+        for doc in page:
+            if doc.get("email"):
+                members[bucket_of(doc["id"], buckets)][doc["id"]] = doc["email"]
+        processed += len(page)
+        await progress(processed=processed)
+
+    # Every bucket is rewritten, a rebuild also empties buckets that lost all members
+    changed = await run_in_threadpool(_write_built_buckets, segment_id, members, before)
+    pending = await run_in_threadpool(_finish_build, segment_id, sum(map(len, members))) | changed
+    if pending:
+        await run_in_threadpool(refresh_members, sorted(pending), [segment_id])
+
+
+async def delete_segment(segment_id: str) -> bool:
+    """Delete a segment and its buckets, False when it does not exist"""
+    try:
+        await run_in_threadpool(email_table.delete_item, Key=segment_key(segment_id),
+                                ConditionExpression="attribute_exists(PK)")
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    keys = await run_in_threadpool(_bucket_keys, segment_id)
+    await batch_delete_keys(keys, EMAIL_TABLE_NAME)
+    return True
+
+
+def _bucket_keys(segment_id: str) -> list:
+    pages = query_pages(
+        email_table,
+        KeyConditionExpression=Key("PK").eq(f"segment#{segment_id}"),
+        ProjectionExpression="PK, SK",
+    )
+    return [{"PK": item["PK"], "SK": item["SK"]} for page in pages for item in page]
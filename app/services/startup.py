@@ -0,0 +1,122 @@
+"""Startup warm-up and readiness
+
+Clients are built once in the lifespan and their connection pools, the
+Cognito signing keys and the `users` index are warmed concurrently before
+the worker reports ready, so the first requests do not pay for TLS
+handshakes, credential resolution or a JWKS download. Each phase is timed
+and exposed on /health/ready. The worker stays not ready while any phase
+has failed; the failed phases are retried in the background every
+APP_WARMUP_RETRY_SECONDS (doubling up to a minute) until they all pass.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+from fastapi.concurrency import run_in_threadpool
+from app.config import settings
+from app.services.db.init import create_tables
+from app.services.db.session import init_clients, table, email_table
+from app.services.opensearch.client import get_opensearch_client
+from app.services.opensearch.indices import USERS_INDEX, USERS_MAPPING, EVENTS_INDEX, EVENTS_MAPPING, ensure_index
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_SECONDS = 60
+
+
+class StartupState:
+    def __init__(self):
+        self.ready = False
+        self.phases: dict = {}
+        self.errors: dict = {}
+        self.retrier: Optional[asyncio.Task] = None
+
+    async def run(self, name: str, fn: Callable[[], None]) -> None:
+        """Run a blocking phase in the threadpool and record how long it took"""
+        started = time.perf_counter()
+        try:
+            await run_in_threadpool(fn)
+            self.errors.pop(name, None)
+        except Exception as e:
+            self.errors[name] = str(e)
+            logger.warning(f"Startup phase {name} failed: {e}")
+        finally:
+            self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def report(self) -> dict:
+        return {"ready": self.ready, "phases_ms": self.phases, "errors": self.errors}
+
+
+state = StartupState()
+
+
+def warm_dynamodb():
+    # describe_table opens a pooled connection and resolves credentials
+    table.table_status
+    email_table.table_status
+
+
+def warm_opensearch():
+    client = get_opensearch_client()
+    client.info()
+    ensure_index(client, USERS_INDEX, USERS_MAPPING)
+    ensure_index(client, EVENTS_INDEX, EVENTS_MAPPING)
+    client.indices.get_mapping(index=f"{USERS_INDEX},{EVENTS_INDEX}")
+
+
+def warm_jwks():
+    from app.middleware.auth import get_jwks
+    get_jwks()
+
+
+def init_all_clients():
+    init_clients()
+    get_opensearch_client()
+
+
+def _phases() -> Dict[str, Callable[[], None]]:
+    """The warm-up phases in order; the ones after `create_tables` run concurrently"""
+    phases = {"clients": init_all_clients}
+    if not settings.app.production:
+        phases["create_tables"] = create_tables
+    phases["dynamodb"] = warm_dynamodb
+    phases["opensearch"] = warm_opensearch
+    if settings.auth.enabled:
+        phases["jwks"] = warm_jwks
+    return phases
+
+
+async def _retry_failed(phases: Dict[str, Callable[[], None]]) -> None:
+    """Re-run the failed phases until none fails, then mark the worker ready"""
+    delay = settings.app.warmup_retry_seconds
+    while state.errors:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MAX_RETRY_SECONDS)
+        for name in [name for name in phases if name in state.errors]:
+            await state.run(name, phases[name])
+    state.ready = True
+    logger.info(f"Startup warm-up finished after retries: {state.phases}")
+
+
+async def warm_up() -> dict:
+    """Build clients, then warm every backend concurrently and mark the worker ready
+
+    A failed phase is logged and reported and keeps the worker not ready;
+    the failed phases are retried in the background (`state.retrier`).
+    """
+    started = time.perf_counter()
+    phases = _phases()
+    await state.run("clients", phases["clients"])
+    if "create_tables" in phases:
+        await state.run("create_tables", phases["create_tables"])
+    await asyncio.gather(*(state.run(name, fn) for name, fn in phases.items()
+                           if name not in ("clients", "create_tables")))
+
+    state.phases["total"] = round((time.perf_counter() - started) * 1000, 1)
+    if state.errors:
+        logger.warning(f"Startup warm-up failed for {sorted(state.errors)}, retrying in the background")
+        state.retrier = asyncio.create_task(_retry_failed(phases))
+    else:
+        state.ready = True
+        logger.info(f"Startup warm-up finished: {state.phases}")
+    return state.report()
@@ -69,6 +69,7 @@ module "ecs" {
   dynamodb_email_table_name = var.dynamodb_email_table_name
   opensearch_endpoint      = module.opensearch.endpoint
   opensearch_vpc_enabled   = var.opensearch_vpc_enabled
+  trusted_proxy_cidrs      = var.public_subnet_cidrs
   auth_enabled             = var.auth_enabled
   opensearch_secret_arn    = module.secrets_manager.opensearch_secret_arn
   auth_secret_arn          = module.secrets_manager.auth_secret_arn
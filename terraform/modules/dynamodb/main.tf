@@ -48,6 +48,11 @@ resource "aws_dynamodb_table" "crm_data" {
     type = "S"
   }
 
+  attribute {
+    name = "attendedAt"
+    type = "S"
+  }
+
   global_secondary_index {
     name            = "SKIndex"
     hash_key        = "SK"
@@ -94,6 +99,26 @@ resource "aws_dynamodb_table" "crm_data" {
     projection_type = "ALL"
   }
 
+  # Sparse indexes over attendance rows, latest first for recommendations
+  global_secondary_index {
+    name            = "EventAttendeesIndex"
+    hash_key        = "SK"
+    range_key       = "attendedAt"
+    projection_type = "KEYS_ONLY"
+  }
+
+  global_secondary_index {
+    name            = "UserAttendanceIndex"
+    hash_key        = "PK"
+    range_key       = "attendedAt"
+    projection_type = "KEYS_ONLY"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
   tags = {
     Name        = "CRM Data Table"
     Environment = var.environment
@@ -121,6 +146,11 @@ resource "aws_dynamodb_table" "email_data" {
     type = "S"
   }
 
+  attribute {
+    name = "campaignStatus"
+    type = "S"
+  }
+
   global_secondary_index {
     name            = "EmailIndex"
     hash_key        = "PK"
@@ -140,6 +170,19 @@ resource "aws_dynamodb_table" "email_data" {
     projection_type = "ALL"
   }
 
+  # Recipients of one campaign with one status, keyed "<email_id>#<status>"
+  global_secondary_index {
+    name            = "StatusIndex"
+    hash_key        = "campaignStatus"
+    range_key       = "SK"
+    projection_type = "ALL"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
   tags = {
     Name        = "Email Data Table"
     Environment = var.environment
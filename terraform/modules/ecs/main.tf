@@ -115,6 +115,7 @@ resource "aws_ecs_task_definition" "emcrm_task" {
         { name = "APP_API_PORT", value = "8080" },
         { name = "APP_API_HOST", value = "0.0.0.0" },
         { name = "APP_PRODUCTION", value = "true" },  # ADD THIS LINE
+        { name = "APP_FORWARDED_ALLOW_IPS", value = join(",", var.trusted_proxy_cidrs) },
         
         # Authentication Configuration (non-sensitive)
         { name = "AUTH_ENABLED", value = var.auth_enabled ? "true" : "false" },
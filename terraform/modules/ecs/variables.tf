@@ -88,4 +88,9 @@ variable "target_group_arn" {
 variable "lb_listener_arn" {
   description = "ARN of the load balancer listener"
   type        = string
-}
\ No newline at end of file
+}
+
+variable "trusted_proxy_cidrs" {
+  description = "CIDR blocks of the load balancer, whose X-Forwarded-* headers the app trusts"
+  type        = list(string)
+}
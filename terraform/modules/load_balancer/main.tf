@@ -57,7 +57,7 @@ resource "aws_lb_target_group" "emcrm_tg" {
   target_type = "ip"
 
   health_check {
-    path                = "/health"
+    path                = "/health/ready"
     interval            = 30
     timeout             = 5
     healthy_threshold   = 3
@@ -0,0 +1,82 @@
+"""Compare per-item Python aggregation with the columnar analytics snapshot.
+
+Run from the repository root with: PYTHONPATH=. python test/bench_analytics.py
+"""
+import random
+from collections import Counter, defaultdict
+from decimal import Decimal
+from time import perf_counter
+
+from app.services.analytics import Snapshot
+
+COMPANIES = [f"Company {i}" for i in range(200)]
+CITIES = [f"City {i}" for i in range(50)]
+
+
+def table_items(users: int, events: int, check_ins: int) -> list:
+    """Items as a scan of the main table returns them"""
+    rng = random.Random(7)
+    items = [{
+        "PK": f"user#u{i}", "SK": f"user#u{i}", "type": "user",
+        "company": rng.choice(COMPANIES), "jobTitle": "Engineer", "city": rng.choice(CITIES), "state": "WA",
+        "attendedCount": Decimal(rng.randrange(20)), "hostedCount": Decimal(rng.randrange(3)),
+    } for i in range(users)]
+    items += [{
+        "PK": f"event#e{i}", "SK": f"event#e{i}", "type": "event", "owner": f"u{rng.randrange(users)}",
+        "venue": f"Hall {i % 30}", "startAt": "2025-06-01T18:00:00",
+    } for i in range(events)]
+    items += [{
+        "PK": f"user#u{rng.randrange(users)}", "SK": f"event#e{rng.randrange(events)}", "type": "attendance",
+        "createdAt": f"2025-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T12:00:00",
+    } for _ in range(check_ins)]
+    return items
+
+
+def per_item(items: list) -> dict:
+    # What a report endpoint does without the snapshot: walk every item
+    companies = {item["PK"]: item.get("company") for item in items if item["type"] == "user"}
+    by_month = Counter()
+    sums, counts = defaultdict(int), Counter()
+    for item in items:
+        if item["type"] == "attendance":
+            by_month[(item["createdAt"][:7], companies.get(item["PK"]))] += 1
+        elif item["type"] == "user":
+            sums[item.get("company")] += int(item["attendedCount"])
+            counts[item.get("company")] += 1
+    return {"by_month": by_month, "mean": {company: sums[company] / counts[company] for company in counts}}
+
+
+def columnar(snapshot: Snapshot) -> dict:
+    by_month = snapshot.attendance_by("company", "month")
+    users = snapshot.users_by("company", "attendedCount", "mean")
+    return {
+        "by_month": Counter({(row["month"], row["company"]): row["count"] for row in by_month}),
+        "mean": {row["company"]: row["mean_attendedCount"] for row in users},
+    }
+
+
+def bench(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        fn(arg)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    for users, repeat in [(10_000, 10), (200_000, 3)]:
+        items = table_items(users, users // 20, users * 5)
+        snapshot = Snapshot()
+        start = perf_counter()
+        snapshot.load(items)
+        load = perf_counter() - start
+
+        expected, actual = per_item(items), columnar(snapshot)
+        assert expected["by_month"] == actual["by_month"]
+        assert all(round(expected["mean"][c], 4) == actual["mean"][c] for c in expected["mean"])
+
+        slow = bench(per_item, items, repeat)
+        fast = bench(columnar, snapshot, repeat)
+        print(f"{users:>7} users, {users * 5:>8} check-ins: per item {slow * 1000:8.1f} ms | "
+              f"snapshot {fast * 1000:7.1f} ms | {slow / fast:5.1f}x (load {load * 1000:.0f} ms)")
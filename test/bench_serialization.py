@@ -0,0 +1,83 @@
+"""Compare the default response_model path with the orjson fast path.
+
+Run from the repository root with: PYTHONPATH=. python test/bench_serialization.py
+"""
+import asyncio
+import json
+from decimal import Decimal
+from time import perf_counter
+from uuid import uuid4
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.models import User
+from app.serialization import FastJSONResponse, stored_record
+
+
+def dynamodb_user_item(i: int) -> dict:
+    user_id = str(uuid4())
+    return {
+        "PK": f"user#{user_id}",
+        "SK": f"user#{user_id}",
+        "type": "user",
+        "firstName": f"First{i}",
+        "lastName": f"Last{i}",
+        "email": f"user{i}@example.com",
+        "jobTitle": "Engineer",
+        "company": f"Company {i % 50}",
+        "city": "Seattle",
+        "state": "WA",
+        "attendedCount": Decimal(i % 17),
+        "hostedCount": Decimal(i % 3),
+    }
+
+
+def build_field_by_field(item: dict) -> User:
+    # What the routes used to do before handing the model to FastAPI
+    return User(**{
+        "id": item["PK"].split("#", 1)[1],
+        "firstName": item["firstName"],
+        "lastName": item["lastName"],
+        "email": item["email"],
+        "phoneNumber": item.get("phoneNumber"),
+        "avatar": item.get("avatar"),
+        "gender": item.get("gender"),
+        "jobTitle": item.get("jobTitle"),
+        "company": item.get("company"),
+        "city": item.get("city"),
+        "state": item.get("state"),
+        "attendedCount": item.get("attendedCount", 0),
+        "hostedCount": item.get("hostedCount", 0),
+    })
+
+
+response_field = create_model_field(name="Response_users", type_=list[User], mode="serialization")
+
+
+def default_path(items: list) -> bytes:
+    users = [build_field_by_field(item) for item in items]
+    content = asyncio.run(serialize_response(field=response_field, response_content=users, is_coroutine=True))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(items: list) -> bytes:
+    return FastJSONResponse([stored_record(User, item) for item in items]).body
+
+
+def bench(fn, items: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        fn(items)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    for count, repeat in [(100, 200), (10_000, 5)]:
+        items = [dynamodb_user_item(i) for i in range(count)]
+        assert json.loads(default_path(items)) == json.loads(fast_path(items))
+        slow = bench(default_path, items, repeat)
+        fast = bench(fast_path, items, repeat)
+        print(f"{count:>6} users: response_model {slow * 1000:8.2f} ms | fast path {fast * 1000:8.2f} ms | {slow / fast:4.1f}x")
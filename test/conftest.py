@@ -0,0 +1,6 @@
+import os
+
+# Run the suite against the in-process DynamoDB and OpenSearch backends
+# unless the environment points it at real services
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("OPENSEARCH_MODE", "memory")
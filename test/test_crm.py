@@ -1,13 +1,20 @@
+import base64
 import pytest
 from fastapi.testclient import TestClient
 from uuid import uuid4
 from datetime import datetime, timedelta
-from app.services.opensearch.client import get_opensearch_client
+from app.services.opensearch.client import get_opensearch_client, breaker
 from app.main import app
 from app.services.db.init import reset_all_table
 from fastapi_pagination import Page, add_pagination, paginate
 from fastapi_pagination.utils import disable_installed_extensions_check
 from app.config import settings
+from app.services.coalesce import SingleFlight
+import asyncio
+import socketserver
+import threading
+import time
+from app.services.email_sender import EmailSender, SMTPProvider
 
 if settings.auth.enabled:
     Exception("Auth is enabled! Please disable it for testing.")
@@ -22,10 +29,13 @@ client = TestClient(app)
 def setup_and_teardown():
     reset_all_table()
     os_client = get_opensearch_client()
-    try:
-        os_client.indices.delete(index="users")
-    except:
-        pass
+    for index in ("users", "events"):
+        try:
+            os_client.indices.delete(index=index)
+        except:
+            pass
+    # Close the breaker an outage test left open
+    breaker.record_success()
     yield
 
 def unique_email():
@@ -41,6 +51,76 @@ def test_health_check():
         "opensearch": "ok"
     }
 
+def test_readiness_after_warm_up():
+    with TestClient(app) as started:
+        res = started.get("/health/ready")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["ready"] is True and body["errors"] == {}
+    assert {"clients", "dynamodb", "opensearch", "total"} <= set(body["phases_ms"])
+
+def test_server_sizing(monkeypatch, tmp_path):
+    import anyio.to_thread
+    from app import server
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: {0, 1, 2, 3}, raising=False)
+    real_open = open
+    quota = tmp_path / "cpu.max"
+
+    def cgroup_open(path, *args, **kwargs):
+        return real_open(quota if path == "/sys/fs/cgroup/cpu.max" else path, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", cgroup_open)
+    quota.write_text("max 100000\n")
+    assert server.available_cpus() == 4
+    quota.write_text("200000 100000\n")
+    assert server.available_cpus() == 2
+    quota.write_text("50000 100000\n")
+    assert server.available_cpus() == 1
+    quota.unlink()
+    assert server.available_cpus() == 4
+    assert server.worker_count() == 4
+    monkeypatch.setattr(settings.app, "workers", 3)
+    assert server.worker_count() == 3
+
+    runs = []
+    monkeypatch.setattr(server.uvicorn, "run", lambda target, **kwargs: runs.append(kwargs))
+    server.main()
+    assert runs[0]["workers"] == 3 and runs[0]["forwarded_allow_ips"] == "127.0.0.1"
+
+    # The threadpool keeps anyio's size unless APP_THREADPOOL_SIZE is set
+    def threads(started):
+        return started.portal.call(lambda: anyio.to_thread.current_default_thread_limiter().total_tokens)
+
+    with TestClient(app) as started:
+        assert threads(started) == 40
+    monkeypatch.setattr(settings.app, "threadpool_size", 64)
+    with TestClient(app) as started:
+        assert threads(started) == 64
+
+def test_failed_warm_up_phase_is_retried_before_ready(monkeypatch):
+    from app.services import startup
+    monkeypatch.setattr(startup, "state", startup.StartupState())
+    monkeypatch.setattr(settings.app, "warmup_retry_seconds", 0.01)
+    calls = []
+
+    def flaky_opensearch():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("cluster still starting")
+
+    monkeypatch.setattr(startup, "warm_opensearch", flaky_opensearch)
+
+    async def start():
+        report = await startup.warm_up()
+        assert report["ready"] is False and report["errors"] == {"opensearch": "cluster still starting"}
+        assert client.get("/health/ready").status_code == 503
+        await startup.state.retrier
+
+    asyncio.run(start())
+    assert len(calls) == 3
+    assert startup.state.report()["ready"] is True and startup.state.errors == {}
+    assert client.get("/health/ready").status_code == 200
+
 def test_create_user_success():
     res = client.post("/users/", json={
         "firstName": "Alice",
@@ -97,6 +177,59 @@ def test_update_nonexistent_user_should_fail():
     })
     assert res.status_code == 404
 
+def test_patch_user_success():
+    create_res = client.post("/users/", json={
+        "firstName": "Patch",
+        "lastName": "User",
+        "email": unique_email(),
+        "company": "Old Company",
+        "city": "NYC",
+        "state": "NY"
+    })
+    assert create_res.status_code == 200
+    user_id = create_res.json()["id"]
+
+    # Only the sent fields change, counters are not reset
+    patch_res = client.patch(f"/users/{user_id}", json={
+        "company": "New Company",
+        "jobTitle": None,
+        "attendedCount": 99
+    })
+    assert patch_res.status_code == 200
+    data = patch_res.json()
+    assert data["company"] == "New Company"
+    assert data["firstName"] == "Patch"
+    assert data["city"] == "NYC"
+    assert data["attendedCount"] == 0
+
+    # Email change swaps the uniqueness guard
+    new_email = unique_email()
+    patch_res = client.patch(f"/users/{user_id}", json={"email": new_email})
+    assert patch_res.status_code == 200
+    assert patch_res.json()["email"] == new_email
+
+    get_res = client.get(f"/users/{user_id}")
+    assert get_res.json()["company"] == "New Company"
+    assert get_res.json()["email"] == new_email
+
+    # A cleared field is removed from the indexed doc, not stored as null
+    assert client.patch(f"/users/{user_id}", json={"company": None, "jobTitle": "CTO"}).status_code == 200
+    doc = get_opensearch_client().get(index="users", id=user_id)["_source"]
+    assert "company" not in doc and doc["jobTitle"] == "CTO" and doc["email"] == new_email
+
+def test_patch_user_duplicate_email_should_fail():
+    email = unique_email()
+    client.post("/users/", json={"firstName": "Taken", "lastName": "Email", "email": email})
+    res = client.post("/users/", json={"firstName": "Other", "lastName": "User", "email": unique_email()})
+    user_id = res.json()["id"]
+
+    patch_res = client.patch(f"/users/{user_id}", json={"email": email})
+    assert patch_res.status_code == 400
+
+def test_patch_nonexistent_user_should_fail():
+    res = client.patch("/users/nonexistent-id", json={"company": "Ghost Corp"})
+    assert res.status_code == 404
+
 def test_delete_user_success():
     # Create user
     res = client.post("/users/", json={
@@ -145,6 +278,40 @@ def test_duplicate_email_should_fail():
     })
     assert res.status_code in [400, 409]
 
+def test_legacy_duplicates_can_be_renamed_only_after_resolving_and_deleted():
+    from app.services.db.session import table
+    email = unique_email()
+    owner = client.post("/users/", json={"firstName": "Guard", "lastName": "Owner", "email": email}).json()["id"]
+    duplicate = client.post("/users/", json={"firstName": "Legacy", "lastName": "Dup", "email": unique_email()}).json()
+    # Written before guards existed: the backfill gave the email's guard to the other user
+    table.delete_item(Key={"PK": f"email#{duplicate['email'].lower()}", "SK": f"email#{duplicate['email'].lower()}"})
+    table.update_item(Key={"PK": f"user#{duplicate['id']}", "SK": f"user#{duplicate['id']}"},
+                      UpdateExpression="SET email = :e", ExpressionAttributeValues={":e": email})
+
+    res = client.patch(f"/users/{duplicate['id']}", json={"email": unique_email()})
+    assert res.status_code == 409 and "old email" in res.json()["detail"]
+    res = client.put(f"/users/{duplicate['id']}", json={"firstName": "Legacy", "lastName": "Dup", "email": unique_email()})
+    assert res.status_code == 409
+
+    assert client.delete(f"/users/{duplicate['id']}").status_code == 200
+    assert client.get(f"/users/{duplicate['id']}").status_code == 404
+    # The owner keeps the guard
+    assert client.post("/users/", json={"firstName": "Taken", "lastName": "Again", "email": email}).status_code == 400
+    assert client.get(f"/users/{owner}").status_code == 200
+
+    slug = f"legacy-{uuid4().hex[:6]}"
+    now = datetime.now()
+    event = {"title": "Legacy", "owner": owner, "startAt": now.isoformat(), "endAt": (now + timedelta(hours=1)).isoformat()}
+    client.post("/events/", json={**event, "slug": slug})
+    legacy = client.post("/events/", json={**event, "slug": f"other-{uuid4().hex[:6]}"}).json()
+    table.delete_item(Key={"PK": f"slug#{legacy['slug']}", "SK": f"slug#{legacy['slug']}"})
+    table.update_item(Key={"PK": f"event#{legacy['id']}", "SK": f"event#{legacy['id']}"},
+                      UpdateExpression="SET slug = :s", ExpressionAttributeValues={":s": slug})
+    res = client.put(f"/events/{legacy['id']}", json={**event, "slug": f"renamed-{uuid4().hex[:6]}"})
+    assert res.status_code == 409
+    assert client.delete(f"/events/{legacy['id']}").status_code == 200
+    assert client.post("/events/", json={**event, "slug": slug}).status_code == 400
+
 def test_get_user_success():
     res = client.post("/users/", json={
         "firstName": "Diana",
@@ -156,6 +323,22 @@ def test_get_user_success():
     assert get_res.status_code == 200
     assert get_res.json()["id"] == user_id
 
+def test_get_user_with_fields():
+    res = client.post("/users/", json={
+        "firstName": "Fiona",
+        "lastName": "Fields",
+        "email": unique_email(),
+        "company": "Acme Corp"
+    })
+    user_id = res.json()["id"]
+
+    get_res = client.get(f"/users/{user_id}", params={"fields": "email,company"})
+    assert get_res.status_code == 200
+    assert get_res.json() == {"id": user_id, "email": res.json()["email"], "company": "Acme Corp"}
+
+    bad_res = client.get(f"/users/{user_id}", params={"fields": "password"})
+    assert bad_res.status_code == 400
+
 def test_create_event_success():
     owner_res = client.post("/users/", json={
         "firstName": "Eve",
@@ -310,6 +493,68 @@ def test_delete_event_success():
     get_res = client.get(f"/events/{event_id}")
     assert get_res.status_code == 404
 
+def test_get_events_with_fields():
+    owner_res = client.post("/users/", json={
+        "firstName": "List",
+        "lastName": "Events",
+        "email": unique_email()
+    })
+    owner_id = owner_res.json()["id"]
+    slug = f"listed-{uuid4().hex[:6]}"
+    create_res = client.post("/events/", json={
+        "slug": slug,
+        "title": "Listed Event",
+        "startAt": datetime.now().isoformat(),
+        "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+        "owner": owner_id
+    })
+    event_id = create_res.json()["id"]
+
+    res = client.get("/events/", params={"fields": "slug"})
+    assert res.status_code == 200
+    assert res.json()["total"] == 1
+    assert res.json()["items"] == [{"id": event_id, "slug": slug}]
+
+    res = client.get("/events/")
+    assert res.json()["items"][0]["title"] == "Listed Event"
+
+def test_delete_event_cascades_attendance():
+    owner_id = client.post("/users/", json={
+        "firstName": "Cascade",
+        "lastName": "Owner",
+        "email": unique_email()
+    }).json()["id"]
+    attendee_ids = [
+        client.post("/users/", json={
+            "firstName": f"Attendee{i}",
+            "lastName": "Cascade",
+            "email": unique_email()
+        }).json()["id"]
+        for i in range(3)
+    ]
+    event_id = client.post("/events/", json={
+        "slug": f"cascade-{uuid4().hex[:6]}",
+        "title": "Cascade Event",
+        "startAt": datetime.now().isoformat(),
+        "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+        "owner": owner_id
+    }).json()["id"]
+    for user_id in attendee_ids:
+        client.post("/attend/", json={"user_id": user_id, "event_id": event_id})
+
+    delete_res = client.delete(f"/events/{event_id}")
+    assert delete_res.status_code == 200
+    job_id = delete_res.json()["job_id"]
+
+    # TestClient runs background tasks before returning
+    job_res = client.get(f"/jobs/{job_id}")
+    assert job_res.status_code == 200
+    assert job_res.json()["status"] == "done"
+    assert job_res.json()["processed"] == 3
+
+    assert client.get(f"/attend/event/{event_id}").json()["total"] == 0
+    assert client.get(f"/users/{attendee_ids[0]}").json()["attendedCount"] == 0
+
 def test_delete_nonexistent_event_should_fail():
     res = client.delete("/events/nonexistent-id")
     assert res.status_code == 404
@@ -360,6 +605,114 @@ def test_attend_event():
     event_res = client.get(f"/attend/event/{event_id}")
     assert event_res.json()["items"][0]["event_id"] == event_id
 
+    # expand attendees without one GET per user
+    event_res = client.get(f"/attend/event/{event_id}", params={"expand": "user"})
+    assert event_res.json()["items"][0]["user"]["id"] == user_id
+    assert event_res.json()["items"][0]["user"]["firstName"] == "Gina"
+
+    user_attend_res = client.get(f"/attend/user/{user_id}", params={"expand": "event"})
+    assert user_attend_res.json()["items"][0]["event"]["title"] == "Networking"
+
+def test_idempotent_create_user_and_attendance():
+    key = {"Idempotency-Key": uuid4().hex}
+    payload = {"firstName": "Retry", "lastName": "Client", "email": unique_email()}
+    first = client.post("/users/", json=payload, headers=key)
+    assert first.status_code == 200
+    retry = client.post("/users/", json=payload, headers=key)
+    assert retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+
+    # Same key with a different body is rejected
+    changed = client.post("/users/", json={**payload, "firstName": "Other"}, headers=key)
+    assert changed.status_code == 422
+
+    user_id = first.json()["id"]
+    event_id = client.post("/events/", json={
+        "slug": f"retry-{uuid4().hex[:6]}",
+        "title": "Retry Event",
+        "startAt": datetime.now().isoformat(),
+        "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+        "owner": user_id
+    }).json()["id"]
+    attend_key = {"Idempotency-Key": uuid4().hex}
+    body = {"user_id": user_id, "event_id": event_id}
+    assert client.post("/attend/", json=body, headers=attend_key).status_code == 200
+    assert client.post("/attend/", json=body, headers=attend_key).status_code == 200
+    assert client.get(f"/users/{user_id}").json()["attendedCount"] == 1
+
+def test_bulk_attendance():
+    user_ids = [
+        client.post("/users/", json={
+            "firstName": f"Bulk{i}",
+            "lastName": "Attendee",
+            "email": unique_email()
+        }).json()["id"]
+        for i in range(2)
+    ]
+    event_ids = [
+        client.post("/events/", json={
+            "slug": f"bulk-{uuid4().hex[:6]}",
+            "title": "Bulk Check-in",
+            "startAt": datetime.now().isoformat(),
+            "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+            "owner": user_ids[0]
+        }).json()["id"]
+        for _ in range(2)
+    ]
+    client.post("/attend/", json={"user_id": user_ids[1], "event_id": event_ids[1]})
+
+    res = client.post("/attend/bulk", json={"items": [
+        {"user_id": user_ids[0], "event_id": event_ids[0]},
+        {"user_id": user_ids[0], "event_id": event_ids[1]},
+        {"user_id": user_ids[0], "event_id": event_ids[0]},
+        {"user_id": user_ids[1], "event_id": event_ids[1]},
+        {"user_id": "missing-user", "event_id": event_ids[0]},
+        {"user_id": user_ids[1], "event_id": "missing-event"},
+    ]})
+    assert res.status_code == 200
+    assert res.json()["created"] == 2
+    assert [r["status"] for r in res.json()["results"]] == [
+        "created", "created", "duplicate", "duplicate", "user_not_found", "event_not_found"
+    ]
+    assert client.get(f"/users/{user_ids[0]}").json()["attendedCount"] == 2
+    assert client.get(f"/users/{user_ids[1]}").json()["attendedCount"] == 1
+    assert client.get(f"/attend/user/{user_ids[0]}").json()["total"] == 2
+
+def test_batch_get_users_and_events():
+    user_ids = [
+        client.post("/users/", json={
+            "firstName": f"Batch{i}",
+            "lastName": "User",
+            "email": unique_email()
+        }).json()["id"]
+        for i in range(3)
+    ]
+    res = client.post("/users/batch_get", json={
+        "ids": [user_ids[2], "missing-id", user_ids[0], user_ids[1]],
+        "fields": ["firstName"]
+    })
+    assert res.status_code == 200
+    data = res.json()
+    assert [u["id"] for u in data["users"]] == [user_ids[2], user_ids[0], user_ids[1]]
+    assert data["users"][0] == {"id": user_ids[2], "firstName": "Batch2"}
+    assert data["missing"] == ["missing-id"]
+
+    event_res = client.post("/events/", json={
+        "slug": f"batch-{uuid4().hex[:6]}",
+        "title": "Batch Event",
+        "startAt": datetime.now().isoformat(),
+        "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+        "owner": user_ids[0]
+    })
+    event_id = event_res.json()["id"]
+    res = client.post("/events/batch_get", json={"ids": [event_id]})
+    assert res.status_code == 200
+    assert res.json()["events"][0]["title"] == "Batch Event"
+
+    res = client.post("/users/batch_get", json={"ids": []})
+    assert res.status_code == 422
+
 # def test_simple_filter_users_endpoint():
 #     res = client.post("/search/basic-filter-users", json={
 #         "company": "NonExistent",
@@ -368,6 +721,55 @@ def test_attend_event():
 #     assert res.status_code == 200
 #     assert isinstance(res.json(), list)
 
+def test_memory_dynamodb_validates_expressions_like_dynamodb():
+    from botocore.exceptions import ClientError
+    from app.services.db.session import table
+    key = {"PK": "check#1", "SK": "check#1"}
+    table.put_item(Item={**key, "status": "new"})
+
+    def rejected(call, **kwargs):
+        with pytest.raises(ClientError) as e:
+            call(Key=key, **kwargs)
+        assert e.value.response["Error"]["Code"] == "ValidationException"
+        return e.value.response["Error"]["Message"]
+
+    assert "reserved keyword: status" in rejected(table.update_item, UpdateExpression="SET status = :s",
+                                                  ExpressionAttributeValues={":s": "old"})
+    assert "reserved keyword: name" in rejected(table.get_item, ProjectionExpression="PK, name")
+    assert "unused in expressions: keys: {#x}" in rejected(
+        table.update_item, UpdateExpression="SET #s = :s", ExpressionAttributeNames={"#s": "status", "#x": "extra"},
+        ExpressionAttributeValues={":s": "old"})
+    assert "unused in expressions: keys: {:y}" in rejected(
+        table.delete_item, ConditionExpression="#s = :s", ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":s": "new", ":y": 1})
+    assert "only be specified when using expressions" in rejected(table.get_item, ExpressionAttributeNames={"#s": "status"})
+
+    table.update_item(Key=key, UpdateExpression="SET #s = :s", ExpressionAttributeNames={"#s": "status"},
+                      ExpressionAttributeValues={":s": "old"})
+    assert table.get_item(Key=key)["Item"]["status"] == "old"
+
+def test_single_flight_coalesces_concurrent_reads():
+    flight = SingleFlight()
+    calls = []
+
+    async def read():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": "e1"}
+
+    async def burst():
+        return await asyncio.gather(*(flight.do("get_event", "e1", read) for _ in range(20)))
+
+    results = asyncio.run(burst())
+    assert len(calls) == 1
+    assert all(r == {"id": "e1"} for r in results)
+    assert flight.metrics()["scopes"]["get_event"]["coalesced"] == 19
+
+    # Once the call finishes, the next read goes to the backend again
+    asyncio.run(burst())
+    assert len(calls) == 2
+    assert client.get("/health/coalescing").status_code == 200
+
 def test_filter_users_opensearch_endpoint():
     client.post("/users/", json={
         "firstName": "Gina",
@@ -403,7 +805,578 @@ def test_email_filter_post():
         "body": "Join our next event!"
     })
     print(res.json())
-    assert res.status_code == 200
+    assert res.status_code == 202
     assert res.json()["totalRecipients"] == 1
+    assert client.get(f"/jobs/{res.json()['job_id']}").json()["status"] == "done"
+    assert client.post(f"/email/{res.json()['email_id']}").json()["status"] == "sent"
+
+
+def test_compact_email_logs(monkeypatch):
+    from app.services.db.session import email_table
+    monkeypatch.setattr(settings.email, "log_format", "compact")
+    monkeypatch.setattr(settings.email, "log_chunk_size", 2)
+    for i in range(3):
+        client.post("/users/", json={"firstName": f"Compact{i}", "lastName": "Log",
+                                     "email": unique_email(), "company": "Compact Co"})
+    # Recipients are paged from OpenSearch, not taken from one capped search
+    from functools import partial
+    from app.services import campaigns, export
+    monkeypatch.setattr(campaigns, "search_user_records", partial(export.search_user_records, page_size=2))
+    res = client.post("/email/send_emails/", json={
+        "filter": {"company": "Compact Co"}, "subject": "Compact", "body": "Logs"})
+    assert res.status_code == 202 and res.json()["totalRecipients"] == 3
+    email_id = res.json()["email_id"]
+
+    stored = email_table.query(KeyConditionExpression="PK = :pk",
+                               ExpressionAttributeValues={":pk": f"req_email#{email_id}"})["Items"]
+    assert [item["recipients"] for item in stored] == [2, 1]
+
+    statuses = client.post(f"/email/sent/{email_id}").json()["items"]
+    assert len(statuses) == 3 and {s["status"] for s in statuses} == {"sent"}
+
+    # A send that dies after the first batch has logged only the recipients it tried
+    batches = []
+
+    def flaky(emails, subject, body):
+        batches.append(emails)
+        if len(batches) > 1:
+            raise RuntimeError("provider went away")
+        return {email: "sent" for email in emails}
+    monkeypatch.setattr(campaigns, "send_bulk_emails", flaky)
+    res = client.post("/email/send_emails/", json={
+        "filter": {"company": "Compact Co"}, "subject": "Compact", "body": "Again"})
+    email_id = res.json()["email_id"]
+    assert client.get(f"/jobs/{res.json()['job_id']}").json()["status"] == "error"
+    summary = client.get(f"/email/{email_id}/summary").json()
+    assert summary["status"] == "sending" and summary["totalRecipients"] == 3
+    assert summary["statusCounts"] == {"sent": 2, "error": 0, "pending": 0, "sending": 0}
+    stored = email_table.query(KeyConditionExpression="PK = :pk",
+                               ExpressionAttributeValues={":pk": f"req_email#{email_id}"})["Items"]
+    assert [item["recipients"] for item in stored] == [2]
+    assert len(client.post(f"/email/sent/{email_id}").json()["items"]) == 2
+
+
+def test_campaign_status_counters(monkeypatch):
+    monkeypatch.setattr(settings.email, "log_format", "compact")
+    user_ids = [client.post("/users/", json={"firstName": f"Count{i}", "lastName": "Er",
+                                             "email": unique_email(), "company": "Counter Co"}).json()["id"]
+                for i in range(2)]
+    email_id = client.post("/email/send_emails/", json={
+        "filter": {"company": "Counter Co"}, "subject": "Counts", "body": "Up"}).json()["email_id"]
+    assert client.get(f"/email/{email_id}/summary").json()["statusCounts"] == {
+        "sent": 2, "error": 0, "pending": 0, "sending": 0}
+
+    res = client.patch(f"/email/sent/{email_id}/{user_ids[0]}", json={"status": "error"})
+    assert res.status_code == 200 and res.json()["status"] == "error"
+    summary = client.get(f"/email/{email_id}/summary").json()
+    assert summary["statusCounts"]["sent"] == 1 and summary["statusCounts"]["error"] == 1
+
+    failed = client.post(f"/email/sent/{email_id}?status=error").json()["items"]
+    assert [e["user_id"] for e in failed] == [user_ids[0]]
+    assert client.patch(f"/email/sent/{email_id}/ghost", json={"status": "error"}).status_code == 404
+
+
+def test_retention_archives_expiring_records(monkeypatch, tmp_path):
+    import gzip, json, types
+    from app.services import retention
+    from app.services.retention import archive_expiring, backfill_expiry
+    user_id = client.post("/users/", json={"firstName": "Kept", "lastName": "Briefly",
+                                           "email": unique_email(), "company": "Retention Co"}).json()["id"]
+    events = [client.post("/events/", json={
+        "slug": f"retain-{uuid4().hex[:6]}", "title": "Retention", "owner": user_id,
+        "startAt": datetime.now().isoformat(), "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+    }).json()["id"] for _ in range(2)]
+    # Written before attendance had a policy, so without expiresAt
+    client.post("/attend/", json={"user_id": user_id, "event_id": events[0]})
+    monkeypatch.setattr(settings.retention, "email_log_days", 3)
+    monkeypatch.setattr(settings.retention, "attendance_days", 3)
+    client.post("/attend/", json={"user_id": user_id, "event_id": events[1]})
+    client.post("/email/send_emails/", json={"filter": {"company": "Retention Co"}, "subject": "Bye", "body": "Soon"})
+
+    with pytest.raises(ValueError):
+        archive_expiring(target=str(tmp_path), lead_days=3)
+    with pytest.raises(ValueError):
+        type(settings.retention)(attendance_days=2, archive_lead_days=2)
+    assert archive_expiring(target=str(tmp_path), lead_days=2, segments=2)["attendance"]["records"] == 0
+
+    later = time.time() + 1.5 * 86400
+    monkeypatch.setattr(retention, "time", types.SimpleNamespace(time=lambda: later))
+    summary = archive_expiring(target=str(tmp_path), fmt="ndjson", lead_days=2, segments=2)
+    assert summary["attendance"]["records"] == 1 and summary["email_log"]["records"] == 1
+    with gzip.open(summary["attendance"]["files"][0]) as f:
+        record = json.loads(f.readline())
+    assert record["SK"] == f"event#{events[1]}" and record["expiresAt"] > datetime.now().timestamp()
+
+    # Archived records are marked, so a second run skips them
+    assert archive_expiring(target=str(tmp_path), lead_days=2, segments=2)["attendance"]["records"] == 0
+    # A backfilled record expires before the last run's window end, and is still archived
+    assert backfill_expiry(segments=2)["attendance"] == 1
+    summary = archive_expiring(target=str(tmp_path), lead_days=2, segments=2)
+    assert summary["attendance"]["records"] == 1 and summary["email_log"]["records"] == 0
+
+
+def test_streaming_exports():
+    import csv, io, json
+    ids = {client.post("/users/", json={"firstName": f"Export{i}", "lastName": "Row", "email": unique_email(),
+                                        "company": "Exportable" if i < 2 else "Unrelated"}).json()["id"]
+           for i in range(3)}
+
+    res = client.get("/users/export?segments=3")
+    assert res.status_code == 200 and res.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(res.text)))
+    assert {row["id"] for row in rows} == ids and rows[0]["company"]
+
+    res = client.post("/search/export?format=ndjson&fields=company", json={"company": "Exportable"})
+    assert res.status_code == 200
+    docs = [json.loads(line) for line in res.text.splitlines()]
+    assert len(docs) == 2 and all(set(doc) == {"id", "company"} for doc in docs)
+    assert [doc["id"] for doc in docs] == sorted(doc["id"] for doc in docs)
+
+def test_discover_events_by_time_and_venue():
+    owner_id = client.post("/users/", json={"firstName": "Dora", "lastName": "Host", "email": unique_email()}).json()["id"]
+    start = datetime.now() + timedelta(days=1)
+    ids = []
+    for i, venue in enumerate(["Main Hall", "Garden", "Main Hall", "Main Hall"]):
+        res = client.post("/events/", json={
+            "slug": f"event-{uuid4().hex[:6]}",
+            "title": f"Discover {i}",
+            "startAt": (start + timedelta(hours=i)).isoformat(),
+            "endAt": (start + timedelta(hours=i + 1)).isoformat(),
+            "owner": owner_id,
+            "venue": venue,
+        })
+        ids.append(res.json()["id"])
+    client.delete(f"/events/{ids[3]}")
+
+    res = client.get("/events/discover", params={"venue": "main hall", "size": 1})
+    assert res.status_code == 200
+    first = res.json()
+    assert [e["id"] for e in first["events"]] == [ids[0]] and first["next"]
+    second = client.get("/events/discover", params={"venue": "main hall", "size": 1, "cursor": first["next"]}).json()
+    assert [e["id"] for e in second["events"]] == [ids[2]]
+
+    res = client.get("/events/discover", params={"start_to": (start + timedelta(minutes=90)).isoformat(),
+                                                 "order": "desc", "fields": "title"})
+    assert [e["id"] for e in res.json()["events"]] == [ids[1], ids[0]]
+    assert set(res.json()["events"][0]) == {"id", "title"}
+    assert client.get("/events/discover", params={"cursor": "nonsense"}).status_code == 400
+    for decoded in (b"1", b"{}", b'["2026-01-01T00:00:00"]', b'[{"a": 1}, "id"]'):
+        cursor = base64.urlsafe_b64encode(decoded).decode()
+        res = client.get("/events/discover", params={"cursor": cursor})
+        assert res.status_code == 400 and res.json()["detail"] == "Invalid cursor"
+
+def test_suggest_users_as_you_type():
+    jane = client.post("/users/", json={"firstName": "Janelle", "lastName": "Smithers", "email": unique_email(),
+                                        "company": "Acme", "avatar": "https://example.com/j.png"}).json()["id"]
+    client.post("/users/", json={"firstName": "Janet", "lastName": "Brown", "email": unique_email(), "company": "Globex"})
+
+    res = client.get("/search/suggest", params={"q": "jan"})
+    assert res.status_code == 200
+    assert len(res.json()["suggestions"]) == 2
+
+    res = client.get("/search/suggest", params={"q": "janelle smi"})
+    assert res.json()["suggestions"] == [{"id": jane, "name": "Janelle Smithers", "avatar": "https://example.com/j.png"}]
+    assert [s["id"] for s in client.get("/search/suggest", params={"q": "acm"}).json()["suggestions"]] == [jane]
+    assert client.get("/search/suggest", params={"q": " "}).status_code == 422
+
+def test_saved_segments_follow_user_changes():
+    ids = [client.post("/users/", json={"firstName": f"Seg{i}", "lastName": "Member", "email": unique_email(),
+                                        "company": "Segmented" if i < 2 else "Elsewhere"}).json()["id"]
+           for i in range(3)]
+
+    res = client.post("/segments/", json={"name": "Segmented staff", "filter": {"company": "Segmented"}})
+    assert res.status_code == 200
+    segment_id = res.json()["segment"]["segment_id"]
+    assert client.get(f"/jobs/{res.json()['job_id']}").json()["status"] == "done"
+    segment = client.get(f"/segments/{segment_id}").json()
+    assert segment["status"] == "ready" and segment["memberCount"] == 2
+
+    regulars = client.post("/segments/", json={"name": "Regulars", "filter": {"minAttended": 1}}).json()["segment"]
+    assert client.get(f"/segments/{regulars['segment_id']}").json()["memberCount"] == 0
+
+    # Joins on a profile change, leaves on delete, counter changes move it between segments
+    client.patch(f"/users/{ids[2]}", json={"company": "Segmented Ltd"})
+    client.delete(f"/users/{ids[0]}")
+    event_id = client.post("/events/", json={
+        "slug": f"seg-{uuid4().hex[:6]}", "title": "Segment Night", "owner": ids[1],
+        "startAt": datetime.now().isoformat(), "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+    }).json()["id"]
+    client.post("/attend/", json={"user_id": ids[1], "event_id": event_id})
+
+    members = client.get(f"/segments/{segment_id}/members").json()["items"]
+    assert sorted(m["id"] for m in members) == sorted(ids[1:])
+    assert client.get(f"/segments/{segment_id}").json()["memberCount"] == 2
+    assert [m["id"] for m in client.get(f"/segments/{regulars['segment_id']}/members").json()["items"]] == [ids[1]]
+
+    res = client.post("/email/send_emails", json={"segment_id": segment_id, "subject": "Hi", "body": "Hello"})
+    assert res.status_code == 202
+    assert res.json()["totalRecipients"] == 2 and res.json()["filter"] == {"company": "Segmented"}
+
+    assert client.delete(f"/segments/{segment_id}").status_code == 200
+    assert client.get(f"/segments/{segment_id}").status_code == 404
+
+
+def test_segment_rebuild_keeps_a_concurrent_refresh(monkeypatch):
+    from app.models import User
+    from app.services import segments
+    from app.services.db.session import table
+    ids = [client.post("/users/", json={"firstName": f"Race{i}", "lastName": "Member", "email": unique_email(),
+                                        "company": "Racing"}).json()["id"] for i in range(2)]
+    segment = client.post("/segments/", json={"name": "Racers", "filter": {"company": "Racing"}}).json()["segment"]
+    segment_id, buckets = segment["segment_id"], segment["buckets"]
+    late = User(firstName="Late", lastName="Racer", email=unique_email(), company="Racing")
+    search = segments.search_user_records
+
+    async def racing_search(*args, **kwargs):
+        async for page in search(*args, **kwargs):
+            # A refresh that read the segment before the rebuild started, for a user the scan does not see
+            table.put_item(Item=late.to_dynamodb_item())
+            segments._apply_bucket(segment_id, segments.bucket_of(late.id, buckets), {late.id: late.email}, set())
+            yield page
+
+    monkeypatch.setattr(segments, "search_user_records", racing_search)
+    job_id = client.post(f"/segments/{segment_id}/rebuild").json()["job_id"]
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "done"
+    assert sorted(segments.read_members(segment_id)) == sorted(ids + [late.id])
+    assert client.get(f"/segments/{segment_id}").json()["memberCount"] == 3
+
+
+def test_analytics_snapshot_group_by_and_refresh():
+    users = [client.post("/users/", json={"firstName": f"Stat{i}", "lastName": "User", "email": unique_email(),
+                                          "company": "Columnar" if i < 3 else "Rowwise", "city": "Oslo"}).json()["id"]
+             for i in range(5)]
+    now = datetime.now()
+    event_ids = [client.post("/events/", json={
+        "slug": f"stats-{uuid4().hex[:6]}", "title": f"Stats {i}", "owner": users[0] if i < 2 else users[3],
+        "venue": "Hall", "startAt": now.isoformat(), "endAt": (now + timedelta(hours=1)).isoformat(),
+    }).json()["id"] for i in range(3)]
+    for user_id in users[:4]:
+        client.post("/attend/", json={"user_id": user_id, "event_id": event_ids[0]})
+
+    status = client.post("/analytics/refresh", params={"full": True}).json()
+    assert (status["users"], status["events"], status["attendance"]) == (5, 3, 4)
+    rows = client.get("/analytics/attendance", params={"by": "company"}).json()["rows"]
+    assert rows == [{"company": "Columnar", "count": 3}, {"company": "Rowwise", "count": 1}]
+    by_month = client.get("/analytics/attendance", params={"by": "city", "period": "month"}).json()["rows"]
+    assert by_month == [{"month": now.strftime("%Y-%m"), "city": "Oslo", "count": 4}]
+    rows = client.get("/analytics/users", params={"by": "company", "metric": "attendedCount", "agg": "mean"}).json()["rows"]
+    assert rows == [{"company": "Columnar", "users": 3, "mean_attendedCount": 1.0},
+                    {"company": "Rowwise", "users": 2, "mean_attendedCount": 0.5}]
+    hosts = client.get("/analytics/hosts", params={"by": "company", "top": 1}).json()["rows"]
+    assert hosts == [{"company": "Columnar", "hosts": [{"id": users[0], "hostedCount": 2}]},
+                     {"company": "Rowwise", "hosts": [{"id": users[3], "hostedCount": 1}]}]
+    histogram = client.get("/analytics/histogram", params={"metric": "attendedCount", "bins": 2}).json()
+    assert [bucket["count"] for bucket in histogram["buckets"]] == [1, 4]
+
+    # Applied from the change log without a full scan
+    client.patch(f"/users/{users[4]}", json={"company": "Columnar"})
+    client.post("/attend/", json={"user_id": users[4], "event_id": event_ids[1]})
+    client.delete(f"/users/{users[1]}")
+    status = client.post("/analytics/refresh").json()
+    assert status["builtAt"] != status["refreshedAt"]
+    assert (status["users"], status["attendance"]) == (4, 4)
+    rows = client.get("/analytics/attendance", params={"by": "company"}).json()["rows"]
+    assert rows == [{"company": "Columnar", "count": 3}, {"company": "Rowwise", "count": 1}]
+    assert client.get("/analytics/users", params={"agg": "sum"}).status_code == 400
+
+
+def test_analytics_queries_never_wait_for_a_scan(monkeypatch):
+    from app.services import analytics
+    monkeypatch.setattr(analytics, "_snapshot", None)
+    release, builds = threading.Event(), []
+    build_snapshot = analytics.build_snapshot
+
+    def slow_build(*args, **kwargs):
+        builds.append(1)
+        release.wait(5)
+        return build_snapshot(*args, **kwargs)
+    monkeypatch.setattr(analytics, "build_snapshot", slow_build)
+
+    # Nothing built yet: 503 right away while the first build runs once
+    assert client.get("/analytics/status").status_code == 503
+    while not builds:
+        time.sleep(0.01)
+    assert client.get("/analytics/users").status_code == 503
+    release.set()
+    with analytics._update_lock:
+        pass
+    first = client.get("/analytics/status").json()
+    assert len(builds) == 1
+
+    # A due rebuild runs in the background, queries get the previous snapshot meanwhile
+    release.clear()
+    monkeypatch.setattr(settings.analytics, "rebuild_seconds", 0)
+    assert client.get("/analytics/status").json() == first
+    while len(builds) < 2:
+        time.sleep(0.01)
+    assert client.get("/analytics/status").json() == first
+    release.set()
+    with analytics._update_lock:
+        pass
+
+
+def test_co_attendance_recommendations():
+    from app.services.recommendations import rebuild_recommendations, read_neighbours, merge_scores
+    # A full list evicts its lowest neighbour, the newcomer inherits its score
+    assert merge_scores({"a": 3, "b": 1}, {"c": 1, "a": 1}, capacity=2) == {"a": 4, "c": 2}
+    users = [client.post("/users/", json={"firstName": f"Rec{i}", "lastName": "User", "email": unique_email()}).json()["id"]
+             for i in range(4)]
+    past, soon = datetime.now() - timedelta(days=30), datetime.now() + timedelta(days=7)
+    events = [client.post("/events/", json={
+        "slug": f"rec-{uuid4().hex[:6]}", "title": f"Rec {i}", "owner": users[0],
+        "startAt": (past if i < 2 else soon).isoformat(), "endAt": ((past if i < 2 else soon) + timedelta(hours=2)).isoformat(),
+    }).json()["id"] for i in range(4)]
+    # events 0 and 1 share users 0-2, event 2 has users 1-2, event 3 only user 3
+    for user_id in users[:3]:
+        client.post("/attend/", json={"user_id": user_id, "event_id": events[0]})
+    res = client.post("/attend/bulk", json={"items": [
+        {"user_id": users[0], "event_id": events[1]}, {"user_id": users[1], "event_id": events[1]},
+        {"user_id": users[2], "event_id": events[1]}, {"user_id": users[1], "event_id": events[2]},
+        {"user_id": users[2], "event_id": events[2]}, {"user_id": users[3], "event_id": events[3]},
+    ]})
+    assert res.json()["created"] == 6
+
+    similar = client.get(f"/recommendations/events/{events[0]}/similar").json()
+    assert [(r["id"], r["score"]) for r in similar] == [(events[1], 3), (events[2], 2)]
+    assert similar[0]["event"]["title"] == "Rec 1"
+    similar = client.get(f"/recommendations/users/{users[1]}/similar", params={"k": 1}).json()
+    assert [(r["id"], r["score"]) for r in similar] == [(users[2], 3)]
+    assert client.get(f"/recommendations/users/{users[3]}/similar").json() == []
+
+    suggested = client.get(f"/recommendations/users/{users[0]}/events").json()
+    assert [(r["id"], r["score"]) for r in suggested] == [(events[2], 4)]
+    assert client.get(f"/recommendations/users/{users[1]}/events", params={"upcoming": False}).json() == []
+    assert client.get("/recommendations/users/missing/events").status_code == 404
+
+    # A rebuild from the attendance rows arrives at the same lists
+    incremental = {e: read_neighbours("event", e) for e in events}
+    assert rebuild_recommendations(segments=2)["events"] == 3
+    assert {e: read_neighbours("event", e) for e in events} == incremental
+    client.delete(f"/events/{events[1]}")
+    assert [r["id"] for r in client.get(f"/recommendations/events/{events[0]}/similar").json()] == [events[2]]
+
+
+def test_recommendation_reads_are_bounded_by_fanout(monkeypatch):
+    from app.services import recommendations
+    monkeypatch.setattr(settings.recommend, "fanout", 2)
+    users = [client.post("/users/", json={"firstName": f"Fan{i}", "lastName": "Out", "email": unique_email()}).json()["id"]
+             for i in range(6)]
+    event_id = client.post("/events/", json={
+        "slug": f"fan-{uuid4().hex[:6]}", "title": "Fanout", "owner": users[0],
+        "startAt": datetime.now().isoformat(), "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+    }).json()["id"]
+    for user_id in users[:3]:
+        client.post("/attend/", json={"user_id": user_id, "event_id": event_id})
+
+    reads = []
+    query_pages = recommendations.query_pages
+
+    def counting(**kwargs):
+        reads.append(kwargs["IndexName"])
+        return query_pages(**kwargs)
+    monkeypatch.setattr(recommendations, "query_pages", counting)
+    client.post("/attend/bulk", json={"items": [{"user_id": u, "event_id": event_id} for u in users[3:]]})
+    # One read of the event for the whole request, one per user
+    assert reads.count("EventAttendeesIndex") == 1 and reads.count("UserAttendanceIndex") == 3
+    # The last check-in only paired with the two attendees before it
+    assert set(recommendations.read_neighbours("user", users[5])) == set(users[3:5])
+
+
+def test_query_users_falls_back_to_dynamodb(monkeypatch):
+    from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+    ids = [client.post("/users/", json={"firstName": f"Fall{i}", "lastName": "Back", "email": unique_email(),
+                                        "company": "Fallback Inc", "city": "Lyon" if i else "Nice", "state": "FR"}).json()["id"]
+           for i in range(3)]
+    client.post("/users/", json={"firstName": "Other", "lastName": "Back", "email": unique_email(), "company": "Elsewhere"})
+    event_id = client.post("/events/", json={
+        "slug": f"fb-{uuid4().hex[:6]}", "title": "Fallback", "owner": ids[1],
+        "startAt": datetime.now().isoformat(), "endAt": (datetime.now() + timedelta(hours=1)).isoformat(),
+    }).json()["id"]
+    client.post("/attend/", json={"user_id": ids[2], "event_id": event_id})
+
+    res = client.post("/search/query_users", json={"company": "Fallback Inc"})
+    assert res.headers["X-Search-Engine"] == "opensearch" and res.json()["total"] == 3
+
+    def down(*args, **kwargs):
+        raise OpenSearchConnectionError("N/A", "connection refused", None)
+    monkeypatch.setattr(get_opensearch_client(), "search", down)
+
+    res = client.post("/search/query_users", json={"company": "Fallback Inc", "city": "Lyon", "state": "FR"})
+    assert res.status_code == 200 and res.headers["X-Search-Engine"] == "dynamodb"
+    assert res.json()["total"] == 2
+    assert [u["id"] for u in res.json()["users"]] == sorted(ids[1:])
+    res = client.post("/search/query_users", params={"size": 1, "page": 1, "fields": "company"},
+                      json={"company": "Fallback Inc", "minAttended": 0, "maxHosted": 0})
+    assert res.json()["total"] == 2 and res.json()["users"] == [{"id": max(ids[0], ids[2]), "company": "Fallback Inc"}]
+    # Nothing indexed to start from
+    assert client.post("/search/query_users", json={"minAttended": 1}).status_code == 503
+
+    monkeypatch.setattr(settings.opensearch, "fallback", False)
+    assert client.post("/search/query_users", json={"company": "Fallback Inc"}).status_code == 503
+
+
+def test_opensearch_outage_queues_index_updates(monkeypatch):
+    from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+    from app.services.opensearch.sync import replay
+    os_client = get_opensearch_client()
+    user_id = client.post("/users/", json={"firstName": "Out", "lastName": "Age", "email": unique_email(),
+                                           "company": "Before"}).json()["id"]
+    doomed = client.post("/users/", json={"firstName": "Gone", "lastName": "Age", "email": unique_email(),
+                                          "company": "Doomed Corp"}).json()["id"]
+    calls = []
+
+    def down(*args, **kwargs):
+        calls.append(args)
+        raise OpenSearchConnectionError("N/A", "connection refused", None)
+
+    with monkeypatch.context() as outage:
+        for method in ("index", "update", "delete", "search"):
+            outage.setattr(os_client, method, down)
+        outage.setattr(settings.opensearch, "breaker_failures", 2)
+        for i in range(4):
+            assert client.patch(f"/users/{user_id}", json={"company": f"During {i}"}).status_code == 200
+        # Two failures open the breaker, later writes are queued without calling
+        assert len(calls) == 2 and breaker.state == "open"
+        assert client.delete(f"/users/{doomed}").status_code == 200
+        res = client.post("/search/query_users", json={"company": "During 3"})
+        assert res.headers["X-Search-Engine"] == "dynamodb" and res.json()["total"] == 1
+        assert len(calls) == 2
+        assert client.get("/health/opensearch").json() == {"breaker": "open", "queued": 2}
+
+    # Still open: replay leaves the queue alone until the reset time lets a probe through
+    assert replay()["pending"] == 2
+    monkeypatch.setattr(settings.opensearch, "breaker_reset_seconds", 0)
+    assert replay() == {"replayed": 2, "pending": 0}
+    assert client.get("/health/opensearch").json() == {"breaker": "closed", "queued": 0}
+    res = client.post("/search/query_users", json={"company": "During 3"})
+    assert res.headers["X-Search-Engine"] == "opensearch" and [u["id"] for u in res.json()["users"]] == [user_id]
+    assert client.post("/search/query_users", json={"company": "Doomed Corp"}).json()["total"] == 0
+
+
+def test_rebuild_and_reconcile_users_index():
+    from app.services.opensearch.indices import USERS_INDEX, alias_targets, versioned_index_name
+    from app.services.opensearch.reindex import rebuild_users_index, reconcile_users_index
+    os_client = get_opensearch_client()
+    ids = [client.post("/users/", json={"firstName": f"Re{i}", "lastName": "Index", "email": unique_email(),
+                                        "company": "Reindex Co"}).json()["id"] for i in range(3)]
+    assert versioned_index_name(USERS_INDEX) != versioned_index_name(USERS_INDEX)
+
+    summary = rebuild_users_index(segments=2)
+    assert summary["scanned"] == summary["indexed"] == 3 and summary["errors"] == 0
+    assert alias_targets(os_client, USERS_INDEX) == [summary["index"]]
+    assert summary["reconcile"]["scanned"] == 3 and summary["reconcile"]["fixed"] == 0
+
+    stale = {**os_client.get(index=USERS_INDEX, id=ids[0])["_source"], "company": "Stale Co"}
+    os_client.index(index=USERS_INDEX, id=ids[0], body=stale, refresh=True)
+    os_client.delete(index=USERS_INDEX, id=ids[1], refresh=True)
+    os_client.index(index=USERS_INDEX, id="ghost", body={"id": "ghost", "firstName": "Ghost"}, refresh=True)
+
+    report = reconcile_users_index(segments=2, fix=False)
+    assert (report["mismatched"], report["missing"], report["orphaned"], report["fixed"]) == (1, 1, 1, 0)
+    report = reconcile_users_index(segments=2)
+    assert (report["mismatched"], report["missing"], report["orphaned"], report["fixed"]) == (1, 1, 1, 2)
+    os_client.indices.refresh(index=USERS_INDEX)
+    assert os_client.get(index=USERS_INDEX, id=ids[0])["_source"]["company"] == "Reindex Co"
+    assert os_client.get(index=USERS_INDEX, id=ids[1])["found"]
+    assert not os_client.exists(index=USERS_INDEX, id="ghost")
+    report = reconcile_users_index(segments=2)
+    assert report["scanned"] == 3 and not any(report.get(k) for k in ("mismatched", "missing", "orphaned", "fixed"))
+
+
+def test_replay_keeps_docs_written_during_the_bulk_call(monkeypatch):
+    from app.services.db.session import table
+    from app.services.opensearch import sync
+    from app.services.opensearch.indices import USERS_INDEX
+    os_client = get_opensearch_client()
+    user_id = client.post("/users/", json={"firstName": "Late", "lastName": "Write", "email": unique_email(),
+                                           "company": "Queued"}).json()["id"]
+    sync.enqueue(USERS_INDEX, [user_id])
+
+    # Another worker holds the lease: nothing is replayed
+    table.put_item(Item={**sync.LEASE_KEY, "owner": "other", "leaseUntil": int(time.time()) + 60})
+    assert sync.replay()["replayed"] == 0 and sync.queue_depth() == 1
+    table.delete_item(Key=sync.LEASE_KEY)
+
+    bulk = sync.helpers.bulk
+
+    def racing_bulk(*args, **kwargs):
+        # The write path updates the item and indexes it before the replayed (older) doc lands
+        assert client.patch(f"/users/{user_id}", json={"company": "Newer"}).status_code == 200
+        return bulk(*args, **kwargs)
+
+    with monkeypatch.context() as race:
+        race.setattr(sync.helpers, "bulk", racing_bulk)
+        assert sync.replay() == {"replayed": 0, "pending": 0}
+    assert os_client.get(index=USERS_INDEX, id=user_id)["_source"]["company"] == "Queued"
+    assert sync.queue_depth() == 1
+    assert sync.replay() == {"replayed": 1, "pending": 0}
+    assert os_client.get(index=USERS_INDEX, id=user_id)["_source"]["company"] == "Newer"
+    assert sync.queue_depth() == 0 and "Item" not in table.get_item(Key=sync.LEASE_KEY)
+
+
+class SMTPStandIn(socketserver.StreamRequestHandler):
+    """Just enough SMTP: bounce@ is refused, busy@ is deferred once"""
+    deferred = set()
+    delivered = []
+    connections = 0
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        SMTPStandIn.connections += 1
+        self.reply("220 stand-in")
+        for raw in self.rfile:
+            line = raw.decode().strip()
+            command = line[:4].upper()
+            if command in ("EHLO", "HELO", "MAIL", "RSET", "NOOP"):
+                self.reply("250 ok")
+            elif command == "RCPT":
+                to = line.split(":", 1)[1].strip("<> ")
+                if to.startswith("bounce@"):
+                    self.reply("550 no such user")
+                elif to.startswith("busy@") and to not in self.deferred:
+                    self.deferred.add(to)
+                    self.reply("451 try later")
+                else:
+                    self.rcpt = to
+                    self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 go on")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                SMTPStandIn.delivered.append(self.rcpt)
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+
+
+def test_smtp_sender_pools_retries_and_reports_per_recipient():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    provider = SMTPProvider("127.0.0.1", server.server_address[1], "crm@test.com", pool_size=2)
+    sender = EmailSender(provider, concurrency=2, chunk_size=5, rate_per_second=0, retry_backoff_seconds=0.01)
+    recipients = [f"user{i}@test.com" for i in range(10)] + ["bounce@test.com", "busy@test.com"]
+    try:
+        results = sender.send(recipients, "Hello", "Body")
+    finally:
+        provider.close()
+        server.shutdown()
+        server.server_close()
+
+    assert results.pop("bounce@test.com") == "error"
+    assert set(results.values()) == {"sent"}
+    assert sorted(SMTPStandIn.delivered) == sorted(recipients[:10] + ["busy@test.com"])
+    assert SMTPStandIn.connections <= 2
+
+
+def test_provider_without_send_batch_fails_when_built():
+    from app.services.email_sender import EmailProvider
 
+    class Incomplete(EmailProvider):
+        name = "incomplete"
 
+    with pytest.raises(TypeError):
+        Incomplete()